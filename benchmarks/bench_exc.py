@@ -0,0 +1,66 @@
+"""Compare stack extraction with and without the frame info cache.
+
+Usage (with slowlog installed or on PYTHONPATH)::
+
+    python benchmarks/bench_exc.py
+
+Extracts a 100-frame stack repeatedly, as the monitor thread does when
+it logs a slow request once per interval.
+"""
+
+from slowlog.exc import FrameInfoCache
+from slowlog.exc import extract_stack
+import linecache
+import sys
+import time
+
+
+def uncached_extract_stack(f, limit):
+    """The pre-cache algorithm: stat and look up every frame."""
+    res = []
+    n = 0
+    while f is not None and (limit is None or n < limit):
+        lineno = f.f_lineno
+        co = f.f_code
+        filename = co.co_filename
+        name = co.co_name
+        linecache.checkcache(filename)
+        line = linecache.getline(filename, lineno, f.f_globals)
+        line = line.strip() if line else None
+        res.append((filename, lineno, name, line))
+        if f.f_locals.get('__slowlog_barrier__'):
+            break
+        f = f.f_back
+        n = n + 1
+    res.reverse()
+    return res
+
+
+def recurse(depth, func):
+    if depth:
+        return recurse(depth - 1, func)
+    return func(sys._getframe())
+
+
+def bench(frame, rounds=2000):
+    t = time.time()
+    for _i in range(rounds):
+        uncached_extract_stack(frame, 100)
+    uncached = (time.time() - t) / rounds
+
+    cache = FrameInfoCache()
+    t = time.time()
+    for _i in range(rounds):
+        extract_stack(frame, 100, cache=cache)
+    cached = (time.time() - t) / rounds
+
+    print('%-10s %10.1f usec per 100-frame stack' % ('uncached', uncached * 1e6))
+    print('%-10s %10.1f usec per 100-frame stack' % ('cached', cached * 1e6))
+
+
+def main():
+    recurse(120, bench)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Measure report_framestats on a 100-frame stack.
+
+Usage (with slowlog and perfmetrics installed or on PYTHONPATH)::
+
+    python benchmarks/bench_framestats.py
+
+Compares the current implementation, which caches metric names per code
+object and weights per stack depth, with the previous one, which built
+every string on every report.  Packets are formatted but not sent.
+"""
+
+from perfmetrics.statsd import StatsdClient
+from slowlog.framestats import report_framestats
+import sys
+import time
+
+
+class NullStatsdClient(StatsdClient):
+
+    def _send(self, data):
+        pass
+
+
+def uncached_report_framestats(client, frame, limit=100, max_buf=1000):
+    """The pre-cache algorithm."""
+    f = frame
+    buf = []
+    bytecount = 0
+    count = 0
+    names = []
+    while f is not None and count < limit:
+        modname = f.f_globals.get('__name__', '(module)')
+        co = f.f_code
+        names.append('%s.%s' % (modname, co.co_name))
+        if f.f_locals.get('__slowlog_barrier__'):
+            break
+        f = f.f_back
+        count += 1
+
+    framecount = float(len(names))
+    for i, name in enumerate(names):
+        weight = '%0.3g' % ((framecount - i) / framecount)
+        client.incr('framestats.%s' % name, weight, buf=buf)
+        flat_name = name.replace('.', '_')
+        client.incr('framestats._.%s' % flat_name, weight, buf=buf)
+        size = len(buf[-2]) + len(buf[-1]) + 2
+        bytecount += size
+        if bytecount >= max_buf:
+            client.sendbuf(buf[:-2])
+            del buf[:-2]
+            bytecount = size
+
+    if buf:
+        client.sendbuf(buf)
+
+
+def recurse(depth, func):
+    if depth:
+        return recurse(depth - 1, func)
+    return func(sys._getframe())
+
+
+def bench(frame, rounds=2000):
+    client = NullStatsdClient()
+    for label, func in (('uncached', uncached_report_framestats),
+                        ('cached', report_framestats)):
+        t = time.time()
+        for _i in range(rounds):
+            func(client, frame, 100)
+        elapsed = (time.time() - t) / rounds
+        print('%-10s %10.1f usec per 100-frame stack' % (label, elapsed * 1e6))
+
+
+def main():
+    recurse(120, bench)
+
+
+if __name__ == '__main__':
+    main()
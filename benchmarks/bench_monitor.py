@@ -0,0 +1,78 @@
+"""Compare the cost of a Monitor sweep with the number of reporters.
+
+Usage (with slowlog installed or on PYTHONPATH)::
+
+    python benchmarks/bench_monitor.py
+
+Each sweep happens when a single reporter is due and every other
+reporter is scheduled in the future, which is the common case for a
+busy process: most requests finish long before slowlog_timeout.
+"""
+
+from slowlog.monitor import Monitor
+import sys
+import time
+
+
+class DummyReporter(object):
+    interval = 1.0
+
+    def __init__(self, report_at, ident):
+        self.report_at = report_at
+        self.ident = ident
+
+    def __call__(self, report_time, frame=None):
+        pass
+
+
+def linear_sweep(reporters, report_time, min_interval=0.01):
+    """The pre-heap algorithm: scan every reporter on every wakeup."""
+    timeout_at = report_time + 3600.0
+    frames = None
+    for reporter in reporters:
+        if report_time >= reporter.report_at:
+            if frames is None:
+                frames = sys._current_frames()
+            frame = frames.get(reporter.ident)
+            reporter.report_at = report_time + reporter.interval
+            reporter(report_time, frame)
+        timeout_at = min(timeout_at, reporter.report_at)
+    return max(min_interval, timeout_at - report_time)
+
+
+def bench(count, rounds=2000):
+    # One reporter is due on every sweep (its interval is 1 second);
+    # the rest are scheduled far in the future.
+    now = 1000.0
+    future = now + rounds + 10.0
+    reporters = [DummyReporter(future + i, i) for i in range(count)]
+
+    monitor = Monitor()
+    for reporter in reporters:
+        monitor._add(reporter)
+    monitor._add(DummyReporter(now, -1))
+    t = time.time()
+    for i in range(rounds):
+        monitor.sweep(now + i)
+    heap_cost = (time.time() - t) / rounds
+
+    linear = set(reporters)
+    linear.add(DummyReporter(now, -1))
+    t = time.time()
+    for i in range(rounds):
+        linear_sweep(linear, now + i)
+    linear_cost = (time.time() - t) / rounds
+
+    return heap_cost, linear_cost
+
+
+def main():
+    print('%10s %14s %14s' % ('reporters', 'heap (usec)', 'linear (usec)'))
+    for count in (10, 100, 1000, 10000):
+        heap_cost, linear_cost = bench(count)
+        print('%10d %14.2f %14.2f' % (
+            count, heap_cost * 1e6, linear_cost * 1e6))
+
+
+if __name__ == '__main__':
+    main()
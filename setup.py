@@ -40,5 +40,8 @@ setup(name='slowlog',
       [paste.filter_app_factory]
       slowlog = slowlog.wsgi:make_slowlog
       framestats = slowlog.wsgi:make_framestats
+      combined = slowlog.wsgi:make_combined
+      [console_scripts]
+      slowlog = slowlog.analyze:main
       """,
       )
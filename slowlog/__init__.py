@@ -5,8 +5,25 @@ def includeme(config):
 
     from pyramid.settings import asbool
 
-    if asbool(config.registry.settings.get('slowlog')):
+    settings = config.registry.settings
+    slowlog = asbool(settings.get('slowlog'))
+    framestats = asbool(settings.get('framestats'))
+
+    if slowlog and framestats:
+        # Register one reporter per request for both.
+        config.add_tween('slowlog.tween.CombinedTween')
+
+    elif slowlog:
         config.add_tween('slowlog.tween.SlowLogTween')
 
-    if asbool(config.registry.settings.get('framestats')):
+    elif framestats:
         config.add_tween('slowlog.tween.FrameStatsTween')
+
+    stats_uri = settings.get('slowlog_stats_uri')
+    if stats_uri:
+        # Send the overhead stats of the monitor to Statsd.
+        from perfmetrics import statsd_client_from_uri
+        from slowlog.monitor import StatsReporter
+        from slowlog.monitor import install
+        interval = float(settings.get('slowlog_stats_interval', 60.0))
+        install(StatsReporter(statsd_client_from_uri(stats_uri), interval))
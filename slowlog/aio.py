@@ -0,0 +1,121 @@
+"""Watchdog that logs the stack of a blocked asyncio event loop.
+
+A coroutine that blocks the event loop (with a CPU-bound loop or a
+blocking call) stalls every other request of the loop.  Requires
+Python 3.7 or later.
+"""
+
+from perfmetrics import statsd_client_from_uri
+from slowlog.compat import StringIO
+from slowlog.compat import get_ident
+from slowlog.exc import print_frames
+from slowlog.exc import walk_stack
+from slowlog.framestats import send_names
+from slowlog.framestats import stack_names
+from slowlog.logfile import make_file_logger
+from slowlog.monitor import get_monitor
+from slowlog.monitor import install
+from slowlog.monitor import uninstall
+import asyncio
+import logging
+import time
+
+blocked_metric = 'slowlog.loop_blocked'
+
+
+class LoopWatchdog(object):
+    """Log the stack of an event loop thread that stops running callbacks.
+
+    start() schedules a heartbeat on the loop: every beat_interval
+    seconds, the loop records the time in a call_later() callback.  The
+    watchdog is also a reporter installed in the monitor (see
+    slowlog.monitor.install).  When the monitor thread finds the
+    heartbeat late by threshold seconds or more, the watchdog logs the
+    stack of the loop thread once, and logs how long the loop was
+    blocked when the heartbeat resumes.  If statsd_uri is given, it
+    also sends the framestats counters of the stack and the blocked
+    time (in milliseconds) to Statsd.
+    """
+    ident = None  # The thread of the loop, set by the first heartbeat
+    beat_at = None  # The time of the latest heartbeat
+    blocked_since = None  # beat_at when the current stall was logged
+    running = False
+
+    def __init__(self, threshold=0.1, logfile=None, frame_limit=100,
+                 statsd_uri=None):
+        self.threshold = threshold
+        self.beat_interval = threshold / 2.0
+        self.interval = threshold / 2.0
+        self.report_at = 0
+        self.frame_limit = frame_limit
+        if logfile:
+            self.log = make_file_logger(logfile)
+        else:
+            self.log = logging.getLogger('slowlog')
+        if statsd_uri:
+            self.client = statsd_client_from_uri(statsd_uri)
+        else:
+            self.client = None
+        self.loop = None
+
+    def start(self, loop=None):
+        """Start the heartbeat on a loop and install the watchdog.
+
+        Uses the current event loop if no loop is given.  May be called
+        from any thread.
+        """
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.running = True
+        loop.call_soon_threadsafe(self.beat)
+        install(self)
+        get_monitor()
+
+    def stop(self):
+        """Uninstall the watchdog and stop the heartbeat."""
+        self.running = False
+        uninstall(self)
+        self.beat_at = None
+
+    def beat(self):
+        """Record a heartbeat.  Called by the event loop."""
+        if not self.running:
+            return
+        self.beat_at = time.time()
+        if self.ident is None:
+            self.ident = get_ident()
+        self.loop.call_later(self.beat_interval, self.beat)
+
+    def __call__(self, report_time, frame=None):
+        beat_at = self.beat_at
+        if beat_at is None:
+            return
+        blocked_since = self.blocked_since
+        if blocked_since is not None:
+            if beat_at == blocked_since:
+                # Still blocked; the stack has been logged.
+                return
+            self.blocked_since = None
+            self.report_end(beat_at - blocked_since - self.beat_interval)
+
+        blocked = report_time - beat_at - self.beat_interval
+        if blocked >= self.threshold and frame is not None:
+            self.blocked_since = beat_at
+            self.report_blocked(blocked, walk_stack(frame, self.frame_limit))
+
+    def report_blocked(self, blocked, stack):
+        """Report the stack of the blocked loop, innermost first."""
+        if self.client is not None:
+            send_names(self.client, stack_names(stack))
+        tb = StringIO()
+        print_frames(stack, tb)
+        self.log.warning("Event loop thread %s: Blocked for %.3f secs\n"
+                         "Traceback:\n%s", self.ident, blocked, tb.getvalue())
+
+    def report_end(self, blocked):
+        """Report the total time of a stall after the loop resumed."""
+        if self.client is not None:
+            self.client.timing(blocked_metric, int(round(blocked * 1000)))
+        self.log.warning("Event loop thread %s: Unblocked after %.3f secs",
+                         self.ident, blocked)
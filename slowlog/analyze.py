@@ -0,0 +1,361 @@
+"""Summarize slowlog files.
+
+Usage::
+
+    slowlog [-n TOP] [-j JOBS] [--no-rotated] LOGFILE [LOGFILE ...]
+
+Reads the reports written by TweenRequestLogger and SlowRequestLogger in
+either the text or the JSON-lines format, including the rotated
+(LOGFILE.1, LOGFILE.2.gz, ...) files next to each LOGFILE, and prints
+the URLs, innermost frames and full stacks that appear in the most
+reports.  When the logs include CPU times (the slowlog_cpu setting), it
+also prints the URLs of the completed slow requests that used the most
+CPU time, with their CPU and wait times.  Memory use is bounded by the
+--capacity of each table rather than by the size of the input.
+"""
+
+from heapq import nlargest
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+
+
+header_re = re.compile(
+    r'Thread (\S+): Started on ([\d.]+); Running for ([\d.]+) secs; '
+    r'request: (\S+) (\S*)')
+other_re = re.compile(
+    r'  thread (\S+): running for ([\d.]+) secs; request: (\S+) (\S*)$')
+finish_re = re.compile(
+    r'Thread (\S+): Started on ([\d.]+); Finished after ([\d.]+) secs; '
+    r'request: (\S+) (\S*); .*; cpu: ([\d.]+) secs; wait: ([\d.]+) secs')
+frame_re = re.compile(r'\s+File "(.*)", line (\d+), in (.*)$')
+diff_re = re.compile(r'Traceback \(after (\d+) unchanged frames\):$')
+unchanged_re = re.compile(r'Stack unchanged for [\d.]+ secs$')
+rotated_re = re.compile(r'\.(\d+)(\.gz)?$')
+
+
+class TopCounter(object):
+    """Count keys in bounded space, keeping the most frequent keys.
+
+    When the number of keys exceeds twice the capacity, only the
+    capacity most frequent keys are kept.  The counts of keys that
+    survive are exact if no key was ever dropped; otherwise a count
+    may be low by at most the dropped attribute.
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.counts = {}
+        self.dropped = 0  # The largest count dropped so far
+
+    def add(self, key, amount=1):
+        counts = self.counts
+        counts[key] = counts.get(key, 0) + amount
+        if len(counts) > 2 * self.capacity:
+            self.prune()
+
+    def prune(self):
+        counts = self.counts
+        keep = nlargest(self.capacity, counts.items(), key=lambda x: x[1])
+        if len(keep) < len(counts):
+            self.dropped = max(self.dropped, keep[-1][1])
+        self.counts = dict(keep)
+
+    def update(self, other):
+        """Add the counts of another TopCounter."""
+        for key, amount in other.counts.items():
+            self.add(key, amount)
+        self.dropped = max(self.dropped, other.dropped)
+
+    def top(self, n):
+        """List the n most frequent (key, count) pairs."""
+        return nlargest(n, self.counts.items(), key=lambda x: x[1])
+
+
+class Summary(object):
+    """Report counts by URL, innermost frame and stack signature.
+
+    Also sums the CPU and wait seconds of completed requests by URL.
+    """
+
+    def __init__(self, capacity=10000):
+        self.reports = 0
+        self.urls = TopCounter(capacity)
+        self.frames = TopCounter(capacity)
+        self.stacks = TopCounter(capacity)
+        self.finished = 0
+        self.cpu = TopCounter(capacity)
+        self.wait = TopCounter(capacity)
+
+    def add(self, method, url, frames):
+        """Add a report.
+
+        frames is a list of (filename, lineno, name), outermost first.
+        """
+        self.reports += 1
+        self.urls.add('%s %s' % (method, url))
+        if frames:
+            names = ['%s:%s(%s)' % frame for frame in reversed(frames)]
+            self.frames.add(names[0])
+            self.stacks.add(' < '.join(names))
+
+    def add_finished(self, method, url, cpu, wait):
+        """Add the CPU and wait seconds of a completed request."""
+        self.finished += 1
+        key = '%s %s' % (method, url)
+        self.cpu.add(key, cpu)
+        self.wait.add(key, wait)
+
+    def update(self, other):
+        self.reports += other.reports
+        self.urls.update(other.urls)
+        self.frames.update(other.frames)
+        self.stacks.update(other.stacks)
+        self.finished += other.finished
+        self.cpu.update(other.cpu)
+        self.wait.update(other.wait)
+
+
+def parse_reports(lines, finished=None):
+    """Generate (method, url, frames) for each report in a log.
+
+    Accepts both the text format (a header line followed by traceback
+    lines) and the JSON-lines format.  In the text format, only the
+    frames after the Traceback: line count; other stacks (such as a
+    flight recorder timeline) are ignored.  A report that lists other
+    requests with the same stack counts as a report of each of them.
+    If given, finished is called with (method, url, cpu, wait) for each
+    completion summary that includes CPU time.
+
+    Reports in the compact format (the slowlog_compact setting) list
+    only the frames that changed since the previous report of the same
+    request; their full stacks are rebuilt from the earlier reports.
+    The reports of the event loop watchdog (slowlog.aio) are skipped.
+    """
+    current = []  # Reports sharing the frames of the current text report
+    key = None  # (thread, start) of the current text report
+    in_traceback = False
+    stacks = {}  # {(thread, start): frames of the latest report}
+    for line in lines:
+        if line.startswith('{'):
+            for report in current:
+                yield report
+            current = []
+            try:
+                report = json.loads(line)
+            except ValueError:
+                continue
+            if report.get('finished'):
+                # Completion summary, not a report.
+                if finished is not None and 'cpu' in report:
+                    finished(report.get('method'), report.get('url'),
+                             report['cpu'], report.get('wait', 0.0))
+                continue
+            frames = [(frame['file'], frame['line'], frame['name'])
+                      for frame in report.get('frames') or ()]
+            report_key = (report.get('thread'), report.get('start'))
+            if 'common' in report or 'unchanged' in report:
+                base = stacks.get(report_key, ())
+                frames = list(base[:report.get('common')]) + frames
+            if frames:
+                remember_stack(stacks, report_key, frames)
+            yield report.get('method'), report.get('url'), frames
+            for other in report.get('others') or ():
+                yield other.get('method'), other.get('url'), frames
+            continue
+
+        if finished is not None and 'Finished after' in line:
+            mo = finish_re.search(line)
+            if mo is not None:
+                finished(mo.group(4), mo.group(5), float(mo.group(6)),
+                         float(mo.group(7)))
+                continue
+
+        mo = header_re.search(line)
+        if mo is not None:
+            for report in current:
+                yield report
+            current = [(mo.group(4), mo.group(5), [])]
+            key = (mo.group(1), mo.group(2))
+            in_traceback = False
+            continue
+
+        if 'Event loop thread ' in line:
+            # A watchdog report, not a request.
+            for report in current:
+                yield report
+            current = []
+            continue
+
+        if not current:
+            continue
+        if line == 'Traceback:':
+            in_traceback = True
+            remember_stack(stacks, key, current[0][2])
+        elif line.startswith('Traceback (') or line.startswith('Stack '):
+            mo = diff_re.match(line)
+            if mo is not None:
+                in_traceback = True
+                depth = int(mo.group(1))
+            elif unchanged_re.match(line):
+                depth = None
+            else:
+                continue
+            frames = current[0][2]
+            frames.extend(stacks.get(key, ())[:depth])
+            remember_stack(stacks, key, frames)
+        elif in_traceback:
+            mo = frame_re.match(line)
+            if mo is not None:
+                current[0][2].append(
+                    (mo.group(1), int(mo.group(2)), mo.group(3)))
+        else:
+            mo = other_re.match(line)
+            if mo is not None:
+                current.append((mo.group(3), mo.group(4), current[0][2]))
+
+    for report in current:
+        yield report
+
+
+def remember_stack(stacks, key, frames, capacity=10000):
+    """Keep the frames of a request for its next compact report."""
+    if key not in stacks and len(stacks) >= capacity:
+        stacks.clear()
+    stacks[key] = frames
+
+
+def read_lines(path):
+    """Generate the decoded lines of a log file, gzipped or not."""
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'rb')
+    else:
+        f = open(path, 'rb')
+    try:
+        for line in f:
+            yield line.decode('utf-8', 'replace').rstrip('\r\n')
+    finally:
+        f.close()
+
+
+def expand_paths(paths, rotated=True):
+    """List the given log files and, optionally, their rotated files."""
+    res = []
+    seen = set()
+    for path in paths:
+        names = [path]
+        if rotated:
+            dirname, basename = os.path.split(path)
+            try:
+                siblings = os.listdir(dirname or os.curdir)
+            except OSError:
+                siblings = ()
+            names.extend(sorted(
+                (os.path.join(dirname, name) for name in siblings
+                 if name.startswith(basename) and
+                 rotated_re.match(name[len(basename):])),
+                key=rotation_number))
+        for name in names:
+            if name not in seen and os.path.isfile(name):
+                seen.add(name)
+                res.append(name)
+    return res
+
+
+def rotation_number(name):
+    return int(rotated_re.search(name).group(1))
+
+
+def summarize_file(args):
+    """Summarize one log file.  Called in worker processes."""
+    path, capacity = args
+    summary = Summary(capacity)
+    lines = read_lines(path)
+    for method, url, frames in parse_reports(lines, summary.add_finished):
+        summary.add(method, url, frames)
+    return summary
+
+
+def summarize(paths, capacity=10000, jobs=1):
+    """Summarize the given log files, using up to jobs processes."""
+    summary = Summary(capacity)
+    tasks = [(path, capacity) for path in paths]
+    if jobs > 1 and len(tasks) > 1:
+        from multiprocessing import Pool
+        pool = Pool(min(jobs, len(tasks)))
+        try:
+            for part in pool.imap_unordered(summarize_file, tasks):
+                summary.update(part)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            summary.update(summarize_file(task))
+    return summary
+
+
+def print_table(title, counter, n, out):
+    out.write('%s\n' % title)
+    out.write('%10s  %s\n' % ('reports', 'key'))
+    for key, count in counter.top(n):
+        out.write('%10d  %s\n' % (count, key))
+    if counter.dropped:
+        out.write('(counts may be low by up to %d)\n' % counter.dropped)
+    out.write('\n')
+
+
+def print_cpu_table(summary, n, out):
+    out.write('Top URLs by CPU time (%d completed requests)\n'
+              % summary.finished)
+    out.write('%10s  %10s  %5s  %s\n' % ('cpu secs', 'wait secs', 'cpu%',
+                                          'key'))
+    wait = summary.wait.counts
+    for key, cpu in summary.cpu.top(n):
+        total = cpu + wait.get(key, 0.0)
+        share = 100.0 * cpu / total if total else 0.0
+        out.write('%10.2f  %10.2f  %5.1f  %s\n' % (
+            cpu, wait.get(key, 0.0), share, key))
+    out.write('\n')
+
+
+def main(argv=None, out=None):
+    """Entry point of the slowlog command."""
+    parser = argparse.ArgumentParser(
+        prog='slowlog',
+        description='Summarize the reports in slowlog files.')
+    parser.add_argument('logfiles', nargs='+', metavar='LOGFILE')
+    parser.add_argument('-n', '--top', type=int, default=20,
+                        help='Rows to show per table (default 20)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Worker processes (default: one per CPU)')
+    parser.add_argument('--capacity', type=int, default=10000,
+                        help='Keys to keep per table (default 10000)')
+    parser.add_argument('--no-rotated', dest='rotated',
+                        action='store_false',
+                        help='Do not read rotated files')
+    args = parser.parse_args(argv)
+    if out is None:
+        out = sys.stdout
+
+    paths = expand_paths(args.logfiles, rotated=args.rotated)
+    jobs = args.jobs
+    if jobs is None:
+        from multiprocessing import cpu_count
+        jobs = cpu_count()
+    summary = summarize(paths, capacity=args.capacity, jobs=jobs)
+
+    out.write('%d reports in %d files\n\n' % (summary.reports, len(paths)))
+    print_table('Top URLs', summary.urls, args.top, out)
+    print_table('Top innermost frames', summary.frames, args.top, out)
+    print_table('Top stacks', summary.stacks, args.top, out)
+    if summary.finished:
+        print_cpu_table(summary, args.top, out)
+    return 0
+
+
+if __name__ == '__main__':  # pragma no cover
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""ASGI middleware that monitors the asyncio task of each request.
+
+Under asyncio, many requests share the event loop thread, so the stack
+of the thread does not tell which request is slow.  The middleware
+registers the task of each HTTP request in a monitor slot, and the
+reporters walk the await chain of the task (cr_frame and cr_await)
+instead of the stack of the thread.  Requires Python 3.7 or later.
+"""
+
+from asyncio import current_task
+from perfmetrics import statsd_client_from_uri
+from slowlog.compat import get_ident
+from slowlog.exc import add_barrier
+from slowlog.framestats import FrameStatsAggregator
+from slowlog.framestats import FrameStatsReporter
+from slowlog.logfile import make_file_logger
+from slowlog.monitor import get_monitor
+from slowlog.monitor import install
+from slowlog.monitor import make_backoff
+from slowlog.wsgi import SlowRequestLogger
+import logging
+import time
+
+
+class TaskFrame(object):
+    """A stand-in for a frame in the await chain of a task.
+
+    The frames of suspended coroutines have no f_back, so TaskFrame
+    links them from the innermost awaited coroutine out to the
+    coroutine of the task.  Stack walkers such as walk_stack() read
+    TaskFrames like the frames of a thread.  f_lineno is read once, so
+    the line does not change while the stack is reported.
+    """
+    __slots__ = ('frame', 'f_back', 'f_lineno')
+
+    def __init__(self, frame, f_back):
+        self.frame = frame
+        self.f_back = f_back
+        self.f_lineno = frame.f_lineno
+
+    @property
+    def f_code(self):
+        return self.frame.f_code
+
+    @property
+    def f_globals(self):
+        return self.frame.f_globals
+
+    @property
+    def f_locals(self):
+        return self.frame.f_locals
+
+
+def task_frame(task, thread_frame=None):
+    """Get the innermost frame of a task as a TaskFrame, or None.
+
+    If the task is running, thread_frame (the current frame of the
+    event loop thread) adds the frames the innermost coroutine called.
+    Returns None if the task is done.
+    """
+    get_coro = getattr(task, 'get_coro', None)
+    coro = get_coro() if get_coro is not None else task._coro
+    chain = []  # Outermost first
+    running = False
+    while coro is not None:
+        frame = (getattr(coro, 'cr_frame', None) or
+                 getattr(coro, 'gi_frame', None) or
+                 getattr(coro, 'ag_frame', None))
+        if frame is None:
+            # A Future or a finished coroutine.
+            break
+        chain.append(frame)
+        running = (getattr(coro, 'cr_running', False) or
+                   getattr(coro, 'gi_running', False) or
+                   getattr(coro, 'ag_running', False))
+        coro = (getattr(coro, 'cr_await', None) or
+                getattr(coro, 'gi_yieldfrom', None) or
+                getattr(coro, 'ag_await', None))
+
+    if not chain:
+        return None
+
+    if running and thread_frame is not None:
+        innermost = chain[-1]
+        called = []
+        f = thread_frame
+        while f is not None and f is not innermost:
+            called.append(f)
+            f = f.f_back
+        if f is innermost:
+            chain.extend(reversed(called))
+        f = None  # Free memory
+
+    res = None
+    for frame in chain:
+        res = TaskFrame(frame, res)
+    return res
+
+
+def scope_environ(scope):
+    """Convert an ASGI HTTP scope to a WSGI environ for SlowRequestLogger.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope.get('method', 'GET'),
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope.get('path', ''),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+    }
+    for name, value in scope.get('headers', ()):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        if key in environ:
+            value = '%s,%s' % (environ[key], value)
+        environ[key] = value
+    return environ
+
+
+class MonitoredMiddleware(object):
+    """Base class of ASGI middleware that registers requests' tasks.
+
+    The task of each HTTP request publishes a slot, which costs a dict
+    assignment on the event loop; the monitor creates a reporter only
+    for requests that are still running at report_at.  Other scope
+    types (websocket and lifespan) are not monitored.
+    Subclasses provide create_reporter().
+    """
+    summarize = False  # Capture the status for reporters with finish()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        monitor = self.get_monitor()
+        key = (current_task(), self)
+        slots = monitor.slots
+        if key in slots:
+            # Nested call in the same task.
+            await self.app(scope, receive, send)
+            return
+        now = time.time()
+        report_at = now + self.timeout
+        slot = slots[key] = (report_at, now, (scope, get_ident()))
+        if report_at < monitor.wake_at:
+            monitor.wake()
+
+        if self.summarize:
+            status = []
+            next_send = send
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                await next_send(message)
+        else:
+            status = None
+
+        try:
+            await self.app(scope, receive, send)
+        except BaseException as e:
+            # Include CancelledError: the client went away.
+            if status is not None:
+                status.append(type(e).__name__)
+            raise
+        finally:
+            reporter = monitor.get_slot_reporter(key, slot)
+            del slots[key]
+            if (status is not None and reporter is not None and
+                    reporter.report_count):
+                reporter.finish(time.time(), status[-1] if status else None)
+
+    def make_reporter(self, context, start, report_at, task):
+        """Create a reporter for the task of a slow request."""
+        scope, ident = context
+        return self.create_reporter(scope, start, report_at, ident, task)
+
+
+add_barrier(MonitoredMiddleware.__call__)
+
+
+class FrameStatsMiddleware(MonitoredMiddleware):
+    """ASGI middleware that logs the frames of slow requests to statsd.
+
+    The asyncio counterpart of slowlog.wsgi.FrameStatsApp.
+    """
+
+    def __init__(self, app, statsd_uri, timeout=2.0, interval=1.0,
+                 frame_limit=100, flush_interval=0):
+        self.app = app
+        self.client = statsd_client_from_uri(statsd_uri)
+        self.timeout = timeout
+        self.interval = interval
+        self.frame_limit = frame_limit
+        if flush_interval > 0:
+            self.aggregator = FrameStatsAggregator(self.client, flush_interval)
+            install(self.aggregator)
+        else:
+            self.aggregator = None
+        self.get_monitor = get_monitor  # test hook
+
+    def create_reporter(self, _scope, _start, report_at, ident, task):
+        return TaskFrameStatsReporter(task, self.client, report_at,
+                                      self.interval, self.frame_limit, ident,
+                                      aggregator=self.aggregator)
+
+
+class SlowLogMiddleware(MonitoredMiddleware):
+    """ASGI middleware that logs slow requests.
+
+    The asyncio counterpart of slowlog.wsgi.SlowLogApp.  The flight
+    recorder and CPU times are not available: they sample threads, and
+    the tasks of the event loop share one thread.
+    """
+    summarize = True
+    recorder = None
+    cpu = False
+
+    def __init__(self, app, timeout=2.0, interval=1.0, logfile=None,
+                 frame_limit=100,
+                 hide_env=('HTTP_COOKIE', 'HTTP_AUTHORIZATION'),
+                 logfile_queued=False, logfile_queue_size=1000,
+                 format='text',  # @ReservedAssignment
+                 backoff=1.0, max_interval=0, max_reports=0,
+                 coalesce=False, compact=False):
+        self.app = app
+        self.timeout = timeout
+        self.interval = interval
+        self.frame_limit = frame_limit
+        self.format = format
+        if logfile:
+            self.log = make_file_logger(logfile, queued=logfile_queued,
+                                        queue_size=logfile_queue_size,
+                                        format=format)
+        else:
+            self.log = logging.getLogger('slowlog')
+        self.hide_env = hide_env
+        self.backoff = make_backoff(backoff, max_interval, max_reports)
+        self.coalesce = coalesce
+        self.compact = compact
+        self.get_monitor = get_monitor  # test hook
+
+    def create_reporter(self, scope, start, report_at, ident, task):
+        return TaskRequestLogger(self, scope, start, report_at, ident, task)
+
+
+class TaskRequestLogger(SlowRequestLogger):
+    """Logger for a request handled by an asyncio task.
+
+    ident is the thread of the event loop.
+    """
+
+    def __init__(self, app, scope, start, report_at, ident, task):
+        SlowRequestLogger.__init__(self, app, scope_environ(scope), start,
+                                   report_at, ident)
+        self.task = task
+
+    def get_frame(self, thread_frame):
+        return task_frame(self.task, thread_frame)
+
+
+class TaskFrameStatsReporter(FrameStatsReporter):
+    """FrameStatsReporter for a request handled by an asyncio task."""
+
+    def __init__(self, task, *args, **kw):
+        FrameStatsReporter.__init__(self, *args, **kw)
+        self.task = task
+
+    def get_frame(self, thread_frame):
+        return task_frame(self.task, thread_frame)
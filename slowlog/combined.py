@@ -0,0 +1,129 @@
+from slowlog.compat import GreenletReporter
+from slowlog.exc import walk_stack
+from slowlog.monitor import align_time
+from slowlog.stats import monitor_stats
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class CombinedReporter(GreenletReporter):
+    """Reporter that drives several reporters for the same thread.
+
+    Registering one CombinedReporter instead of each reporter halves
+    the monitor traffic of a request that is both logged and counted.
+    Each reporter keeps its own report_at and interval.  When any of
+    them is due, the stack is walked once, up to frame_limit frames,
+    and passed to the report_stack() method of each due reporter.
+    Reporters that set their interval to None are not called again.
+    When the request completes, finish() passes the summary to the
+    reporters that reported the request and accept a summary.
+
+    If one of the reporters coalesces (see
+    slowlog.monitor.CoalescingReporterInterface), so does the combined
+    reporter, with the same coalesce key.  The reports of all the
+    reporters are then scheduled on multiples of their intervals.
+    """
+    barrier = None
+    coalesce = None
+    logger = None  # The coalescing reporter, if any
+
+    def __init__(self, reporters, frame_limit=100, ident=None):
+        self.reporters = reporters
+        self.frame_limit = frame_limit
+        self.set_ident(ident)
+        for reporter in reporters:
+            if getattr(reporter, 'coalesce', None) is not None:
+                self.logger = reporter
+                self.coalesce = reporter.coalesce
+                break
+        if self.coalesce is not None:
+            for reporter in reporters:
+                reporter.report_at = align_time(reporter.report_at,
+                                                reporter.interval)
+        self.report_at = min(r.report_at for r in reporters)
+        self.interval = min(r.interval for r in reporters)
+
+    def __call__(self, report_time, frame=None):
+        stack = None
+        if frame is not None:
+            stack = self.walk(frame)
+            del frame
+        self.report_parts(report_time, stack)
+        self.schedule()
+
+    def walk(self, frame):
+        """List the frames of the thread, innermost first."""
+        return walk_stack(frame, self.frame_limit, self.barrier)
+
+    def report_group(self, report_time, stack, others):
+        """Report the stack of this request and of the other requests.
+
+        The due coalescing reporters log one report together; the
+        other reporters get the stack of each request as usual.
+        """
+        combined = [self] + list(others)
+        loggers = []
+        for reporter in combined:
+            reporter.report_parts(report_time, stack, loggers)
+        if loggers:
+            self.call_part(loggers[0], 'report_group',
+                           report_time, stack, loggers[1:])
+        for reporter in combined:
+            reporter.schedule()
+
+    def report_parts(self, report_time, stack, loggers=None):
+        """Pass the stack to the reporters that are due.
+
+        If loggers is a list, a due coalescing reporter is appended to
+        it instead of called.
+        """
+        for reporter in self.reporters:
+            if reporter.interval is None:
+                # The reporter stopped reporting.
+                continue
+            if reporter.report_at <= report_time:
+                if self.coalesce is None:
+                    reporter.report_at = report_time + reporter.interval
+                else:
+                    reporter.report_at = align_time(
+                        report_time + reporter.interval / 2.0,
+                        reporter.interval)
+                if loggers is not None and reporter is self.logger:
+                    loggers.append(reporter)
+                else:
+                    self.call_part(reporter, 'report_stack',
+                                   report_time, stack)
+
+    def call_part(self, reporter, name, *args):
+        """Call a method of a reporter and count and log its errors."""
+        try:
+            getattr(reporter, name)(*args)
+        except Exception:
+            monitor_stats.errors += 1
+            log.exception("Error in reporter %s", reporter)
+
+    def schedule(self):
+        """Schedule the next report of the reporters that continue."""
+        report_at = None
+        for reporter in self.reporters:
+            if reporter.interval is None:
+                continue
+            if report_at is None or reporter.report_at < report_at:
+                report_at = reporter.report_at
+        if report_at is None:
+            # All of the reporters stopped; so does this one.
+            self.interval = None
+        else:
+            # Override the schedule the monitor set before the report.
+            self.report_at = report_at
+
+    @property
+    def report_count(self):
+        """The number of reports made by reporters that log summaries."""
+        return sum(getattr(r, 'report_count', 0) for r in self.reporters)
+
+    def finish(self, end_time, status):
+        for reporter in self.reporters:
+            if getattr(reporter, 'report_count', 0):
+                reporter.finish(end_time, status)
@@ -1,18 +1,161 @@
-
+from collections import deque
 import sys
+import time
 
 if sys.version_info[0] >= 3:  # pragma no cover
     # Python 3
-    from _thread import get_ident
+    from _thread import error as ThreadError
     from io import StringIO
     from queue import Empty
+    from queue import Full
     from queue import Queue
     from urllib.parse import quote
+    thread_module = '_thread'
 
 else:  # pragma no cover
     # Python 2
-    from thread import get_ident
+    from thread import error as ThreadError
     from cStringIO import StringIO
     from Queue import Empty
+    from Queue import Full
     from Queue import Queue
     from urllib import quote
+    thread_module = 'thread'
+
+
+def get_original(module_name, name):
+    """Get a function of a module as it was before gevent patched it."""
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is not None:
+        return monkey.get_original(module_name, name)
+    return getattr(__import__(module_name), name)
+
+
+# Under gevent, the patched functions identify greenlets, not threads.
+get_ident = get_original(thread_module, 'get_ident')
+allocate_lock = get_original(thread_module, 'allocate_lock')
+start_new_thread = get_original(thread_module, 'start_new_thread')
+
+
+def use_native_thread():
+    """Return true if the monitor should bypass the threading module.
+
+    gevent's patched threading module runs threads as greenlets, which
+    do not run while another greenlet keeps the hub busy.  Requires
+    Python 3, where native locks can wait with a timeout.
+    """
+    monkey = sys.modules.get('gevent.monkey')
+    return (monkey is not None and sys.version_info[0] >= 3 and
+            monkey.is_module_patched('threading'))
+
+
+class NativeQueue(object):
+    """A queue whose get() blocks a native thread under gevent.
+
+    Waits on a lock from allocate_lock, which gevent does not patch.
+    Provides only what the monitor uses: put() from any thread and
+    get() from a single consumer.
+    """
+
+    def __init__(self):
+        self.items = deque()
+        self.ready = allocate_lock()
+        self.ready.acquire()  # Released when items may be available
+
+    def put(self, item):
+        self.items.append(item)
+        try:
+            self.ready.release()
+        except ThreadError:
+            # Already released.
+            pass
+
+    def get(self, block=True, timeout=None):
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            try:
+                return self.items.popleft()
+            except IndexError:
+                pass
+            if not block:
+                raise Empty()
+            if timeout is None:
+                self.ready.acquire()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.ready.acquire(True, remaining):
+                    raise Empty()
+
+
+def get_greenlet():
+    """Get the current greenlet, or None outside of spawned greenlets.
+
+    Returns None if the greenlet module is not loaded or the caller runs
+    in the main greenlet of its thread.
+    """
+    greenlet = sys.modules.get('greenlet')
+    if greenlet is None:
+        return None
+    current = greenlet.getcurrent()
+    if current.parent is None:
+        return None
+    return current
+
+
+def get_request_ident():
+    """Get the ident of the current request.
+
+    That is the thread ident, or (thread ident, greenlet) in a spawned
+    greenlet, since the greenlets of a thread handle different requests.
+    """
+    glet = get_greenlet()
+    if glet is None:
+        return get_ident()
+    return (get_ident(), glet)
+
+
+def split_ident(ident=None):
+    """Split a request ident into (thread ident, greenlet or None).
+
+    If ident is None, uses the ident of the current request.
+    """
+    if ident is None:
+        ident = get_request_ident()
+    if isinstance(ident, tuple):
+        return ident
+    return ident, None
+
+
+def greenlet_frame(glet, thread_frame):
+    """Get the innermost frame of a greenlet, or None if it is not active.
+
+    A suspended greenlet keeps its frame in gr_frame.  The greenlet
+    running in its thread has no gr_frame; its frame is thread_frame.
+    """
+    frame = glet.gr_frame
+    if frame is not None:
+        return frame
+    if not glet:
+        # Not started yet, or dead.
+        return None
+    return thread_frame
+
+
+class GreenletReporter(object):
+    """Mixin for the reporter of a request that may run in a greenlet.
+
+    set_ident() splits the ident of the request, and get_frame() then
+    gets the frame of the request's greenlet, if any.
+    """
+    greenlet = None  # The greenlet of the request, if any
+
+    def set_ident(self, ident=None):
+        """Set the thread ident and greenlet of the request."""
+        self.ident, self.greenlet = split_ident(ident)
+
+    def get_frame(self, thread_frame):
+        """Get the frame of the request's greenlet, if any."""
+        if self.greenlet is None:
+            return thread_frame
+        return greenlet_frame(self.greenlet, thread_frame)
@@ -0,0 +1,58 @@
+"""Per-thread CPU clocks.
+
+On Linux and other platforms that provide pthread_getcpuclockid(), the
+monitor thread can read the CPU clock of a request thread, which tells
+whether a slow request is using the CPU (and holding the GIL) or
+waiting for something else, such as the database.  The thread idents
+from get_ident() are pthread IDs on those platforms.
+
+On other platforms the functions return None and the reports omit the
+CPU time.
+"""
+
+import time
+
+_clock_gettime = getattr(time, 'clock_gettime', None)
+_getcpuclockid = getattr(time, 'pthread_getcpuclockid', None)
+_thread_time = getattr(time, 'thread_time', None)
+
+available = (_clock_gettime is not None and _getcpuclockid is not None and
+             _thread_time is not None)
+
+
+def thread_time():
+    """Get the CPU seconds used by the current thread, or None."""
+    if not available:
+        return None
+    return _thread_time()
+
+
+def thread_cpu_time(ident):
+    """Get the CPU seconds used by another thread, or None.
+
+    The thread must be running: the pthread ID of a finished thread is
+    not safe to use.  Reporters call this only when the monitor found a
+    frame for the thread.
+    """
+    if not available:
+        return None
+    try:
+        return _clock_gettime(_getcpuclockid(ident))
+    except (OSError, OverflowError, ValueError):
+        return None
+
+
+def cpu_split(ident, cpu_start, elapsed):
+    """Split the elapsed wall time of a request into (cpu, wait) seconds.
+
+    cpu_start is the reading of thread_time() in the request thread
+    when the request started.  Returns None if cpu_start is None or the
+    CPU clock of the thread is not available.
+    """
+    if cpu_start is None:
+        return None
+    cpu_now = thread_cpu_time(ident)
+    if cpu_now is None:
+        return None
+    cpu = max(0.0, cpu_now - cpu_start)
+    return cpu, max(0.0, elapsed - cpu)
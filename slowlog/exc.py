@@ -1,32 +1,187 @@
+"""Stack formatter that stops at a barrier frame.
 
-"""Stack formatter that stops at __slowlog_barrier__."""
+The frames of registered barrier functions (see add_barrier) end the
+stack.  As a fallback, so does any frame with a true local variable
+named __slowlog_barrier__.
+"""
 
-import traceback
+from slowlog.stats import monitor_stats
 import linecache
+import os
+import time
+import traceback
 
 
-def print_stack(f, limit,
-                file):  # @ReservedAssignment
-    """Print the stack trace of a frame."""
-    traceback.print_list(extract_stack(f, limit), file)
+class CodeCache(object):
+    """Bounded cache of values computed for code objects.
 
+    Keys start with the id of the code object.  The cache is cleared
+    when it grows beyond maxsize entries.
+    """
 
-def extract_stack(f, limit):
-    """Extract the raw traceback from the current stack frame."""
-    res = []
-    n = 0
-    while f is not None and (limit is None or n < limit):
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.entries = {}  # {key: (code, value)}
+
+    def lookup(self, co, key):
+        """Get the value stored for a code object, or None."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is co:
+            return entry[1]
+        return None
+
+    def store(self, co, key, value):
+        """Store the value computed for a code object."""
+        entries = self.entries
+        if len(entries) >= self.maxsize:
+            entries.clear()
+        # Keep a reference to the code object so its id is not reused
+        # while the entry exists.
+        entries[key] = (co, value)
+
+
+class FrameInfoCache(CodeCache):
+    """Cache of the (filename, lineno, name, line) tuples of stack frames.
+
+    Entries are keyed on the code object and line number.  Source files
+    are checked for changes at most once per check_interval seconds
+    rather than once per frame.
+    """
+
+    def __init__(self, maxsize=10000, check_interval=10.0):
+        CodeCache.__init__(self, maxsize)
+        self.check_interval = check_interval
+        # entries: {(id(code), lineno): (code, (generation, info))}
+        self.files = {}  # {filename: (checked_at, generation, stat)}
+
+    def clear(self):
+        self.entries.clear()
+        self.files.clear()
+
+    def get_generation(self, filename, now):
+        """Return a number that changes when the source file changes."""
+        state = self.files.get(filename)
+        if state is not None and now - state[0] < self.check_interval:
+            return state[1]
+
+        try:
+            st = os.stat(filename)
+        except (OSError, TypeError, ValueError):
+            stat = None
+        else:
+            stat = (st.st_size, st.st_mtime)
+
+        if state is None:
+            generation = 0
+            linecache.checkcache(filename)
+        else:
+            generation = state[1]
+            if stat != state[2]:
+                generation += 1
+                linecache.checkcache(filename)
+        if len(self.files) >= self.maxsize:
+            self.clear()
+        self.files[filename] = (now, generation, stat)
+        return generation
+
+    def get(self, f, now):
+        """Get the (filename, lineno, name, line) tuple for a frame."""
         lineno = f.f_lineno
         co = f.f_code
         filename = co.co_filename
-        name = co.co_name
-        linecache.checkcache(filename)
+        generation = self.get_generation(filename, now)
+        key = (id(co), lineno)
+        value = self.lookup(co, key)
+        if value is not None and value[0] == generation:
+            return value[1]
+
         line = linecache.getline(filename, lineno, f.f_globals)
         line = line.strip() if line else None
-        res.append((filename, lineno, name, line))
-        if f.f_locals.get('__slowlog_barrier__'):
+        info = (filename, lineno, co.co_name, line)
+        self.store(co, key, (generation, info))
+        return info
+
+
+frame_info_cache = FrameInfoCache()
+
+barrier_codes = {}  # {id(code): code}
+
+
+def add_barrier(func):
+    """Register a function (or code object) whose frames end stacks.
+
+    Registration lets the stack walkers find the barrier by comparing
+    code objects instead of reading the f_locals of every frame.
+    """
+    code = getattr(func, '__code__', func)
+    barrier_codes[id(code)] = code
+
+
+def walk_stack(f, limit, barrier=None):
+    """List the frames of a stack, innermost first, ending at a barrier.
+
+    If a barrier frame is given, the stack also ends at that frame.
+    """
+    frames = []
+    codes = barrier_codes
+    while f is not None and (limit is None or len(frames) < limit):
+        frames.append(f)
+        if f is barrier:
+            break
+        co = f.f_code
+        if id(co) in codes:
+            break
+        if (('__slowlog_barrier__' in co.co_varnames or
+                '__slowlog_barrier__' in co.co_cellvars) and
+                f.f_locals.get('__slowlog_barrier__')):
             break
         f = f.f_back
-        n = n + 1
+    return frames
+
+
+def stack_key(frames):
+    """Get a hashable fingerprint of frames listed by walk_stack().
+
+    Stacks that are at the same lines of the same code have equal keys.
+    """
+    return tuple([(f.f_code, f.f_lineno) for f in frames])
+
+
+def common_depth(old_key, new_key):
+    """Count the outermost frames shared by two keys from stack_key()."""
+    depth = 0
+    for old, new in zip(reversed(old_key), reversed(new_key)):
+        if old != new:
+            break
+        depth += 1
+    return depth
+
+
+def print_stack(f, limit,
+                file,  # @ReservedAssignment
+                barrier=None):
+    """Print the stack trace of a frame."""
+    traceback.print_list(extract_stack(f, limit, barrier=barrier), file)
+
+
+def print_frames(frames,
+                 file):  # @ReservedAssignment
+    """Print the stack trace of frames listed by walk_stack()."""
+    traceback.print_list(extract_frames(frames), file)
+
+
+def extract_stack(f, limit, cache=None, barrier=None):
+    """Extract the raw traceback from the current stack frame."""
+    return extract_frames(walk_stack(f, limit, barrier), cache)
+
+
+def extract_frames(frames, cache=None):
+    """Extract the raw traceback from frames listed by walk_stack()."""
+    if cache is None:
+        cache = frame_info_cache
+    now = time.time()
+    get = cache.get
+    res = [get(frame, now) for frame in frames]
     res.reverse()
+    monitor_stats.extract.add(time.time() - now)
     return res
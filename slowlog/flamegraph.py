@@ -0,0 +1,181 @@
+"""Export the call tree of a SamplingProfiler as a flame graph.
+
+Two formats are supported: the collapsed stack format read by Brendan
+Gregg's flamegraph.pl (one "outer;inner count" line per stack) and the
+speedscope JSON format (https://www.speedscope.app).
+"""
+
+from slowlog.compat import Queue
+from threading import Thread
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+replace = getattr(os, 'replace', os.rename)
+
+speedscope_schema = 'https://www.speedscope.app/file-format-schema.json'
+
+
+def frame_label(node):
+    """Describe a node of a profiler snapshot in one line."""
+    return '%s (%s:%s)' % (node['name'], node['filename'], node['lineno'])
+
+
+def iter_stacks(snapshot):
+    """Generate ([node], samples) for each stack with self samples.
+
+    The list of nodes starts with the outermost function.
+    """
+    path = []
+
+    def visit(node):
+        path.append(node)
+        if node['self']:
+            yield list(path), node['self']
+        for child in node['children']:
+            for item in visit(child):
+                yield item
+        path.pop()
+
+    for child in snapshot['children']:
+        for item in visit(child):
+            yield item
+
+
+def write_collapsed(snapshot, f):
+    """Write a profiler snapshot in the collapsed stack format."""
+    for path, samples in iter_stacks(snapshot):
+        f.write('%s %d\n' % (
+            ';'.join(frame_label(node).replace(';', ':') for node in path),
+            samples))
+
+
+def make_speedscope(snapshot, name='slowlog'):
+    """Convert a profiler snapshot to a speedscope 'sampled' profile."""
+    frames = []
+    frame_indexes = {}  # {(name, filename, lineno): index}
+    samples = []
+    weights = []
+    for path, count in iter_stacks(snapshot):
+        stack = []
+        for node in path:
+            key = (node['name'], node['filename'], node['lineno'])
+            index = frame_indexes.get(key)
+            if index is None:
+                index = frame_indexes[key] = len(frames)
+                frames.append({'name': node['name'],
+                               'file': node['filename'],
+                               'line': node['lineno']})
+            stack.append(index)
+        samples.append(stack)
+        weights.append(count)
+    total = sum(weights)
+    return {
+        '$schema': speedscope_schema,
+        'exporter': 'slowlog',
+        'name': name,
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'none',
+            'startValue': 0,
+            'endValue': total,
+            'samples': samples,
+            'weights': weights,
+        }],
+    }
+
+
+def write_speedscope(snapshot, f, name='slowlog'):
+    """Write a profiler snapshot in the speedscope JSON format."""
+    json.dump(make_speedscope(snapshot, name), f)
+
+
+class FlameGraphWriter(object):
+    """Rewrite a flame graph of a SamplingProfiler every flush_interval secs.
+
+    A {pid} in the path becomes the process ID.  A writer thread writes
+    the copies of the call tree; copies due while it is busy are counted
+    in skipped.
+    """
+    ident = None
+    writer = None
+    pid = None
+
+    def __init__(self, profiler, path, flush_interval=60.0,
+                 format='collapsed'):  # @ReservedAssignment
+        if format not in ('collapsed', 'speedscope'):
+            raise ValueError("Unknown flame graph format: %r" % format)
+        self.profiler = profiler
+        self.path = path
+        self.interval = flush_interval
+        self.report_at = 0
+        self.format = format
+        self.skipped = 0
+
+    def __call__(self, _report_time, frame=None):
+        pid = os.getpid()
+        if self.pid != pid:
+            self.start_writer()
+        queue = self.queue
+        if queue.full():
+            # Only this thread puts, so the queue stays full.
+            self.skipped += 1
+            return
+        queue.put_nowait((self.profiler.snapshot(), pid))
+
+    def start_writer(self):
+        """Create the queue and start the writer thread."""
+        self.queue = Queue(1)
+        self.writer = SnapshotWriter(self.queue, self.write)
+        self.writer.start()
+        self.pid = os.getpid()
+
+    def close(self, timeout=5.0):
+        """Write the queued copy and stop the writer thread."""
+        writer = self.writer
+        if writer is not None and writer.is_alive():
+            self.queue.put(None)
+            writer.join(timeout)
+
+    def flush(self):
+        """Write the file in the calling thread."""
+        self.write(self.profiler.snapshot(), os.getpid())
+
+    def write(self, snapshot, pid):
+        """Write a snapshot of the call tree to the file."""
+        path = self.path.replace('{pid}', str(pid))
+        tmp = '%s.tmp' % path
+        f = open(tmp, 'w')
+        try:
+            if self.format == 'speedscope':
+                write_speedscope(snapshot, f, 'slowlog %d' % pid)
+            else:
+                write_collapsed(snapshot, f)
+        finally:
+            f.close()
+        replace(tmp, path)
+
+
+class SnapshotWriter(Thread):
+    """A thread that writes the snapshots queued by a FlameGraphWriter."""
+
+    def __init__(self, queue, write):
+        super(SnapshotWriter, self).__init__(name='slowlog_flamegraph')
+        self.setDaemon(True)
+        self.queue = queue
+        self.write = write
+
+    def run(self):
+        queue = self.queue
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            try:
+                self.write(*item)
+            except Exception:
+                log.exception("Error writing a flame graph")
@@ -0,0 +1,117 @@
+from collections import deque
+from slowlog.exc import extract_frames
+from slowlog.exc import stack_key
+from slowlog.monitor import get_monitor
+import traceback
+
+
+class FlightRecorder(object):
+    """Keep the last depth samples of each request thread for timeline().
+
+    Samples are taken rate times per second.  Their stacks are interned
+    in a table of at most max_stacks stacks, cleared when it is full.
+    """
+    ident = None
+
+    def __init__(self, rate=10.0, depth=64, max_stacks=10000,
+                 frame_limit=100):
+        self.interval = 1.0 / rate
+        self.report_at = 0
+        self.depth = depth
+        self.max_stacks = max_stacks
+        self.frame_limit = frame_limit
+        self.rings = {}  # {ident: deque([(time, stack)])}
+        self.stacks = {}  # {((code, lineno),): stack}
+        self.get_monitor = get_monitor  # testing hook
+
+    def __call__(self, report_time, frame=None):
+        stacks = self.get_monitor().sample_stacks(report_time,
+                                                  self.frame_limit)
+        rings = self.rings
+        for ident in list(rings):
+            if ident not in stacks:
+                # The thread finished its request; forget its samples.
+                del rings[ident]
+        for ident, stack in stacks.items():
+            ring = rings.get(ident)
+            if ring is None:
+                ring = rings[ident] = deque(maxlen=self.depth)
+            ring.append((report_time, self.intern(stack)))
+
+    def intern(self, frames):
+        """Get the shared stack tuple for frames listed by walk_stack()."""
+        key = stack_key(frames)
+        stacks = self.stacks
+        stack = stacks.get(key)
+        if stack is None:
+            if len(stacks) >= self.max_stacks:
+                stacks.clear()
+            stack = stacks[key] = tuple(extract_frames(frames))
+        return stack
+
+    def timeline(self, ident, since):
+        """List the (time, stack) samples of a thread taken since a time.
+        """
+        ring = self.rings.get(ident)
+        if not ring:
+            return []
+        return [entry for entry in list(ring) if entry[0] >= since]
+
+
+def group_timeline(timeline):
+    """Merge consecutive samples of the same stack.
+
+    Returns ([(time, count, stack number)], [stack]).
+    """
+    groups = []
+    stacks = []
+    numbers = {}  # {id(stack): number}
+    prev = None
+    for t, stack in timeline:
+        if stack is prev:
+            groups[-1][1] += 1
+            continue
+        number = numbers.get(id(stack))
+        if number is None:
+            number = numbers[id(stack)] = len(stacks)
+            stacks.append(stack)
+        groups.append([t, 1, number])
+        prev = stack
+    return [tuple(group) for group in groups], stacks
+
+
+def format_timeline(timeline, start):
+    """Format the samples of a request as text."""
+    groups, stacks = group_timeline(timeline)
+    lines = ['timeline:']
+    for t, count, number in groups:
+        lines.append('  +%.2fs %d sample%s: stack %d' % (
+            t - start, count, '' if count == 1 else 's', number))
+    for number, stack in enumerate(stacks):
+        lines.append('stack %d:' % number)
+        lines.append(''.join(traceback.format_list(list(stack))).rstrip())
+    return '\n'.join(lines)
+
+
+def timeline_data(timeline, start):
+    """Convert the samples of a request to JSON-compatible data.
+
+    samples is a list of [offset, stack number]; each stack is a list
+    of frames, outermost first.
+    """
+    samples = []
+    stacks = []
+    numbers = {}  # {id(stack): number}
+    for t, stack in timeline:
+        number = numbers.get(id(stack))
+        if number is None:
+            number = numbers[id(stack)] = len(stacks)
+            stacks.append(stack)
+        samples.append([round(t - start, 3), number])
+    return {
+        'samples': samples,
+        'stacks': [[{'file': filename, 'line': lineno, 'name': name,
+                     'code': line}
+                    for filename, lineno, name, line in stack]
+                   for stack in stacks],
+    }
@@ -1,35 +1,82 @@
 
-from slowlog.compat import get_ident
+from slowlog.compat import GreenletReporter
+from slowlog.cputime import thread_cpu_time
+from slowlog.exc import CodeCache
+from slowlog.exc import walk_stack
 
 
-def report_framestats(client, frame, limit=100, max_buf=1000):
-    """Send info about a frame to a Statsd server"""
-    f = frame
+class MetricNameCache(CodeCache):
+    """Cache of the Statsd metric names of code objects.
+
+    Each frame is recorded in 2 forms, hierarchical and flat, to make
+    the stats easy to browse.
+    """
+
+    def get(self, f):
+        """Get the (hierarchical, flat) metric names for a frame."""
+        co = f.f_code
+        names = self.lookup(co, id(co))
+        if names is not None:
+            return names
+
+        modname = f.f_globals.get('__name__', '(module)')
+        name = '%s.%s' % (modname, co.co_name)
+        names = ('framestats.%s' % name,
+                 'framestats._.%s' % name.replace('.', '_'))
+        self.store(co, id(co), names)
+        return names
+
+
+metric_name_cache = MetricNameCache()
+
+cpu_metric = 'slowlog.cpu_ms'
+wait_metric = 'slowlog.wait_ms'
+
+_weights = {}  # {framecount: ['%0.3g' weight]}
+
+
+def get_weights(framecount):
+    """List the formatted counter weights for a stack of framecount frames.
+
+    The current frame is first in the list and increments a counter by 1.
+    The rest of the frames increment counters by smaller amounts.
+    """
+    weights = _weights.get(framecount)
+    if weights is None:
+        n = float(framecount)
+        weights = ['%0.3g' % ((n - i) / n) for i in range(framecount)]
+        if len(_weights) < 1000:
+            _weights[framecount] = weights
+    return weights
+
+
+def frame_names(frame, limit=100, cache=None, barrier=None):
+    """List the metric names of the frames of a stack, innermost first.
+
+    Each item is a (hierarchical, flat) pair of names.
+    """
+    # Ignore the stack beyond the barrier.
+    return stack_names(walk_stack(frame, limit, barrier), cache)
+
+
+def stack_names(frames, cache=None):
+    """List the metric names of frames listed by walk_stack()."""
+    if cache is None:
+        cache = metric_name_cache
+    get = cache.get
+    return [get(f) for f in frames]
+
+
+def send_counters(client, counters, max_buf=1000):
+    """Send ((name, flat_name), amount) counters to Statsd.
+
+    Sends buffers of up to max_buf bytes.
+    """
     buf = []
     bytecount = 0
-    count = 0
-    names = []
-    while f is not None and count < limit:
-        modname = f.f_globals.get('__name__', '(module)')
-        co = f.f_code
-        names.append('%s.%s' % (modname, co.co_name))
-        if f.f_locals.get('__slowlog_barrier__'):
-            # Ignore the stack beyond this point.
-            break
-        f = f.f_back
-        count += 1
-
-    framecount = float(len(names))
-    for i, name in enumerate(names):
-        # The current frame is first in the list and increments a counter by 1.
-        # The rest of the frames increment counters by smaller
-        # amounts.
-        weight = '%0.3g' % ((framecount - i) / framecount)
-        # Record the frame names in 2 forms, hierarchical and flat,
-        # to make the stats easy to browse.
-        client.incr('framestats.%s' % name, weight, buf=buf)
-        flat_name = name.replace('.', '_')
-        client.incr('framestats._.%s' % flat_name, weight, buf=buf)
+    for (name, flat_name), amount in counters:
+        client.incr(name, amount, buf=buf)
+        client.incr(flat_name, amount, buf=buf)
         size = len(buf[-2]) + len(buf[-1]) + 2
         bytecount += size
         if bytecount >= max_buf:
@@ -41,20 +88,136 @@ def report_framestats(client, frame, limit=100, max_buf=1000):
         client.sendbuf(buf)
 
 
-class FrameStatsReporter(object):
-    """Reporter that calls report_framestats"""
+def report_framestats(client, frame, limit=100, max_buf=1000, barrier=None):
+    """Send info about a frame to a Statsd server"""
+    send_names(client, frame_names(frame, limit, barrier=barrier), max_buf)
+
+
+def send_names(client, names, max_buf=1000):
+    """Send weighted counters for the metric names of a stack."""
+    counters = zip(names, get_weights(len(names)))
+    send_counters(client, counters, max_buf)
+
+
+def send_cpu(client, cpu, wait):
+    """Send seconds of CPU and wait time to Statsd as millisecond counters.
+    """
+    buf = []
+    client.incr(cpu_metric, '%.6g' % (cpu * 1000), buf=buf)
+    client.incr(wait_metric, '%.6g' % (wait * 1000), buf=buf)
+    client.sendbuf(buf)
+
+
+class FrameStatsAggregator(object):
+    """Sum framestats counters and send them every flush_interval seconds.
+
+    A periodic reporter that sends a few packets per flush instead of a
+    few per report, with the metric names of report_framestats.
+    """
+    ident = None
+
+    def __init__(self, client, flush_interval=10.0, max_buf=1000):
+        self.client = client
+        self.interval = flush_interval
+        self.report_at = 0
+        self.max_buf = max_buf
+        self.counters = {}  # {(name, flat_name): amount}
+        self.cpu = [0.0, 0.0]  # [cpu, wait] seconds
+
+    def add(self, frame, limit=100, barrier=None):
+        """Add the counters for a frame to the totals."""
+        self.add_names(frame_names(frame, limit, barrier=barrier))
+
+    def add_names(self, names):
+        """Add the counters for the metric names of a stack."""
+        framecount = float(len(names))
+        counters = self.counters
+        for i, name in enumerate(names):
+            counters[name] = (counters.get(name, 0.0) +
+                              (framecount - i) / framecount)
+
+    def add_cpu(self, cpu, wait):
+        """Add seconds of CPU and wait time to the totals."""
+        totals = self.cpu
+        totals[0] += cpu
+        totals[1] += wait
+
+    def flush(self):
+        """Send the totals to Statsd and reset them."""
+        counters, self.counters = self.counters, {}
+        (cpu, wait), self.cpu = self.cpu, [0.0, 0.0]
+        if cpu or wait:
+            send_cpu(self.client, cpu, wait)
+        if counters:
+            send_counters(self.client,
+                          [(name, '%.6g' % amount)
+                           for name, amount in counters.items()],
+                          self.max_buf)
+
+    def __call__(self, _report_time, frame=None):
+        self.flush()
+
+
+class FrameStatsReporter(GreenletReporter):
+    """Reporter that calls report_framestats
+
+    If an aggregator is given, the reporter adds to its totals
+    instead of sending the stats immediately.  If barrier is set to a
+    frame, stacks end at that frame.  If cpu is true, each report after
+    the first also counts the CPU and wait time of the thread since the
+    previous report (see slowlog.cputime).
+    """
+    barrier = None
+    cpu_mark = None  # (report_time, CPU time) of the previous report
 
     def __init__(self, client, report_at, interval, frame_limit=100,
-                 ident=None):
+                 ident=None, aggregator=None, cpu=False):
         self.client = client
         self.report_at = report_at
         self.interval = interval
-        if ident is None:
-            ident = get_ident()
-        self.ident = ident
+        self.set_ident(ident)
         self.frame_limit = frame_limit
+        self.aggregator = aggregator
+        # The CPU clock of the thread is shared by its greenlets.
+        self.cpu = cpu and self.greenlet is None
 
-    def __call__(self, _report_time, frame=None,
+    def __call__(self, report_time, frame=None,
                  report_framestats=report_framestats):
         if frame is not None:
-            report_framestats(self.client, frame, self.frame_limit)
+            if self.cpu:
+                self.report_cpu(report_time)
+            if self.aggregator is not None:
+                self.aggregator.add(frame, self.frame_limit, self.barrier)
+            else:
+                report_framestats(self.client, frame, self.frame_limit,
+                                  barrier=self.barrier)
+
+    def report_stack(self, report_time, stack):
+        """Report frames already listed by walk_stack(), innermost first."""
+        if stack is not None:
+            if self.cpu:
+                self.report_cpu(report_time)
+            limit = self.frame_limit
+            if len(stack) > limit:
+                stack = stack[:limit]
+            names = stack_names(stack)
+            if self.aggregator is not None:
+                self.aggregator.add_names(names)
+            else:
+                send_names(self.client, names)
+
+    def report_cpu(self, report_time):
+        """Report the CPU and wait time since the previous report."""
+        cpu_now = thread_cpu_time(self.ident)
+        if cpu_now is None:
+            return
+        mark = self.cpu_mark
+        self.cpu_mark = (report_time, cpu_now)
+        if mark is None:
+            return
+        cpu = max(0.0, cpu_now - mark[1])
+        wait = max(0.0, report_time - mark[0] - cpu)
+        if self.aggregator is not None:
+            self.aggregator.add_cpu(cpu, wait)
+        else:
+            send_cpu(self.client, cpu, wait)
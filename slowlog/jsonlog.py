@@ -0,0 +1,45 @@
+"""JSON-lines format for slow request reports.
+
+Each report is a single JSON object on one line, so downstream tools
+can parse reports without matching the text format.
+"""
+
+from itertools import count
+from slowlog.exc import extract_frames
+import json
+
+
+_request_ids = count(1)
+
+
+def next_request_id():
+    """Generate a request ID for requests that did not provide one."""
+    # next() on itertools.count is atomic under the GIL.
+    return str(next(_request_ids))
+
+
+def format_frames(frames):
+    """Convert frames listed by walk_stack() to dicts, outermost first."""
+    return [{'file': filename, 'line': lineno, 'name': name, 'code': line}
+            for filename, lineno, name, line in extract_frames(frames)]
+
+
+def dump_report(ident, request_id, start, elapsed, method, url,
+                frames=None, **extra):
+    """Serialize a report as one line of JSON.
+
+    Values in extra that JSON can not represent (such as Hidden) are
+    written using repr().
+    """
+    report = {
+        'thread': ident,
+        'request_id': request_id,
+        'start': round(start, 3),
+        'elapsed': round(elapsed, 3),
+        'method': method,
+        'url': url,
+        'frames': frames,
+    }
+    if extra:
+        report.update(extra)
+    return json.dumps(report, default=repr, sort_keys=True)
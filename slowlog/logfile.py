@@ -4,10 +4,24 @@ from logging import Handler
 from logging import Logger
 from logging import StreamHandler
 from logging.handlers import RotatingFileHandler
+from slowlog.compat import Empty
+from slowlog.compat import Full
+from slowlog.compat import Queue
+from threading import Thread
+import os
 
 
-def make_file_logger(logfile, maxBytes=int(1e7), backupCount=10):
-    """Create a logger that mimics the format of Products.LongRequestLogger"""
+def make_file_logger(logfile, maxBytes=int(1e7), backupCount=10,
+                     queued=False, queue_size=1000,
+                     format='text'):  # @ReservedAssignment
+    """Create a logger that mimics the format of Products.LongRequestLogger
+
+    If queued is true, the logger only puts records in a queue of up
+    to queue_size records; a writer thread formats and writes them.
+
+    If format is 'json', each record is written as-is, one per line,
+    for use with the JSON-lines reports of the request loggers.
+    """
     if isinstance(logfile, Logger):
         # The Logger is already set up.
         return logfile
@@ -21,13 +35,114 @@ def make_file_logger(logfile, maxBytes=int(1e7), backupCount=10):
         if hasattr(logfile, 'write'):
             # Write to an open file.
             handler = StreamHandler(logfile)
+        elif queued:
+            # Create a rotating file handler that the writer thread
+            # flushes once per batch of records.
+            handler = BatchRotatingFileHandler(logfile,
+                                               maxBytes=maxBytes,
+                                               backupCount=backupCount)
         else:
             # Create a rotating file handler.
             handler = RotatingFileHandler(logfile,
                                           maxBytes=maxBytes,
                                           backupCount=backupCount)
-        fmt = Formatter('%(asctime)s - %(message)s')
+        if format == 'json':
+            fmt = Formatter('%(message)s')
+        else:
+            fmt = Formatter('%(asctime)s - %(message)s')
         handler.setFormatter(fmt)
 
+    if queued:
+        handler = QueuedHandler(handler, queue_size)
+
     logger.addHandler(handler)
     return logger
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """A RotatingFileHandler that can defer flushing.
+
+    While batching is true, the stream is flushed only when the file
+    rotates or when batching ends.
+    """
+    batching = False
+
+    def flush(self):
+        if not self.batching:
+            RotatingFileHandler.flush(self)
+
+
+class QueuedHandler(Handler):
+    """Handler that passes records to a writer thread.
+
+    Emitting a record only puts it in a bounded queue, so a slow disk
+    does not delay the monitor thread.  If the queue is full, the record
+    is dropped and counted in the dropped attribute.  A forked child
+    process does not inherit the writer thread, so the first record
+    emitted in the child starts a new queue and writer thread.
+    """
+
+    def __init__(self, handler, queue_size=1000):
+        Handler.__init__(self)
+        self.handler = handler
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.start_writer()
+
+    def start_writer(self):
+        """Create the queue and start the writer thread."""
+        self.queue = Queue(self.queue_size)
+        self.writer = LogWriter(self.queue, self.handler)
+        self.writer.start()
+        self.pid = os.getpid()
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            # The records queued before the fork belong to the parent.
+            self.start_writer()
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        """Write the queued records and stop the writer thread."""
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join(timeout)
+        self.handler.close()
+        Handler.close(self)
+
+
+class LogWriter(Thread):
+    """A thread that writes queued log records to a handler."""
+
+    def __init__(self, queue, handler):
+        super(LogWriter, self).__init__(name='slowlog_writer')
+        self.setDaemon(True)
+        self.queue = queue
+        self.handler = handler
+
+    def run(self):
+        queue = self.queue
+        handler = self.handler
+        batching = hasattr(handler, 'batching')
+        while True:
+            records = [queue.get()]
+            while True:
+                try:
+                    records.append(queue.get_nowait())
+                except Empty:
+                    break
+
+            if batching:
+                handler.batching = True
+            try:
+                for record in records:
+                    if record is None:
+                        return
+                    handler.handle(record)
+            finally:
+                if batching:
+                    handler.batching = False
+                handler.flush()
@@ -1,14 +1,29 @@
 
+from collections import deque
+from heapq import heapify
+from heapq import heappop
+from heapq import heappush
+from itertools import count
 from slowlog.compat import Empty
+from slowlog.compat import NativeQueue
 from slowlog.compat import Queue
-from threading import Lock
+from slowlog.compat import allocate_lock
+from slowlog.compat import start_new_thread
+from slowlog.compat import use_native_thread
+from slowlog.exc import stack_key
+from slowlog.exc import walk_stack
+from slowlog.stats import MonitorStats
+from slowlog.stats import monitor_stats
 from threading import Thread
 import logging
+import os
 import sys
 import time
 
 log = logging.getLogger(__name__)
 
+infinity = float('inf')
+
 
 class ReporterInterface(object):
     """The interface of Reporter objects.
@@ -20,6 +35,8 @@ class ReporterInterface(object):
     ident = 0       # thread.get_ident()
     report_at = 0   # a Unix time
     interval = 1.0  # Seconds between reports (after report_at)
+    # A reporter may change its interval when called.  The monitor does
+    # not call it again after it sets the interval to None.
 
     def __call__(self, report_time, frame=None):  # pragma no cover
         """Report the thread's current activity.
@@ -30,70 +47,487 @@ class ReporterInterface(object):
         """
 
 
+class CoalescingReporterInterface(ReporterInterface):
+    """A reporter whose reports may be combined with those of others.
+
+    When several coalescing reporters with the same coalesce key are
+    due in one sweep and their threads have identical stacks, the
+    monitor calls report_group() on one of them with the others
+    instead of calling each reporter.
+    """
+    coalesce = None  # Reporters with equal keys may share reports
+
+    def walk(self, frame):  # pragma no cover
+        """List the frames of the thread's stack, innermost first."""
+
+    def report_group(self, report_time, stack, others):  # pragma no cover
+        """Report the stack of this thread and of the other reporters.
+
+        others is a list of reporters whose threads have the same stack.
+        """
+
+
+class TaskReporterInterface(ReporterInterface):
+    """A reporter for a task that shares its thread with other tasks.
+
+    Tasks include asyncio tasks and greenlets.  The frame of the thread
+    shows whichever task is running, if any,
+    so the monitor passes it to get_frame() and reports the frame that
+    get_frame() returns instead.
+    """
+
+    def get_frame(self, thread_frame):  # pragma no cover
+        """Get the innermost frame of the task, or None.
+
+        thread_frame is the current frame of the thread, or None.
+        """
+
+
+class PeriodicReporterInterface(ReporterInterface):
+    """A reporter for a periodic task rather than a thread.
+
+    Install periodic reporters (see install()) rather than adding and
+    removing them.  The monitor thread calls them every interval seconds
+    with no frame, so they delay the reports of slow requests while
+    they run.
+    """
+    ident = None
+
+
+class Backoff(object):
+    """Policy for the intervals between the reports of one request.
+
+    After each report, the interval grows by factor, up to max_interval
+    seconds.  After max_reports reports, the reporter stops reporting.
+    A max_interval or max_reports of 0 means no limit.
+    """
+
+    def __init__(self, factor=1.0, max_interval=0, max_reports=0):
+        self.factor = factor
+        self.max_interval = max_interval
+        self.max_reports = max_reports
+
+    def next_interval(self, interval, report_count):
+        """Get the interval after the next report, or None to stop.
+
+        interval is the current interval and report_count is the
+        number of reports made so far.
+        """
+        if self.max_reports and report_count >= self.max_reports:
+            return None
+        interval *= self.factor
+        if self.max_interval and interval > self.max_interval:
+            interval = self.max_interval
+        return interval
+
+
+def make_backoff(factor=1.0, max_interval=0, max_reports=0):
+    """Create a Backoff, or return None if it would change nothing."""
+    if factor == 1.0 and not max_interval and not max_reports:
+        return None
+    return Backoff(factor, max_interval, max_reports)
+
+
+class SlotOwnerInterface(object):
+    """The interface of objects that register requests in Monitor.slots.
+
+    Registering a slot is much cheaper than adding a Reporter: the
+    request thread stores a tuple in a dict and removes it when done.
+    The monitor polls the slots and creates a Reporter only for requests
+    that are still running at report_at.
+    """
+
+    def make_reporter(self, context, start, report_at, ident):
+        """Create a Reporter for a slot that reached its report_at.
+
+        The slot key is (ident, owner) and the slot value is
+        (report_at, start, context).  ident is usually a thread ident,
+        or (thread ident, greenlet) in a greenlet (see
+        slowlog.compat.get_request_ident); owners that register asyncio
+        tasks use the task instead.
+        """
+
+
+def align_time(t, interval):
+    """Round a Unix time up to a multiple of interval."""
+    periods = t // interval
+    if t > periods * interval:
+        periods += 1
+    return periods * interval
+
+
+def align_report_at(reporter):
+    """Align the first report of a coalescing reporter.
+
+    Coalescing reporters only share reports when they are due in the
+    same sweep, so their report times are rounded up to a multiple of
+    their interval.  This delays the first report by up to one interval.
+    """
+    if getattr(reporter, 'coalesce', None) is not None:
+        reporter.report_at = align_time(reporter.report_at, reporter.interval)
+
+
 class Monitor(Thread):
     """A thread that reports info about activities longer than some threshold.
+
+    When gevent has patched the threading module, the monitor runs in a
+    native thread instead (see slowlog.compat.use_native_thread), so it
+    reports even while a greenlet keeps the hub busy.  Such a monitor
+    can not be joined.
     """
     min_interval = 0.01
+    max_timeout = 3600.0
+    poll_interval = 0.1  # Seconds between polls of the slots
+    native = False
 
     def __init__(self):
         super(Monitor, self).__init__(name='slowlog_monitor')
         self.setDaemon(True)
-        self.queue = Queue()  # Thread communication: [(reporter, add) or None]
-        self.reporters = set()  # set([Reporter])
+        if use_native_thread():
+            self.native = True
+            self.queue = NativeQueue()
+        else:
+            self.queue = Queue()  # Wakes the thread: [() or None to stop]
+        # Registrations wait in self.pending until the monitor thread
+        # drains them in a batch.
+        self.pending = deque()  # [(reporter, add)]
+        # The schedule is a heap of (report_at, seq, reporter) entries.
+        # Removed reporters are deleted from the schedule lazily:
+        # an entry is live only while self.reporters maps its reporter
+        # to that exact entry.  A reporter that stopped reporting (its
+        # interval is None) maps to None until it is removed.
+        self.reporters = {}  # {Reporter: schedule entry}
+        self.schedule = []  # [(report_at, seq, Reporter)]
+        self.seq = count()
+        # Request threads write to self.slots directly.
+        self.slots = {}  # {(ident, owner): (report_at, start, context)}
+        self.slot_reporters = {}  # {(ident, owner): (slot, Reporter)}
+        # wake_at is the time the monitor thread will next wake up on its
+        # own; it is 0 while the thread is busy.  Threads that register
+        # something due before wake_at should call wake().
+        self.wake_at = 0.0
+        # Counters of registrations processed by the monitor thread.
+        self.added = 0
+        self.removed = 0
+        self.cancelled = 0  # Add/remove pairs drained in the same batch
+        # Overhead counters and histograms, shared with the code that
+        # extracts stacks and logs reports.  get_monitor() resets them
+        # when it starts a new global Monitor.
+        self.stats = monitor_stats
+        # (report_time, frame_limit, {ident: stack}) of sample_stacks(),
+        # kept until the end of the sweep.
+        self.sampled = None
+
+    def start(self):
+        if self.native:
+            start_new_thread(self.run, ())
+        else:
+            Thread.start(self)
 
     def add(self, reporter):
         """Add a Reporter."""
-        self.queue.put((reporter, True))
+        self.pending.append((reporter, True))
+        if reporter.report_at < self.wake_at:
+            self.wake()
 
     def remove(self, reporter):
         """Remove a Reporter."""
-        self.queue.put((reporter, False))
+        # The monitor does not need to wake up for this; it drains
+        # removals before it calls any reporter.
+        self.pending.append((reporter, False))
+
+    def wake(self):
+        """Wake the monitor thread so it notices new registrations."""
+        self.wake_at = 0.0
+        self.queue.put(())
+
+    def drain(self):
+        """Apply the pending registrations.  Called by the monitor thread.
+
+        A reporter added and removed within the same batch belongs to a
+        request that finished before the monitor saw it, so the pair is
+        cancelled without touching the schedule.
+        Returns the earliest report_at of the added reporters, or None.
+        """
+        pending = self.pending
+        added = {}  # {Reporter: None}
+        popleft = pending.popleft
+        while True:
+            try:
+                reporter, add = popleft()
+            except IndexError:
+                break
+            if add:
+                added[reporter] = None
+            elif reporter in added:
+                del added[reporter]
+                self.cancelled += 1
+            else:
+                self._remove(reporter)
+                self.removed += 1
+
+        if not added:
+            return None
+        added_at = None
+        for reporter in added:
+            align_report_at(reporter)
+            self._add(reporter)
+            if added_at is None or reporter.report_at < added_at:
+                added_at = reporter.report_at
+        self.added += len(added)
+        return added_at
+
+    def _add(self, reporter):
+        """Schedule a Reporter.  Called only by the monitor thread."""
+        entry = (reporter.report_at, next(self.seq), reporter)
+        self.reporters[reporter] = entry
+        heappush(self.schedule, entry)
+
+    def _remove(self, reporter):
+        """Unschedule a Reporter.  Called only by the monitor thread."""
+        reporters = self.reporters
+        if reporter in reporters:
+            del reporters[reporter]
+            schedule = self.schedule
+            if not reporters:
+                del schedule[:]
+            elif len(schedule) > 2 * len(reporters) + 64:
+                # Most of the schedule is dead; compact it.
+                schedule[:] = [entry for entry in schedule
+                               if reporters.get(entry[2]) is entry]
+                heapify(schedule)
+
+    def _reschedule(self, reporter):
+        """Schedule a Reporter after a report.  Called by the monitor thread.
+        """
+        if reporter.interval is None:
+            # Keep the reporter registered, but unscheduled.
+            self.reporters[reporter] = None
+        else:
+            self._add(reporter)
+
+    def poll(self, report_time):
+        """Create reporters for the slots that have reached report_at.
+
+        Also remove the reporters of slots that have been released.
+        Returns the time the slots should be polled again, or None if
+        there are no slots.
+        """
+        slots = self.slots.copy()  # Atomic in CPython
+        slot_reporters = self.slot_reporters
+
+        for key, (slot, reporter) in list(slot_reporters.items()):
+            if slots.get(key) is not slot:
+                # The request finished.
+                del slot_reporters[key]
+                if reporter is not None:
+                    self._remove(reporter)
+
+        if not slots:
+            return None
+
+        poll_at = report_time + self.poll_interval
+        for key, slot in slots.items():
+            report_at = slot[0]
+            if report_at > report_time:
+                if report_at < poll_at:
+                    poll_at = report_at
+            elif key not in slot_reporters:
+                ident, owner = key
+                _report_at, start, context = slot
+                try:
+                    reporter = owner.make_reporter(
+                        context, start, report_at, ident)
+                except Exception:
+                    self.stats.errors += 1
+                    log.exception("Error creating reporter for %s", owner)
+                    reporter = None
+                slot_reporters[key] = (slot, reporter)
+                if reporter is not None:
+                    align_report_at(reporter)
+                    self._add(reporter)
+        return poll_at
+
+    def get_slot_reporter(self, key, slot):
+        """Get the reporter the monitor created for a slot, if any."""
+        entry = self.slot_reporters.get(key)
+        if entry is not None and entry[0] is slot:
+            return entry[1]
+        return None
+
+    def sample_stacks(self, report_time, frame_limit=100):
+        """Walk the stacks of the threads with registered requests.
+
+        Returns {ident: [frame]} with the frames listed by walk_stack().
+        Reporters that sample every request, such as the flight
+        recorder and the profiler, share the stacks walked in a sweep.
+        Called by the monitor thread.
+        """
+        sampled = self.sampled
+        if (sampled is not None and sampled[0] == report_time and
+                sampled[1] >= frame_limit):
+            stacks = sampled[2]
+            if sampled[1] > frame_limit:
+                stacks = dict((ident, stack[:frame_limit])
+                              for ident, stack in stacks.items())
+            return stacks
+
+        stacks = {}
+        idents = self.active_idents()
+        if idents:
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks[ident] = walk_stack(frame, frame_limit)
+            frame = frames = None  # Free memory
+        self.sampled = (report_time, frame_limit, stacks)
+        return stacks
+
+    def active_idents(self):
+        """Return the idents of the threads with registered requests.
+
+        Includes threads with a slot or a reporter.  The slots of
+        asyncio tasks add the tasks.  Called by the monitor thread.
+        """
+        idents = set(ident for ident, _owner in self.slots.copy())
+        for reporter in self.reporters:
+            ident = reporter.ident
+            if ident is not None:
+                idents.add(ident)
+        return idents
+
+    def sweep(self, report_time):
+        """Call the reporters that are due.
+
+        Returns the time of the next scheduled report, or None if
+        no reporters remain.
+        """
+        reporters = self.reporters
+        schedule = self.schedule
+        due = []
+        while schedule:
+            entry = schedule[0]
+            if reporters.get(entry[2]) is not entry:
+                # The reporter was removed or rescheduled.
+                heappop(schedule)
+            elif entry[0] <= report_time:
+                heappop(schedule)
+                due.append(entry[2])
+            else:
+                break
+
+        if due:
+            stats = self.stats
+            frames = sys._current_frames()
+            groups = {}  # {(coalesce, stack key): [(reporter, stack)]}
+            for reporter in due:
+                frame = frames.get(reporter.ident)
+                try:
+                    get_frame = getattr(reporter, 'get_frame', None)
+                    if get_frame is not None:
+                        frame = get_frame(frame)
+                    interval = reporter.interval
+                    coalesce = getattr(reporter, 'coalesce', None)
+                    if coalesce is None:
+                        reporter.report_at = report_time + interval
+                    else:
+                        # Stay on the boundaries shared with other
+                        # coalescing reporters.
+                        reporter.report_at = align_time(
+                            report_time + interval / 2.0, interval)
+                    if frame is not None and coalesce is not None:
+                        stack = reporter.walk(frame)
+                        key = (coalesce, stack_key(stack))
+                        group = groups.get(key)
+                        if group is None:
+                            groups[key] = [(reporter, stack)]
+                        else:
+                            group.append((reporter, stack))
+                        continue
+                    started = time.time()
+                    reporter(report_time, frame)
+                    stats.report.add(time.time() - started)
+                    stats.reports += 1
+                except Exception:
+                    stats.errors += 1
+                    log.exception("Error in reporter %s", reporter)
+                self._reschedule(reporter)
+            frame = frames = None  # Free memory
+
+            for group in groups.values():
+                reporter, stack = group[0]
+                others = [other for other, _stack in group[1:]]
+                try:
+                    started = time.time()
+                    reporter.report_group(report_time, stack, others)
+                    stats.report.add(time.time() - started)
+                    stats.reports += 1
+                except Exception:
+                    stats.errors += 1
+                    log.exception("Error in reporter %s", reporter)
+                self._reschedule(reporter)
+                for other in others:
+                    self._reschedule(other)
+            group = stack = None  # Free memory
+            self.sampled = None
+
+        if schedule:
+            return schedule[0][0]
+        return None
 
     def run(self, time=time.time):
         try:
             queue = self.queue
+            stats = self.stats
 
             while True:
-                if not queue.empty():
-                    block = False
-                    timeout = None
-                elif self.reporters:
-                    report_time = time()
-                    timeout_at = report_time + 3600.0
-                    frames = None
-                    for reporter in self.reporters:
-                        if report_time >= reporter.report_at:
-                            if frames is None:
-                                frames = sys._current_frames()
-                            frame = frames.get(reporter.ident)
-                            try:
-                                reporter.report_at = (report_time +
-                                                      reporter.interval)
-                                reporter(report_time, frame)
-                            except Exception:
-                                log.exception("Error in reporter %s", reporter)
-                        timeout_at = min(timeout_at, reporter.report_at)
-                    frames = None  # Free memory
-                    block = True
-                    timeout = max(self.min_interval, timeout_at - report_time)
+                self.wake_at = 0.0
+                self.drain()
+                report_time = time()
+                timeout_at = None
+                if self.slots or self.slot_reporters:
+                    timeout_at = self.poll(report_time)
+                if self.reporters:
+                    sweep_at = self.sweep(report_time)
+                    if timeout_at is None or (
+                            sweep_at is not None and sweep_at < timeout_at):
+                        timeout_at = sweep_at
+                stats.sweep.add(time() - report_time)
+                if timeout_at is not None:
+                    timeout_at = max(report_time + self.min_interval,
+                                     min(timeout_at,
+                                         report_time + self.max_timeout))
+                    self.wake_at = timeout_at
                 else:
-                    # Wait for a reporter.
-                    block = True
+                    self.wake_at = infinity
+
+                # Pick up registrations that arrived while the monitor
+                # was busy, before wake_at was published.
+                added_at = self.drain()
+                if self.slots:
+                    poll_at = report_time + self.poll_interval
+                    if added_at is None or poll_at < added_at:
+                        added_at = poll_at
+                if added_at is not None and (
+                        timeout_at is None or added_at < timeout_at):
+                    timeout_at = max(report_time + self.min_interval,
+                                     added_at)
+
+                if timeout_at is None:
+                    # Wait for a reporter or a slot.
                     timeout = None
+                else:
+                    timeout = timeout_at - report_time
 
                 try:
-                    item = queue.get(block, timeout)
+                    item = queue.get(True, timeout)
                 except Empty:
                     pass
                 else:
                     if item is None:
                         # Stop looping.
                         break
-                    reporter, add = item
-                    if add:
-                        self.reporters.add(reporter)
-                    else:
-                        self.reporters.discard(reporter)
 
         finally:
             global _monitor
@@ -107,6 +541,25 @@ class Monitor(Thread):
             else:
                 pass  # pragma no cover
 
+    def get_stats(self):
+        """Return a dict of the monitor's overhead stats.
+
+        Combines the registration counters, the current number of
+        reporters, slots and pending registrations, and the snapshot of
+        self.stats (see slowlog.stats.MonitorStats).  May be called from
+        any thread; the values are read without a lock.
+        """
+        res = self.stats.snapshot()
+        res.update({
+            'added': self.added,
+            'removed': self.removed,
+            'cancelled': self.cancelled,
+            'reporters': len(self.reporters),
+            'slots': len(self.slots),
+            'pending': len(self.pending),
+        })
+        return res
+
     def stop(self):
         global _monitor
         _monitor = None
@@ -114,22 +567,133 @@ class Monitor(Thread):
 
 
 _monitor = None
-_monitor_lock = Lock()
+_monitor_pid = None  # The process that started _monitor
+_monitor_lock = allocate_lock()
+_installed = []  # [Reporter]
 
 
 def get_monitor():
     """Get the global Monitor and start it if it's not already running.
+
+    A forked child process does not inherit the monitor thread, so the
+    child starts its own Monitor.
     """
-    global _monitor
+    global _monitor, _monitor_pid
     m = _monitor
-    if m is None:
+    if m is None or _monitor_pid != os.getpid():
+        if m is not None:
+            # Forked without os.register_at_fork().
+            _after_fork()
         _monitor_lock.acquire()
         try:
             if _monitor is None:
+                # The stats describe the global Monitor; start over
+                # along with its registration counters.
+                monitor_stats.reset()
                 _monitor = m = Monitor()
+                _monitor_pid = os.getpid()
+                for reporter in _installed:
+                    m.add(reporter)
                 m.start()
             else:
-                pass  # pragma no cover
+                m = _monitor  # pragma no cover
         finally:
             _monitor_lock.release()
     return m
+
+
+def _after_fork():
+    """Forget the Monitor of the parent process.  Called in a child."""
+    global _monitor, _monitor_pid, _monitor_lock
+    _monitor = None
+    _monitor_pid = None
+    # Another thread may have held the lock when the process forked.
+    _monitor_lock = allocate_lock()
+
+
+if hasattr(os, 'register_at_fork'):  # pragma no cover
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def install(reporter):
+    """Keep a Reporter registered with the global Monitor.
+
+    Installed reporters are periodic tasks that are not tied to a
+    request, such as flushing aggregated statistics.  They are added to
+    the global Monitor if it is running and to any Monitor that
+    get_monitor() starts later.
+    """
+    _monitor_lock.acquire()
+    try:
+        if reporter not in _installed:
+            _installed.append(reporter)
+            if _monitor is not None:
+                _monitor.add(reporter)
+    finally:
+        _monitor_lock.release()
+
+
+def uninstall(reporter):
+    """Stop keeping a Reporter registered with the global Monitor."""
+    _monitor_lock.acquire()
+    try:
+        if reporter in _installed:
+            _installed.remove(reporter)
+            if _monitor is not None:
+                _monitor.remove(reporter)
+    finally:
+        _monitor_lock.release()
+
+
+class StatsReporter(object):
+    """Send the overhead stats of the global Monitor to Statsd.
+
+    Counters are sent as increments and histograms as a count and a
+    mean (<name>_ms) since the previous report.
+    """
+    ident = None
+    monitor = None  # The Monitor of the previous report
+    counter_names = ('reports', 'errors', 'added', 'removed', 'cancelled')
+    gauge_names = ('reporters', 'slots', 'pending')
+    histogram_names = MonitorStats.histogram_names
+
+    def __init__(self, client, interval=60.0, prefix='slowlog.monitor'):
+        self.client = client
+        self.interval = interval
+        self.report_at = 0
+        self.prefix = prefix
+        self.last = {}  # {name: counter or histogram (count, total)}
+
+    def __call__(self, _report_time, frame=None):
+        m = _monitor
+        if m is not None:
+            if m is not self.monitor:
+                self.monitor = m
+                self.last = {}
+            self.send(m.get_stats())
+
+    def send(self, stats):
+        """Send a dict from Monitor.get_stats() to Statsd."""
+        client = self.client
+        prefix = self.prefix
+        last = self.last
+        buf = []
+        for name in self.counter_names:
+            value = stats[name]
+            client.incr('%s.%s' % (prefix, name), value - last.get(name, 0),
+                        buf=buf)
+            last[name] = value
+        for name in self.gauge_names:
+            client.gauge('%s.%s' % (prefix, name), stats[name], buf=buf)
+        for name in self.histogram_names:
+            count = stats[name]['count']
+            total = stats[name]['total']
+            last_count, last_total = last.get(name, (0, 0.0))
+            last[name] = (count, total)
+            if count > last_count:
+                client.incr('%s.%s' % (prefix, name), count - last_count,
+                            buf=buf)
+                mean = (total - last_total) / (count - last_count)
+                client.gauge('%s.%s_ms' % (prefix, name),
+                             '%.3f' % (mean * 1000), buf=buf)
+        client.sendbuf(buf)
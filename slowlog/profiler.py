@@ -0,0 +1,103 @@
+from slowlog.monitor import get_monitor
+from threading import Lock
+
+
+class SamplingProfiler(object):
+    """Sample the stacks of all request threads rate times per second.
+
+    The samples accumulate in a call tree of at most max_nodes nodes
+    keyed by code object; samples that need more nodes are counted at
+    the deepest existing node and in truncated.
+    """
+    ident = None
+
+    def __init__(self, rate=100.0, max_nodes=100000, frame_limit=100):
+        self.interval = 1.0 / rate
+        self.report_at = 0
+        self.max_nodes = max_nodes
+        self.frame_limit = frame_limit
+        self.lock = Lock()
+        self.get_monitor = get_monitor  # testing hook
+        self.clear()
+
+    def clear(self):
+        """Clear the call tree.  The caller must hold the lock."""
+        # A node is [samples, self_samples, {code: node}].
+        self.root = [0, 0, {}]
+        self.nodes = 1
+        self.samples = 0
+        self.truncated = 0
+
+    def reset(self):
+        """Clear the call tree."""
+        with self.lock:
+            self.clear()
+
+    def __call__(self, report_time, frame=None):
+        stacks = self.get_monitor().sample_stacks(report_time,
+                                                  self.frame_limit)
+        if not stacks:
+            return
+        with self.lock:
+            for stack in stacks.values():
+                self.add_stack(stack)
+
+    def add_stack(self, stack):
+        """Add a sample given the frames listed by walk_stack().
+
+        The caller must hold the lock.
+        """
+        node = self.root
+        node[0] += 1
+        for f in reversed(stack):
+            children = node[2]
+            co = f.f_code
+            child = children.get(co)
+            if child is None:
+                if self.nodes >= self.max_nodes:
+                    self.truncated += 1
+                    break
+                children[co] = child = [0, 0, {}]
+                self.nodes += 1
+            child[0] += 1
+            node = child
+        node[1] += 1
+        self.samples += 1
+
+    def snapshot(self, reset=False):
+        """Copy the call tree into nested dicts.
+
+        Each node has the keys name, filename, lineno (of the start of
+        the function), samples (including callees), self (samples in
+        the function itself) and children (sorted by samples, most
+        first).  The root node represents all samples.  If reset is
+        true, the tree is cleared after copying.
+        """
+        with self.lock:
+            res = {
+                'name': '(root)',
+                'filename': None,
+                'lineno': None,
+                'samples': self.root[0],
+                'self': self.root[1],
+                'children': copy_children(self.root[2]),
+                'truncated': self.truncated,
+            }
+            if reset:
+                self.clear()
+        return res
+
+
+def copy_children(children):
+    res = []
+    for co, (samples, self_samples, grandchildren) in children.items():
+        res.append({
+            'name': co.co_name,
+            'filename': co.co_filename,
+            'lineno': co.co_firstlineno,
+            'samples': samples,
+            'self': self_samples,
+            'children': copy_children(grandchildren),
+        })
+    res.sort(key=lambda node: node['samples'], reverse=True)
+    return res
@@ -0,0 +1,265 @@
+"""The base class of the loggers of slow requests."""
+
+from pprint import pformat
+from slowlog.compat import GreenletReporter
+from slowlog.compat import StringIO
+from slowlog.cputime import cpu_split
+from slowlog.exc import common_depth
+from slowlog.exc import print_frames
+from slowlog.exc import stack_key
+from slowlog.exc import walk_stack
+from slowlog.flightrecorder import format_timeline
+from slowlog.flightrecorder import timeline_data
+from slowlog.jsonlog import dump_report
+from slowlog.jsonlog import format_frames
+from slowlog.jsonlog import next_request_id
+from slowlog.stats import monitor_stats
+import time
+
+
+class RequestLogger(GreenletReporter):
+    """Logger for a particular request.
+
+    owner is the component (a tween or WSGI app) that provides the
+    settings.  Subclasses describe the request: they provide the
+    environ attribute, method_url(), details() and read_request_id().
+    """
+    logged_first = False
+    report_count = 0
+    request_id = None
+    barrier = None
+    cpu_start = None
+    coalesce = None
+    last_stack_key = None
+    stack_since = None
+
+    def __init__(self, owner, start, report_at, ident=None):
+        self.owner = owner
+        self.start = start
+        self.report_at = report_at
+        self.set_ident(ident)
+        self.interval = owner.interval
+        if owner.cpu and self.greenlet is None:
+            # The CPU clock of the thread is shared by its greenlets.
+            self.cpu_start = self.environ.get('slowlog.cpu_start')
+        if owner.coalesce:
+            self.coalesce = owner
+
+    def method_url(self):  # pragma no cover
+        """Get the (method, URL) of the request."""
+        raise NotImplementedError()
+
+    def details(self):  # pragma no cover
+        """List the (name, value) details of the first report."""
+        raise NotImplementedError()
+
+    def read_request_id(self):  # pragma no cover
+        """Get the X-Request-Id header of the request, or None."""
+        raise NotImplementedError()
+
+    def __call__(self, report_time, frame=None):
+        stack = None
+        if frame is not None:
+            stack = self.walk(frame)
+            del frame
+        self.report_stack(report_time, stack)
+
+    def walk(self, frame):
+        """List the frames of the request, innermost first."""
+        return walk_stack(frame, self.owner.frame_limit, self.barrier)
+
+    def report_group(self, report_time, stack, others):
+        """Log one report for this request and others with the same stack.
+        """
+        for other in others:
+            other.count_report()
+        self.report_stack(report_time, stack, others)
+
+    def count_report(self):
+        """Count a report and apply the backoff policy."""
+        self.report_count += 1
+        backoff = self.owner.backoff
+        if backoff is not None:
+            # The monitor has scheduled the next report; this changes
+            # the interval after it, or stops reporting.
+            self.interval = backoff.next_interval(self.interval,
+                                                  self.report_count)
+
+    def report_stack(self, report_time, stack, others=()):
+        """Log a report given the frames listed by walk_stack(), or None.
+
+        others lists the loggers of requests with the same stack.
+        """
+        self.count_report()
+        owner = self.owner
+        if owner.format == 'json':
+            self.log_json(report_time, stack, others)
+            return
+
+        elapsed = report_time - self.start
+        lines = ['request: %s %s' % self.method_url()]
+        split = None
+        if stack is not None:
+            # The thread is still running.
+            split = cpu_split(self.ident, self.cpu_start, elapsed)
+        if split is not None:
+            lines.append('cpu: %.2f secs; wait: %.2f secs' % split)
+
+        if not self.logged_first:
+            for name, value in self.details():
+                lines.append('%s: %s' % (name, pformat(value)))
+            recorder = owner.recorder
+            if recorder is not None and self.greenlet is None:
+                timeline = recorder.timeline(self.ident, self.start)
+                if timeline:
+                    lines.append(format_timeline(timeline, self.start))
+            self.logged_first = True
+
+        if others:
+            lines.append('same stack in %d other request%s:' % (
+                len(others), '' if len(others) == 1 else 's'))
+            for other in others:
+                lines.append('  thread %(thread)s: running for '
+                             '%(elapsed).1f secs; request: %(method)s %(url)s'
+                             % other.describe(report_time))
+
+        if stack is not None:
+            limit = owner.frame_limit
+            if limit > 0:
+                lines.append(self.format_stack(report_time, stack[:limit]))
+
+        msg = '\n'.join(lines)
+        started = time.time()
+        owner.log.warning("Thread %s: Started on %.1f; "
+                          "Running for %.1f secs; %s",
+                          self.ident, self.start, elapsed, msg)
+        monitor_stats.log.add(time.time() - started)
+
+    def log_json(self, report_time, stack=None, others=()):
+        """Log the report as one line of JSON."""
+        owner = self.owner
+        extra = {}
+        if not self.logged_first:
+            self.get_request_id()
+            for name, value in self.details():
+                extra[name] = value
+            recorder = owner.recorder
+            if recorder is not None and self.greenlet is None:
+                extra['timeline'] = timeline_data(
+                    recorder.timeline(self.ident, self.start), self.start)
+            self.logged_first = True
+
+        if stack is not None:
+            split = cpu_split(self.ident, self.cpu_start,
+                              report_time - self.start)
+            if split is not None:
+                extra['cpu'], extra['wait'] = [round(x, 3) for x in split]
+
+        if others:
+            extra['others'] = [other.describe(report_time)
+                               for other in others]
+
+        frames = None
+        if stack is not None and owner.frame_limit > 0:
+            stack = stack[:owner.frame_limit]
+            diff = None
+            if owner.compact:
+                diff = self.diff_stack(report_time, stack)
+            if diff is None:
+                frames = format_frames(stack)
+            elif diff[1] is not None:
+                extra['unchanged'] = round(report_time - diff[1], 3)
+            else:
+                extra['common'] = diff[0]
+                frames = format_frames(stack[:len(stack) - diff[0]])
+
+        method, url = self.method_url()
+        report = dump_report(
+            self.ident, self.request_id, self.start,
+            report_time - self.start, method, url, frames, **extra)
+        started = time.time()
+        owner.log.warning('%s', report)
+        monitor_stats.log.add(time.time() - started)
+
+    def format_stack(self, report_time, stack):
+        """Format the traceback of a text report."""
+        diff = None
+        if self.owner.compact:
+            diff = self.diff_stack(report_time, stack)
+        if diff is None:
+            head = 'Traceback:\n'
+        else:
+            depth, since = diff
+            if since is not None:
+                return 'Stack unchanged for %.1f secs' % (report_time - since)
+            head = 'Traceback (after %d unchanged frames):\n' % depth
+            stack = stack[:len(stack) - depth]
+        tb = StringIO()
+        tb.write(head)
+        print_frames(stack, tb)
+        return tb.getvalue()
+
+    def diff_stack(self, report_time, stack):
+        """Compare a stack with the stack logged in the previous report.
+
+        Returns None if the stack should be logged in full.  Otherwise
+        returns (depth, since), where depth is the number of outermost
+        frames shared with the previous stack and since is the time the
+        stack was first logged if it is unchanged, or None.
+        """
+        key = stack_key(stack)
+        last_key = self.last_stack_key
+        self.last_stack_key = key
+        if last_key is None:
+            self.stack_since = report_time
+            return None
+        if key == last_key:
+            return len(key), self.stack_since
+        self.stack_since = report_time
+        return common_depth(last_key, key), None
+
+    def get_request_id(self):
+        """Get the ID of the request from X-Request-Id or a counter."""
+        if self.request_id is None:
+            self.request_id = self.read_request_id() or next_request_id()
+        return self.request_id
+
+    def describe(self, report_time):
+        """Describe the request for the report of another request."""
+        method, url = self.method_url()
+        return {
+            'thread': self.ident,
+            'request_id': self.get_request_id(),
+            'elapsed': round(report_time - self.start, 3),
+            'method': method,
+            'url': url,
+        }
+
+    def finish(self, end_time, status):
+        """Log a summary of a reported request when it completes."""
+        owner = self.owner
+        method, url = self.method_url()
+        elapsed = end_time - self.start
+        split = cpu_split(self.ident, self.cpu_start, elapsed)
+        if owner.format == 'json':
+            extra = {}
+            if split is not None:
+                extra['cpu'], extra['wait'] = [round(x, 3) for x in split]
+            owner.log.warning('%s', dump_report(
+                self.ident, self.request_id, self.start, elapsed, method,
+                url, finished=True, status=status,
+                reports=self.report_count, **extra))
+            return
+        cpu = ''
+        if split is not None:
+            cpu = '; cpu: %.2f secs; wait: %.2f secs' % split
+        owner.log.warning("Thread %s: Started on %.1f; "
+                          "Finished after %.1f secs; request: %s %s; "
+                          "status: %s; reports: %d%s",
+                          self.ident, self.start, elapsed, method, url,
+                          status, self.report_count, cpu)
+
+
+class Hidden(object):
+    def __repr__(self):
+        return '<hidden>'
@@ -0,0 +1,78 @@
+"""Counters and timing histograms of the work slowlog itself does.
+
+The monitor thread updates monitor_stats as it polls, sweeps, extracts
+stacks and logs reports.  Read them with Monitor.get_stats(), or push
+them to Statsd with slowlog.monitor.StatsReporter.
+"""
+
+from bisect import bisect_left
+
+
+class Histogram(object):
+    """Counts of durations in buckets with fixed upper bounds in seconds.
+
+    The last bucket counts durations beyond the last bound.  Only one
+    thread should call add().
+    """
+    bounds = (0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """Count a duration."""
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self):
+        """Return a dict of the count, total, max and bucket counts.
+
+        buckets is a list of (upper bound, count) pairs.
+        """
+        bounds = self.bounds + (float('inf'),)
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'buckets': list(zip(bounds, self.counts)),
+        }
+
+
+class MonitorStats(object):
+    """The overhead counters and histograms of a monitor.
+
+    reports counts calls to reporters (a coalesced group counts once)
+    and errors counts the exceptions raised by reporters and slot
+    owners.  The histograms time each wakeup of the monitor thread
+    (sweep), each reporter call (report), each stack extraction
+    (extract) and each report written to a log (log).
+    """
+    histogram_names = ('sweep', 'report', 'extract', 'log')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clear the counters and histograms."""
+        self.reports = 0
+        self.errors = 0
+        self.sweep = Histogram()
+        self.report = Histogram()
+        self.extract = Histogram()
+        self.log = Histogram()
+
+    def snapshot(self):
+        """Return a dict of the counters and histogram snapshots."""
+        res = {'reports': self.reports, 'errors': self.errors}
+        for name in self.histogram_names:
+            res[name] = getattr(self, name).snapshot()
+        return res
+
+
+monitor_stats = MonitorStats()
@@ -0,0 +1,118 @@
+"""Tests of slowlog.aio"""
+
+import asyncio
+import sys
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+def block_loop(seconds):
+    time.sleep(seconds)
+
+
+class TestLoopWatchdog(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.aio import LoopWatchdog
+        return LoopWatchdog
+
+    def _make(self, **kw):
+        obj = self._class(**kw)
+        self.logged = logged = []
+        self.sent = sent = []
+
+        class DummyLogger:
+            def warning(self, msg, *args):
+                logged.append(msg % args)
+
+        class DummyClient:
+            def sendbuf(self, buf):
+                sent.append(('sendbuf', buf))
+
+            def incr(self, stat, count=1, buf=None):
+                buf.append('%s:%s|c' % (stat, count))
+
+            def timing(self, stat, value):
+                sent.append(('timing', stat, value))
+
+        obj.log = DummyLogger()
+        obj.client = DummyClient()
+        obj.ident = 123
+        return obj
+
+    def test_ctor(self):
+        obj = self._class(threshold=0.2)
+        self.assertEqual(obj.interval, 0.1)
+        self.assertEqual(obj.beat_interval, 0.1)
+        self.assertIsNone(obj.ident)
+        self.assertIsNone(obj.client)
+
+    def test_ctor_with_statsd_uri(self):
+        obj = self._class(statsd_uri='statsd://localhost:9999')
+        self.assertIsNotNone(obj.client)
+
+    def test_call_before_first_beat(self):
+        obj = self._make()
+        obj(1000.0, sys._getframe())
+        self.assertEqual(self.logged, [])
+
+    def test_call_with_timely_beat(self):
+        obj = self._make(threshold=0.1)
+        obj.beat_at = 1000.0
+        obj(1000.1, sys._getframe())
+        self.assertEqual(self.logged, [])
+
+    def test_call_reports_each_stall_once(self):
+        obj = self._make(threshold=0.1)
+        obj.beat_at = 1000.0
+        obj(1000.2, sys._getframe())
+        obj(1000.3, sys._getframe())
+        self.assertEqual(len(self.logged), 1)
+        self.assertTrue(self.logged[0].startswith(
+            'Event loop thread 123: Blocked for 0.150 secs\nTraceback:\n'))
+        self.assertIn('in test_call_reports_each_stall_once',
+                      self.logged[0])
+        self.assertEqual(self.sent[0][0], 'sendbuf')
+        # The loop resumes.
+        obj.beat_at = 1000.55
+        obj(1000.6, sys._getframe())
+        self.assertEqual(self.logged[1],
+                         'Event loop thread 123: Unblocked after 0.500 secs')
+        self.assertEqual(self.sent[-1],
+                         ('timing', 'slowlog.loop_blocked', 500))
+        self.assertIsNone(obj.blocked_since)
+
+    def test_call_without_frame(self):
+        obj = self._make(threshold=0.1)
+        obj.beat_at = 1000.0
+        obj(1000.2)
+        self.assertEqual(self.logged, [])
+
+    def test_detects_blocked_loop(self):
+        from slowlog.compat import StringIO
+        f = StringIO()
+        obj = self._class(threshold=0.05, logfile=f)
+
+        async def main():
+            obj.start()
+            await asyncio.sleep(0.1)
+            block_loop(0.3)
+            await asyncio.sleep(0.1)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(main())
+        finally:
+            obj.stop()
+            loop.close()
+        from slowlog.compat import get_ident
+        self.assertEqual(obj.ident, get_ident())
+        logged = f.getvalue()
+        self.assertIn('Event loop thread %s: Blocked for' % obj.ident, logged)
+        self.assertIn(', in block_loop\n    time.sleep(seconds)', logged)
+        self.assertIn('Unblocked after 0.', logged)
@@ -0,0 +1,324 @@
+"""Tests of slowlog.analyze"""
+
+import gzip
+import os
+import shutil
+import tempfile
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+TEXT_LOG = '''\
+2012-09-22 10:00:00,000 - Thread 1: Started on 100.0; \
+Running for 2.0 secs; request: GET http://example.com/a
+environ: {'PATH_INFO': '/a'}
+Traceback:
+  File "/app/views.py", line 10, in view
+    return query()
+  File "/app/db.py", line 20, in query
+    cursor.execute(sql)
+2012-09-22 10:00:01,000 - Thread 1: Started on 100.0; \
+Running for 3.0 secs; request: GET http://example.com/a
+Traceback:
+  File "/app/views.py", line 10, in view
+    return query()
+  File "/app/db.py", line 20, in query
+    cursor.execute(sql)
+2012-09-22 10:00:02,000 - Thread 2: Started on 101.0; \
+Running for 2.0 secs; request: POST http://example.com/b
+post: {'password': <hidden>}
+'''
+
+JSON_LOG = '''\
+{"elapsed": 2.0, "frames": [{"code": "render()", "file": "/app/views.py", \
+"line": 30, "name": "other"}], "method": "GET", "request_id": "1", \
+"start": 100.0, "thread": 3, "url": "http://example.com/c"}
+not json
+{"elapsed": 2.0, "frames": null, "method": "GET", "request_id": "2", \
+"start": 100.0, "thread": 3, "url": "http://example.com/a"}
+'''
+
+
+class TestTopCounter(unittest.TestCase):
+
+    def _make(self, capacity):
+        from slowlog.analyze import TopCounter
+        return TopCounter(capacity)
+
+    def test_top(self):
+        obj = self._make(10)
+        for key in 'abacab':
+            obj.add(key)
+        self.assertEqual(obj.top(2), [('a', 3), ('b', 2)])
+        self.assertEqual(obj.dropped, 0)
+
+    def test_prune(self):
+        obj = self._make(1)
+        obj.add('a', 5)
+        obj.add('b', 2)
+        self.assertEqual(len(obj.counts), 2)
+        obj.add('c', 1)
+        self.assertEqual(obj.counts, {'a': 5})
+        self.assertEqual(obj.dropped, 5)
+
+    def test_update(self):
+        obj = self._make(10)
+        obj.add('a')
+        other = self._make(10)
+        other.add('a', 2)
+        other.add('b')
+        other.dropped = 1
+        obj.update(other)
+        self.assertEqual(obj.counts, {'a': 3, 'b': 1})
+        self.assertEqual(obj.dropped, 1)
+
+
+class Test_parse_reports(unittest.TestCase):
+
+    def _call(self, text):
+        from slowlog.analyze import parse_reports
+        return list(parse_reports(text.splitlines()))
+
+    def test_text(self):
+        reports = self._call(TEXT_LOG)
+        stack = [('/app/views.py', 10, 'view'), ('/app/db.py', 20, 'query')]
+        self.assertEqual(reports, [
+            ('GET', 'http://example.com/a', stack),
+            ('GET', 'http://example.com/a', stack),
+            ('POST', 'http://example.com/b', []),
+        ])
+
+    def test_text_with_timeline(self):
+        reports = self._call('''\
+2012-09-22 10:00:00,000 - Thread 1: Started on 100.0; \
+Running for 2.0 secs; request: GET http://example.com/a
+timeline:
+  +0.10s 1 sample: stack 0
+stack 0:
+  File "/app/startup.py", line 5, in startup
+    load()
+Traceback:
+  File "/app/views.py", line 10, in view
+    return query()
+''')
+        self.assertEqual(reports, [
+            ('GET', 'http://example.com/a', [('/app/views.py', 10, 'view')]),
+        ])
+
+    def test_json(self):
+        reports = self._call(JSON_LOG)
+        self.assertEqual(reports, [
+            ('GET', 'http://example.com/c', [('/app/views.py', 30, 'other')]),
+            ('GET', 'http://example.com/a', []),
+        ])
+
+    def test_json_skips_summaries(self):
+        reports = self._call(
+            '{"elapsed": 3.0, "finished": true, "frames": null, '
+            '"method": "GET", "reports": 1, "status": "200 OK", '
+            '"url": "http://example.com/a"}\n')
+        self.assertEqual(reports, [])
+
+    def test_text_with_others(self):
+        reports = self._call('''\
+2012-09-22 10:00:00,000 - Thread 1: Started on 100.0; \
+Running for 2.0 secs; request: GET http://example.com/a
+same stack in 1 other request:
+  thread 2: running for 3.0 secs; request: POST http://example.com/b
+Traceback:
+  File "/app/views.py", line 10, in view
+    return query()
+''')
+        stack = [('/app/views.py', 10, 'view')]
+        self.assertEqual(reports, [
+            ('GET', 'http://example.com/a', stack),
+            ('POST', 'http://example.com/b', stack),
+        ])
+
+    def test_json_with_others(self):
+        reports = self._call(
+            '{"frames": [{"file": "/app/views.py", "line": 10, '
+            '"name": "view", "code": "return query()"}], '
+            '"method": "GET", "url": "http://example.com/a", '
+            '"others": [{"method": "POST", "url": "http://example.com/b", '
+            '"thread": 2, "request_id": "2", "elapsed": 3.0}]}\n')
+        stack = [('/app/views.py', 10, 'view')]
+        self.assertEqual(reports, [
+            ('GET', 'http://example.com/a', stack),
+            ('POST', 'http://example.com/b', stack),
+        ])
+
+    def test_text_compact(self):
+        reports = self._call('''\
+2012-09-22 10:00:00,000 - Thread 1: Started on 100.0; \
+Running for 2.0 secs; request: GET http://example.com/a
+Traceback:
+  File "/app/views.py", line 10, in view
+    return query()
+  File "/app/db.py", line 20, in query
+    return execute()
+2012-09-22 10:00:01,000 - Thread 1: Started on 100.0; \
+Running for 3.0 secs; request: GET http://example.com/a
+Stack unchanged for 1.0 secs
+2012-09-22 10:00:02,000 - Thread 1: Started on 100.0; \
+Running for 4.0 secs; request: GET http://example.com/a
+Traceback (after 1 unchanged frames):
+  File "/app/cache.py", line 5, in lookup
+    return get()
+''')
+        views = ('/app/views.py', 10, 'view')
+        query = ('/app/db.py', 20, 'query')
+        lookup = ('/app/cache.py', 5, 'lookup')
+        self.assertEqual([frames for _m, _u, frames in reports], [
+            [views, query],
+            [views, query],
+            [views, lookup],
+        ])
+
+    def test_json_compact(self):
+        reports = self._call(
+            '{"frames": [{"file": "/app/views.py", "line": 10, '
+            '"name": "view", "code": ""}, {"file": "/app/db.py", '
+            '"line": 20, "name": "query", "code": ""}], "method": "GET", '
+            '"start": 100.0, "thread": 1, "url": "http://example.com/a"}\n'
+            '{"frames": null, "method": "GET", "start": 100.0, '
+            '"thread": 1, "unchanged": 1.0, "url": "http://example.com/a"}\n'
+            '{"common": 1, "frames": [{"file": "/app/cache.py", "line": 5, '
+            '"name": "lookup", "code": ""}], "method": "GET", '
+            '"start": 100.0, "thread": 1, "url": "http://example.com/a"}\n')
+        views = ('/app/views.py', 10, 'view')
+        query = ('/app/db.py', 20, 'query')
+        lookup = ('/app/cache.py', 5, 'lookup')
+        self.assertEqual([frames for _m, _u, frames in reports], [
+            [views, query],
+            [views, query],
+            [views, lookup],
+        ])
+
+    def test_text_skips_watchdog_reports(self):
+        reports = self._call('''\
+2012-09-22 10:00:00,000 - Thread 1: Started on 100.0; \
+Running for 2.0 secs; request: GET http://example.com/a
+Traceback:
+  File "/app/views.py", line 10, in view
+    return query()
+2012-09-22 10:00:01,000 - Event loop thread 1: Blocked for 0.250 secs
+Traceback:
+  File "/app/cpu.py", line 5, in crunch
+    work()
+''')
+        self.assertEqual(reports, [
+            ('GET', 'http://example.com/a', [('/app/views.py', 10, 'view')]),
+        ])
+
+    def test_finished(self):
+        finished = []
+        from slowlog.analyze import parse_reports
+        lines = [
+            '2012-09-22 10:00:03,000 - Thread 1: Started on 100.0; '
+            'Finished after 4.0 secs; request: GET http://example.com/a; '
+            'status: 200 OK; reports: 2; cpu: 1.25 secs; wait: 2.75 secs',
+            '2012-09-22 10:00:04,000 - Thread 1: Started on 100.0; '
+            'Finished after 4.0 secs; request: GET http://example.com/b; '
+            'status: 200 OK; reports: 2',
+            '{"cpu": 0.5, "finished": true, "method": "POST", '
+            '"url": "http://example.com/c", "wait": 1.5}',
+        ]
+        reports = list(parse_reports(lines, lambda *args: finished.append(
+            args)))
+        self.assertEqual(reports, [])
+        self.assertEqual(finished, [
+            ('GET', 'http://example.com/a', 1.25, 2.75),
+            ('POST', 'http://example.com/c', 0.5, 1.5),
+        ])
+
+
+class TestSummary(unittest.TestCase):
+
+    def test_add(self):
+        from slowlog.analyze import Summary
+        obj = Summary()
+        obj.add('GET', '/a', [('x.py', 1, 'f'), ('y.py', 2, 'g')])
+        obj.add('GET', '/a', [])
+        self.assertEqual(obj.reports, 2)
+        self.assertEqual(obj.urls.counts, {'GET /a': 2})
+        self.assertEqual(obj.frames.counts, {'y.py:2(g)': 1})
+        self.assertEqual(obj.stacks.counts, {'y.py:2(g) < x.py:1(f)': 1})
+
+
+    def test_add_finished(self):
+        from slowlog.analyze import Summary
+        obj = Summary()
+        obj.add_finished('GET', '/a', 1.0, 2.0)
+        obj.add_finished('GET', '/a', 0.5, 0.5)
+        other = Summary()
+        other.add_finished('GET', '/b', 3.0, 0.0)
+        obj.update(other)
+        self.assertEqual(obj.finished, 3)
+        self.assertEqual(obj.cpu.counts, {'GET /a': 1.5, 'GET /b': 3.0})
+        self.assertEqual(obj.wait.counts, {'GET /a': 2.5, 'GET /b': 0.0})
+
+
+class Test_main(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'slow.log')
+        with open(self.path, 'w') as f:
+            f.write(TEXT_LOG)
+        with open(self.path + '.1', 'w') as f:
+            f.write(JSON_LOG)
+        f = gzip.open(self.path + '.2.gz', 'wb')
+        f.write(TEXT_LOG.encode('utf-8'))
+        f.close()
+        with open(self.path + '.bak', 'w') as f:
+            f.write(TEXT_LOG)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _call(self, *args):
+        from slowlog.analyze import main
+        from slowlog.compat import StringIO
+        out = StringIO()
+        self.assertEqual(main(list(args), out), 0)
+        return out.getvalue()
+
+    def test_expand_paths(self):
+        from slowlog.analyze import expand_paths
+        self.assertEqual(expand_paths([self.path]), [
+            self.path, self.path + '.1', self.path + '.2.gz'])
+        self.assertEqual(expand_paths([self.path], rotated=False),
+                         [self.path])
+
+    def test_it(self):
+        out = self._call('-j', '1', '-n', '1', self.path)
+        self.assertIn('8 reports in 3 files', out)
+        self.assertIn('         5  GET http://example.com/a', out)
+        self.assertIn('         4  /app/db.py:20(query)\n', out)
+        self.assertIn('4  /app/db.py:20(query) < /app/views.py:10(view)',
+                      out)
+        self.assertNotIn('example.com/b', out)
+
+    def test_with_processes(self):
+        out = self._call('-j', '2', self.path)
+        self.assertIn('8 reports in 3 files', out)
+        self.assertIn('         5  GET http://example.com/a', out)
+        self.assertIn('         2  POST http://example.com/b', out)
+
+    def test_cpu_table(self):
+        self.assertNotIn('CPU time', self._call('-j', '1', self.path))
+        with open(self.path, 'a') as f:
+            f.write('2012-09-22 10:00:03,000 - Thread 1: Started on 100.0; '
+                    'Finished after 4.0 secs; '
+                    'request: GET http://example.com/a; status: 200 OK; '
+                    'reports: 2; cpu: 1.00 secs; wait: 3.00 secs\n')
+        out = self._call('-j', '1', '--no-rotated', self.path)
+        self.assertIn('3 reports in 1 files', out)
+        self.assertIn('Top URLs by CPU time (1 completed requests)\n'
+                      '  cpu secs   wait secs   cpu%  key\n'
+                      '      1.00        3.00   25.0  '
+                      'GET http://example.com/a\n', out)
@@ -0,0 +1,326 @@
+"""Tests of slowlog.asgi"""
+
+import asyncio
+import sys
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def make_scope(**kw):
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'server': ('example.com', 8080),
+        'root_path': '',
+        'path': '/stuff',
+        'query_string': b'x=1',
+        'headers': [(b'host', b'example.com'),
+                    (b'x-request-id', b'abc'),
+                    (b'cookie', b'secret=1')],
+    }
+    scope.update(kw)
+    return scope
+
+
+async def inner(event):
+    await event.wait()
+
+
+async def outer(event):
+    await inner(event)
+
+
+class Test_task_frame(unittest.TestCase):
+
+    def _call(self, task, thread_frame=None):
+        from slowlog.asgi import task_frame
+        return task_frame(task, thread_frame)
+
+    def _names(self, frame):
+        names = []
+        while frame is not None:
+            names.append(frame.f_code.co_name)
+            frame = frame.f_back
+        return names
+
+    def test_suspended_task(self):
+        async def main():
+            event = asyncio.Event()
+            task = asyncio.ensure_future(outer(event))
+            await asyncio.sleep(0)
+            frame = self._call(task)
+            event.set()
+            await task
+            return frame
+
+        frame = run(main())
+        # Innermost first, ending at the coroutine of the task.
+        self.assertEqual(self._names(frame)[:3], ['wait', 'inner', 'outer'])
+        self.assertEqual(frame.f_back.f_globals['__name__'], __name__)
+        self.assertIn('event', frame.f_back.f_locals)
+
+    def test_running_task(self):
+        def blocking():
+            return self._call(asyncio.current_task(), sys._getframe())
+
+        async def handler():
+            return blocking()
+
+        frame = run(handler())
+        self.assertEqual(self._names(frame)[:2], ['blocking', 'handler'])
+        self.assertIsNone(frame.f_back.f_back)
+
+    def test_done_task(self):
+        async def main():
+            task = asyncio.ensure_future(asyncio.sleep(0))
+            await task
+            return self._call(task)
+
+        self.assertIsNone(run(main()))
+
+
+class Test_scope_environ(unittest.TestCase):
+
+    def _call(self, scope):
+        from slowlog.asgi import scope_environ
+        return scope_environ(scope)
+
+    def test_it(self):
+        from slowlog.wsgi import construct_url
+        environ = self._call(make_scope(headers=[
+            (b'host', b'example.com:8080'),
+            (b'content-type', b'text/plain'),
+            (b'accept', b'text/html'),
+            (b'accept', b'*/*'),
+        ]))
+        self.assertEqual(environ['REQUEST_METHOD'], 'GET')
+        self.assertEqual(environ['QUERY_STRING'], 'x=1')
+        self.assertEqual(environ['SERVER_PORT'], '8080')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,*/*')
+        self.assertEqual(construct_url(environ),
+                         'http://example.com:8080/stuff?x=1')
+
+    def test_without_server(self):
+        environ = self._call({'type': 'http', 'path': '/'})
+        self.assertEqual(environ['SERVER_NAME'], 'localhost')
+        self.assertEqual(environ['wsgi.url_scheme'], 'http')
+
+
+class DummyMonitor(object):
+    wake_at = float('inf')
+
+    def __init__(self):
+        self.slots = {}
+        self.slot_reporters = {}
+        self.woken = 0
+
+    def wake(self):
+        self.woken += 1
+
+    def get_slot_reporter(self, key, slot):
+        entry = self.slot_reporters.get(key)
+        if entry is not None and entry[0] is slot:
+            return entry[1]
+        return None
+
+
+class TestSlowLogMiddleware(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.asgi import SlowLogMiddleware
+        return SlowLogMiddleware
+
+    def _make(self, app_error=None, **kw):
+        self.handled_slots = handled_slots = []
+        self.sent = sent = []
+        monitor = self.monitor = DummyMonitor()
+
+        async def dummy_app(scope, receive, send):
+            handled_slots.append(dict(monitor.slots))
+            await send({'type': 'http.response.start', 'status': 200})
+            if app_error is not None:
+                raise app_error
+            await send({'type': 'http.response.body', 'body': b'ok'})
+
+        async def dummy_send(message):
+            sent.append(message)
+
+        self.send = dummy_send
+        obj = self._class(dummy_app, **kw)
+        obj.get_monitor = lambda: monitor
+        return obj
+
+    def _call(self, obj, scope=None):
+        async def receive():  # pragma no cover
+            return {'type': 'http.request'}
+
+        return run(obj(scope or make_scope(), receive, self.send))
+
+    def test_ctor(self):
+        obj = self._make(timeout=0.5, backoff=2.0, compact=True)
+        self.assertEqual(obj.timeout, 0.5)
+        self.assertEqual(obj.backoff.factor, 2.0)
+        self.assertTrue(obj.compact)
+        self.assertFalse(obj.coalesce)
+        self.assertIsNone(obj.recorder)
+        self.assertFalse(obj.cpu)
+
+    def test_call_registers_task(self):
+        obj = self._make()
+        self._call(obj)
+        self.assertEqual(len(self.handled_slots[0]), 1)
+        key, slot = list(self.handled_slots[0].items())[0]
+        self.assertIsInstance(key[0], asyncio.Task)
+        self.assertIs(key[1], obj)
+        report_at, start, (scope, ident) = slot
+        self.assertAlmostEqual(report_at, start + 2.0)
+        self.assertEqual(scope['path'], '/stuff')
+        from slowlog.compat import get_ident
+        self.assertEqual(ident, get_ident())
+        self.assertEqual(self.monitor.slots, {})
+        self.assertEqual(self.monitor.woken, 1)
+        self.assertEqual([m['type'] for m in self.sent],
+                         ['http.response.start', 'http.response.body'])
+
+    def test_call_nested(self):
+        obj = self._make()
+        next_app = obj.app
+        calls = []
+
+        async def app(scope, receive, send):
+            calls.append(len(self.monitor.slots))
+            if len(calls) == 1:
+                await obj(scope, receive, send)
+            else:
+                await next_app(scope, receive, send)
+
+        obj.app = app
+        self._call(obj)
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(self.monitor.slots, {})
+
+    def test_call_ignores_lifespan(self):
+        obj = self._make()
+        self._call(obj, {'type': 'lifespan'})
+        self.assertEqual(self.handled_slots, [{}])
+
+    def _make_reporter(self, obj):
+        from slowlog.asgi import TaskRequestLogger
+
+        class DummyReporter(TaskRequestLogger):
+            report_count = 1
+
+            def finish(self, end_time, status):
+                finished.append(status)
+
+        finished = self.finished = []
+        monitor = self.monitor
+        next_app = obj.app
+
+        async def app(scope, receive, send):
+            key, slot = list(monitor.slots.items())[0]
+            reporter = DummyReporter(obj, scope, slot[1], slot[0],
+                                     slot[2][1], key[0])
+            monitor.slot_reporters[key] = (slot, reporter)
+            await next_app(scope, receive, send)
+
+        obj.app = app
+
+    def test_call_summarizes_reported_request(self):
+        obj = self._make()
+        self._make_reporter(obj)
+        self._call(obj)
+        self.assertEqual(self.finished, [200])
+
+    def test_call_summarizes_reported_request_with_error(self):
+        obj = self._make(app_error=ValueError('synthetic'))
+        self._make_reporter(obj)
+        with self.assertRaises(ValueError):
+            self._call(obj)
+        self.assertEqual(self.finished, ['ValueError'])
+
+    def test_make_reporter(self):
+        from slowlog.asgi import TaskRequestLogger
+
+        async def main():
+            return obj.make_reporter((make_scope(), 543), 1000.0, 1002.0,
+                                     asyncio.current_task())
+
+        obj = self._make(coalesce=True)
+        reporter = run(main())
+        self.assertIsInstance(reporter, TaskRequestLogger)
+        self.assertEqual(reporter.ident, 543)
+        self.assertEqual(reporter.report_at, 1002.0)
+        self.assertIs(reporter.coalesce, obj)
+        self.assertEqual(reporter.get_request_id(), 'abc')
+        self.assertIsNone(reporter.get_frame(None))
+
+    def test_reports_slow_task(self):
+        from slowlog.compat import StringIO
+        from slowlog.monitor import Monitor
+
+        async def slow_app(scope, receive, send):
+            await asyncio.sleep(0.3)
+            await send({'type': 'http.response.start', 'status': 200})
+
+        async def send(message):
+            pass
+
+        self.send = send
+        f = StringIO()
+        obj = self._class(slow_app, timeout=0.05, interval=10.0, logfile=f)
+        monitor = Monitor()
+        monitor.start()
+        obj.get_monitor = lambda: monitor
+        try:
+            self._call(obj)
+        finally:
+            monitor.stop()
+            monitor.join()
+        logged = f.getvalue()
+        self.assertIn('request: GET http://example.com/stuff?x=1', logged)
+        self.assertIn("'HTTP_COOKIE': <hidden>", logged)
+        self.assertIn(', in slow_app\n    await asyncio.sleep(0.3)', logged)
+        self.assertIn('status: 200; reports: 1', logged)
+
+
+class TestFrameStatsMiddleware(unittest.TestCase):
+
+    def test_make_reporter(self):
+        from slowlog.asgi import FrameStatsMiddleware
+        from slowlog.asgi import TaskFrameStatsReporter
+
+        async def main():
+            event = asyncio.Event()
+            task = asyncio.ensure_future(outer(event))
+            await asyncio.sleep(0)
+            reporter = obj.make_reporter((make_scope(), 543), time.time(),
+                                         1002.0, task)
+            frame = reporter.get_frame(None)
+            event.set()
+            await task
+            return reporter, frame
+
+        obj = FrameStatsMiddleware(None, 'statsd://localhost:9999',
+                                   interval=0.5)
+        reporter, frame = run(main())
+        self.assertIsInstance(reporter, TaskFrameStatsReporter)
+        self.assertEqual(reporter.ident, 543)
+        self.assertEqual(reporter.interval, 0.5)
+        self.assertEqual(frame.f_back.f_code.co_name, 'inner')
@@ -0,0 +1,194 @@
+"""Tests of slowlog.combined"""
+
+import sys
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class DummyReporter(object):
+
+    def __init__(self, report_at, interval, error=None):
+        self.report_at = report_at
+        self.interval = interval
+        self.error = error
+        self.reported = []
+
+    def report_stack(self, report_time, stack):
+        self.reported.append((report_time, stack))
+        if self.error is not None:
+            raise self.error
+
+
+class DummyLogger(DummyReporter):
+    coalesce = 'owner'
+
+    def __init__(self, report_at, interval, error=None):
+        DummyReporter.__init__(self, report_at, interval, error)
+        self.groups = []
+
+    def report_group(self, report_time, stack, others):
+        self.groups.append((report_time, stack, others))
+
+
+class TestCombinedReporter(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.combined import CombinedReporter
+        return CombinedReporter
+
+    def test_ctor(self):
+        a = DummyReporter(1002.0, 1.0)
+        b = DummyReporter(1001.0, 5.0)
+        obj = self._class([a, b], 10, ident=543)
+        self.assertEqual(obj.report_at, 1001.0)
+        self.assertEqual(obj.interval, 1.0)
+        self.assertEqual(obj.ident, 543)
+        self.assertIsNone(obj.barrier)
+
+    def test_ctor_with_default_ident(self):
+        from slowlog.compat import get_ident
+        obj = self._class([DummyReporter(1000.0, 1.0)])
+        self.assertEqual(obj.ident, get_ident())
+
+    def test_call_shares_one_stack(self):
+        a = DummyReporter(1000.0, 1.0)
+        b = DummyReporter(1000.0, 5.0)
+        obj = self._class([a, b], 2)
+        frame = sys._getframe()
+        obj(1000.5, frame)
+        self.assertEqual(len(a.reported), 1)
+        stack = a.reported[0][1]
+        self.assertEqual(stack, [frame, frame.f_back])
+        self.assertIs(b.reported[0][1], stack)
+        self.assertEqual(a.report_at, 1001.5)
+        self.assertEqual(b.report_at, 1005.5)
+        self.assertEqual(obj.report_at, 1001.5)
+
+    def test_call_only_due_reporters(self):
+        a = DummyReporter(1000.0, 1.0)
+        b = DummyReporter(1003.0, 5.0)
+        obj = self._class([a, b])
+        obj(1001.0)
+        self.assertEqual(a.reported, [(1001.0, None)])
+        self.assertEqual(b.reported, [])
+        self.assertEqual(obj.report_at, 1002.0)
+
+    def test_call_with_barrier(self):
+        a = DummyReporter(1000.0, 1.0)
+        obj = self._class([a])
+        frame = sys._getframe()
+        obj.barrier = frame
+        obj(1000.0, frame)
+        self.assertEqual(a.reported, [(1000.0, [frame])])
+
+    def test_call_with_reporter_error(self):
+        a = DummyReporter(1000.0, 1.0, error=ValueError('synthetic'))
+        b = DummyReporter(1000.0, 2.0)
+        obj = self._class([a, b])
+        from slowlog.stats import monitor_stats
+        errors = monitor_stats.errors
+        obj(1000.0)
+        self.assertEqual(len(b.reported), 1)
+        self.assertEqual(obj.report_at, 1001.0)
+        # Counted like the errors of reporters called by the monitor.
+        self.assertEqual(monitor_stats.errors, errors + 1)
+
+    def test_call_with_stopped_reporter(self):
+        a = DummyReporter(1000.0, 1.0)
+        b = DummyReporter(1000.0, 5.0)
+        obj = self._class([a, b])
+
+        def report_stack(report_time, stack):
+            a.reported.append((report_time, stack))
+            a.interval = None
+
+        a.report_stack = report_stack
+        obj(1000.0)
+        self.assertEqual(obj.report_at, 1005.0)
+        obj(1005.0)
+        self.assertEqual(len(a.reported), 1)
+        self.assertEqual(len(b.reported), 2)
+        self.assertEqual(obj.report_at, 1010.0)
+        b.interval = None
+        obj(1010.0)
+        self.assertEqual(len(b.reported), 2)
+        self.assertIsNone(obj.interval)
+
+    def test_finish(self):
+        finished = []
+
+        class LoggingReporter(DummyReporter):
+            report_count = 0
+
+            def finish(self, end_time, status):
+                finished.append((self, end_time, status))
+
+        a = LoggingReporter(1000.0, 1.0)
+        b = LoggingReporter(1000.0, 1.0)
+        c = DummyReporter(1000.0, 1.0)
+        obj = self._class([a, b, c])
+        self.assertEqual(obj.report_count, 0)
+        a.report_count = 2
+        self.assertEqual(obj.report_count, 2)
+        obj.finish(1005.0, '200 OK')
+        self.assertEqual(finished, [(a, 1005.0, '200 OK')])
+
+    def test_ctor_with_coalescing_reporter(self):
+        a = DummyLogger(1002.3, 1.0)
+        b = DummyReporter(1001.2, 5.0)
+        obj = self._class([b, a])
+        self.assertIs(obj.logger, a)
+        self.assertEqual(obj.coalesce, 'owner')
+        self.assertEqual(a.report_at, 1003.0)
+        self.assertEqual(b.report_at, 1005.0)
+        self.assertEqual(obj.report_at, 1003.0)
+
+    def test_walk(self):
+        obj = self._class([DummyReporter(1000.0, 1.0)], 2)
+        frame = sys._getframe()
+        self.assertEqual(obj.walk(frame), [frame, frame.f_back])
+        obj.barrier = frame
+        self.assertEqual(obj.walk(frame), [frame])
+
+    def test_report_group(self):
+        stack = ['frame']
+        logger1 = DummyLogger(1003.0, 1.0)
+        stats1 = DummyReporter(1002.0, 1.0)
+        obj1 = self._class([logger1, stats1])
+        logger2 = DummyLogger(1003.0, 1.0)
+        stats2 = DummyReporter(1002.0, 1.0)
+        obj2 = self._class([logger2, stats2])
+        logger3 = DummyLogger(1004.0, 1.0)
+        obj3 = self._class([logger3])
+        obj1.report_group(1003.01, stack, [obj2, obj3])
+        # The due loggers share one report.
+        self.assertEqual(logger1.groups, [(1003.01, stack, [logger2])])
+        self.assertEqual(logger1.reported, [])
+        self.assertEqual(logger2.groups, [])
+        self.assertEqual(logger3.groups, [])
+        # The other parts report the stack of each request.
+        self.assertEqual(stats1.reported, [(1003.01, stack)])
+        self.assertEqual(stats2.reported, [(1003.01, stack)])
+        # The next reports stay aligned.
+        self.assertEqual([r.report_at for r in (obj1, obj2, obj3)],
+                         [1004.0, 1004.0, 1004.0])
+
+    def test_report_group_with_logger_error(self):
+        logger1 = DummyLogger(1003.0, 1.0)
+
+        def report_group(report_time, stack, others):
+            raise ValueError('synthetic')
+
+        logger1.report_group = report_group
+        obj1 = self._class([logger1])
+        obj2 = self._class([DummyLogger(1003.0, 1.0)])
+        from slowlog.stats import monitor_stats
+        errors = monitor_stats.errors
+        obj1.report_group(1003.0, None, [obj2])
+        self.assertEqual(monitor_stats.errors, errors + 1)
+        self.assertEqual(obj1.report_at, 1004.0)
+        self.assertEqual(obj2.report_at, 1004.0)
@@ -0,0 +1,199 @@
+"""Tests of slowlog.compat"""
+
+import sys
+import threading
+import time
+import types
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class DummyGreenlet(object):
+
+    def __init__(self, parent=None, gr_frame=None, active=True):
+        self.parent = parent
+        self.gr_frame = gr_frame
+        self.active = active
+
+    def __bool__(self):
+        return self.active
+
+    __nonzero__ = __bool__
+
+
+class GreenletTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = sys.modules.get('greenlet')
+
+    def tearDown(self):
+        if self.saved is None:
+            sys.modules.pop('greenlet', None)
+        else:
+            sys.modules['greenlet'] = self.saved  # pragma no cover
+
+    def _install_greenlet(self, current):
+        module = types.ModuleType('greenlet')
+        module.getcurrent = lambda: current
+        sys.modules['greenlet'] = module
+
+
+class Test_get_greenlet(GreenletTestBase):
+
+    def _call(self):
+        from slowlog.compat import get_greenlet
+        return get_greenlet()
+
+    def test_without_greenlet_module(self):
+        sys.modules.pop('greenlet', None)
+        self.assertIsNone(self._call())
+
+    def test_in_main_greenlet(self):
+        self._install_greenlet(DummyGreenlet())
+        self.assertIsNone(self._call())
+
+    def test_in_spawned_greenlet(self):
+        glet = DummyGreenlet(parent=DummyGreenlet())
+        self._install_greenlet(glet)
+        self.assertIs(self._call(), glet)
+
+
+class Test_split_ident(GreenletTestBase):
+
+    def _call(self, ident=None):
+        from slowlog.compat import split_ident
+        return split_ident(ident)
+
+    def test_thread_ident(self):
+        self.assertEqual(self._call(123), (123, None))
+
+    def test_greenlet_ident(self):
+        glet = DummyGreenlet()
+        self.assertEqual(self._call((123, glet)), (123, glet))
+
+    def test_current_thread(self):
+        from slowlog.compat import get_ident
+        sys.modules.pop('greenlet', None)
+        self.assertEqual(self._call(), (get_ident(), None))
+
+    def test_current_greenlet(self):
+        from slowlog.compat import get_ident
+        glet = DummyGreenlet(parent=DummyGreenlet())
+        self._install_greenlet(glet)
+        self.assertEqual(self._call(), (get_ident(), glet))
+
+
+class Test_greenlet_frame(unittest.TestCase):
+
+    def _call(self, glet, thread_frame):
+        from slowlog.compat import greenlet_frame
+        return greenlet_frame(glet, thread_frame)
+
+    def test_suspended(self):
+        frame = sys._getframe()
+        glet = DummyGreenlet(gr_frame=frame)
+        self.assertIs(self._call(glet, None), frame)
+
+    def test_running(self):
+        frame = sys._getframe()
+        self.assertIs(self._call(DummyGreenlet(), frame), frame)
+
+    def test_dead(self):
+        glet = DummyGreenlet(active=False)
+        self.assertIsNone(self._call(glet, sys._getframe()))
+
+
+class TestGreenletReporter(unittest.TestCase):
+
+    def _make(self, ident):
+        from slowlog.compat import GreenletReporter
+        obj = GreenletReporter()
+        obj.set_ident(ident)
+        return obj
+
+    def test_thread(self):
+        obj = self._make(123)
+        self.assertEqual(obj.ident, 123)
+        self.assertIsNone(obj.greenlet)
+        frame = sys._getframe()
+        self.assertIs(obj.get_frame(frame), frame)
+
+    def test_suspended_greenlet(self):
+        frame = sys._getframe()
+        glet = DummyGreenlet(gr_frame=frame)
+        obj = self._make((123, glet))
+        self.assertEqual(obj.ident, 123)
+        self.assertIs(obj.greenlet, glet)
+        self.assertIs(obj.get_frame(None), frame)
+
+
+class Test_use_native_thread(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = sys.modules.get('gevent.monkey')
+
+    def tearDown(self):
+        if self.saved is None:
+            sys.modules.pop('gevent.monkey', None)
+        else:
+            sys.modules['gevent.monkey'] = self.saved  # pragma no cover
+
+    def _call(self):
+        from slowlog.compat import use_native_thread
+        return use_native_thread()
+
+    def test_without_gevent(self):
+        sys.modules.pop('gevent.monkey', None)
+        self.assertFalse(self._call())
+
+    def test_with_patched_threading(self):
+        module = types.ModuleType('gevent.monkey')
+        module.is_module_patched = lambda name: name == 'threading'
+        sys.modules['gevent.monkey'] = module
+        self.assertEqual(self._call(), sys.version_info[0] >= 3)
+
+    def test_with_unpatched_threading(self):
+        module = types.ModuleType('gevent.monkey')
+        module.is_module_patched = lambda name: False
+        sys.modules['gevent.monkey'] = module
+        self.assertFalse(self._call())
+
+
+@unittest.skipIf(sys.version_info[0] < 3, "Requires Python 3")
+class TestNativeQueue(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.compat import NativeQueue
+        return NativeQueue
+
+    def test_put_and_get(self):
+        obj = self._class()
+        obj.put(1)
+        obj.put(2)
+        self.assertEqual(obj.get(), 1)
+        self.assertEqual(obj.get(False), 2)
+
+    def test_get_nonblocking_when_empty(self):
+        from slowlog.compat import Empty
+        obj = self._class()
+        self.assertRaises(Empty, obj.get, False)
+
+    def test_get_with_timeout(self):
+        from slowlog.compat import Empty
+        obj = self._class()
+        start = time.time()
+        self.assertRaises(Empty, obj.get, True, 0.05)
+        self.assertGreaterEqual(time.time() - start, 0.04)
+
+    def test_get_woken_by_other_thread(self):
+        obj = self._class()
+        t = threading.Timer(0.02, obj.put, (None,))
+        t.start()
+        try:
+            self.assertIsNone(obj.get(True, 10.0))
+        finally:
+            t.join()
@@ -0,0 +1,66 @@
+"""Tests of slowlog.cputime"""
+
+from slowlog import cputime
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+def burn_cpu():
+    start = cputime.thread_time()
+    while cputime.thread_time() - start < 0.01:
+        pass
+
+
+@unittest.skipUnless(cputime.available, 'per-thread CPU clocks unavailable')
+class Test_thread_cpu_time(unittest.TestCase):
+
+    def test_current_thread(self):
+        from slowlog.compat import get_ident
+        before = cputime.thread_time()
+        burn_cpu()
+        now = cputime.thread_cpu_time(get_ident())
+        self.assertGreaterEqual(now - before, 0.01)
+        self.assertLessEqual(now, cputime.thread_time())
+
+    def test_other_thread(self):
+        from slowlog.compat import get_ident
+        from threading import Event
+        from threading import Thread
+        idents = []
+        burned = Event()
+        done = Event()
+
+        def run():
+            idents.append(get_ident())
+            burn_cpu()
+            burned.set()
+            done.wait()
+
+        t = Thread(target=run)
+        t.start()
+        try:
+            burned.wait()
+            self.assertGreaterEqual(cputime.thread_cpu_time(idents[0]), 0.01)
+        finally:
+            done.set()
+            t.join()
+
+
+class Test_cpu_split(unittest.TestCase):
+
+    def test_without_start(self):
+        self.assertIsNone(cputime.cpu_split(1, None, 5.0))
+
+    @unittest.skipUnless(cputime.available,
+                         'per-thread CPU clocks unavailable')
+    def test_it(self):
+        from slowlog.compat import get_ident
+        start = cputime.thread_time()
+        burn_cpu()
+        cpu, wait = cputime.cpu_split(get_ident(), start, 5.0)
+        self.assertGreaterEqual(cpu, 0.01)
+        self.assertLess(cpu, 5.0)
+        self.assertAlmostEqual(cpu + wait, 5.0)
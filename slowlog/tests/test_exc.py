@@ -38,6 +38,33 @@ class Test_print_stack(unittest.TestCase):
         match(lines[2], r'  File ".*/test_exc.py", line \d+, in func2$')
         match(lines[4], r'  File ".*/test_exc.py", line \d+, in func3$')
 
+    def test_with_registered_barrier(self):
+        from slowlog.exc import add_barrier
+        from slowlog.exc import barrier_codes
+        frames = []
+
+        def func3():
+            frames.append(sys._getframe())
+
+        def func2():
+            func3()
+
+        def func1():
+            func2()
+
+        add_barrier(func1)
+        try:
+            func1()
+            frame = frames[0]
+            f = StringIO()
+            self._call(frame, 100, f)
+        finally:
+            del barrier_codes[id(func1.__code__)]
+        lines = f.getvalue().splitlines()
+        self.assertEqual(len(lines), 6)
+        match = self.assertRegexpMatches
+        match(lines[0], r'  File ".*/test_exc.py", line \d+, in func1$')
+
     def test_without_barrier(self):
         frame = sys._getframe()
         f = StringIO()
@@ -45,3 +72,296 @@ class Test_print_stack(unittest.TestCase):
         lines = f.getvalue().splitlines()
         self.assertGreater(len(lines), 2)
         self.assertLess(len(lines), 100)
+
+
+class Test_walk_stack(unittest.TestCase):
+
+    def _call(self, frame, limit, barrier=None):
+        from slowlog.exc import walk_stack
+        return walk_stack(frame, limit, barrier)
+
+    def test_with_limit(self):
+        frame = sys._getframe()
+        frames = self._call(frame, 2)
+        self.assertEqual(frames, [frame, frame.f_back])
+
+    def test_without_limit(self):
+        frame = sys._getframe()
+        frames = self._call(frame, None)
+        self.assertIs(frames[0], frame)
+        self.assertIsNone(frames[-1].f_back)
+
+    def test_with_barrier(self):
+        from slowlog.exc import add_barrier
+        from slowlog.exc import barrier_codes
+
+        def inner():
+            return sys._getframe()
+
+        def outer():
+            return inner()
+
+        add_barrier(outer)
+        try:
+            frames = self._call(outer(), 100)
+        finally:
+            del barrier_codes[id(outer.__code__)]
+        self.assertEqual([f.f_code.co_name for f in frames],
+                         ['inner', 'outer'])
+
+    def _make_frame(self, varnames=(), cellvars=(), f_locals=None):
+        # A frame called by an ordinary frame.
+        class DummyCode:
+            co_varnames = varnames
+            co_cellvars = cellvars
+
+        class DummyFrame:
+            f_code = DummyCode()
+            f_back = None
+
+            @property
+            def f_locals(self):
+                if f_locals is None:
+                    raise AssertionError("f_locals should not be read")
+                return f_locals
+
+        frame = DummyFrame()
+        frame.f_back = self._make_frame() if varnames or cellvars else None
+        return frame
+
+    def test_registered_code(self):
+        from slowlog.exc import add_barrier
+        from slowlog.exc import barrier_codes
+        frame = self._make_frame(varnames=('x',), f_locals={})
+        add_barrier(frame.f_code)
+        try:
+            self.assertEqual(len(self._call(frame, 100)), 1)
+        finally:
+            del barrier_codes[id(frame.f_code)]
+
+    def test_ordinary_frame_does_not_read_locals(self):
+        frame = self._make_frame(varnames=('x', 'y'))
+        self.assertEqual(len(self._call(frame, 100)), 2)
+
+    def test_fallback_to_local_variable(self):
+        frame = self._make_frame(varnames=('__slowlog_barrier__',),
+                                 f_locals={'__slowlog_barrier__': True})
+        self.assertEqual(len(self._call(frame, 100)), 1)
+
+    def test_fallback_to_cell_variable(self):
+        frame = self._make_frame(cellvars=('__slowlog_barrier__',),
+                                 f_locals={'__slowlog_barrier__': True})
+        self.assertEqual(len(self._call(frame, 100)), 1)
+
+    def test_fallback_with_false_variable(self):
+        frame = self._make_frame(varnames=('__slowlog_barrier__',),
+                                 f_locals={'__slowlog_barrier__': False})
+        self.assertEqual(len(self._call(frame, 100)), 2)
+
+    def test_fallback_in_real_frame(self):
+        def inner():
+            return sys._getframe()
+
+        def outer():
+            __slowlog_barrier__ = True
+            return inner()
+
+        frames = self._call(outer(), 100)
+        self.assertEqual([f.f_code.co_name for f in frames],
+                         ['inner', 'outer'])
+
+    def test_with_barrier_frame(self):
+        def gen():
+            yield self._call(sys._getframe(), 100, barrier)
+
+        it = gen()
+        barrier = it.gi_frame
+        frames = next(it)
+        self.assertEqual(len(frames), 1)
+        self.assertIs(frames[0], barrier)
+
+
+class Test_stack_key(unittest.TestCase):
+
+    def _call(self, frames):
+        from slowlog.exc import stack_key
+        return stack_key(frames)
+
+    def test_it(self):
+        def here():
+            return sys._getframe()
+
+        keys = [self._call([here(), sys._getframe()]) for _i in range(2)]
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(hash(keys[0]), hash(keys[1]))
+        self.assertNotEqual(keys[0], self._call([here()]))
+
+
+class Test_common_depth(unittest.TestCase):
+
+    def _call(self, old_key, new_key):
+        from slowlog.exc import common_depth
+        return common_depth(old_key, new_key)
+
+    def test_it(self):
+        # Keys list the innermost frame first.
+        self.assertEqual(self._call(('c', 'b', 'a'), ('d', 'b', 'a')), 2)
+        self.assertEqual(self._call(('b', 'a'), ('c', 'b', 'a')), 2)
+        self.assertEqual(self._call(('b', 'a'), ('b', 'a')), 2)
+        self.assertEqual(self._call(('a',), ('b',)), 0)
+
+
+class TestCodeCache(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.exc import CodeCache
+        return CodeCache
+
+    def test_lookup_and_store(self):
+        obj = self._class()
+        co = sys._getframe().f_code
+        self.assertIsNone(obj.lookup(co, id(co)))
+        obj.store(co, id(co), 'x')
+        self.assertEqual(obj.lookup(co, id(co)), 'x')
+
+    def test_lookup_with_reused_id(self):
+        obj = self._class()
+        co = sys._getframe().f_code
+        # Simulate another code object with the same id.
+        obj.entries[id(co)] = (object(), 'x')
+        self.assertIsNone(obj.lookup(co, id(co)))
+
+    def test_maxsize(self):
+        obj = self._class(maxsize=2)
+        co = sys._getframe().f_code
+        obj.store(co, (id(co), 1), 'a')
+        obj.store(co, (id(co), 2), 'b')
+        self.assertEqual(len(obj.entries), 2)
+        obj.store(co, (id(co), 3), 'c')
+        self.assertEqual(obj.entries, {(id(co), 3): (co, 'c')})
+
+
+class TestFrameInfoCache(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tempdir)
+
+    @property
+    def _class(self):
+        from slowlog.exc import FrameInfoCache
+        return FrameInfoCache
+
+    def _make(self, *args, **kw):
+        return self._class(*args, **kw)
+
+    def _write_source(self, source, mtime):
+        import os
+        fn = os.path.join(self.tempdir, 'sample.py')
+        f = open(fn, 'w')
+        f.write(source)
+        f.close()
+        os.utime(fn, (mtime, mtime))
+        return fn
+
+    def _get_frame(self, fn):
+        f = open(fn)
+        source = f.read()
+        f.close()
+        code = compile(source, fn, 'exec')
+        ns = {'sys': sys}
+        exec(code, ns)
+        return ns['get_frame']()
+
+    def test_get(self):
+        fn = self._write_source(
+            'def get_frame():\n'
+            '    return sys._getframe()\n', 1000000000)
+        frame = self._get_frame(fn)
+        obj = self._make()
+        info = obj.get(frame, 1000.0)
+        self.assertEqual(info, (fn, 2, 'get_frame', 'return sys._getframe()'))
+        self.assertIs(obj.get(frame, 1001.0), info)
+
+    def test_get_after_source_changed(self):
+        fn = self._write_source(
+            'def get_frame():\n'
+            '    return sys._getframe()\n', 1000000000)
+        frame = self._get_frame(fn)
+        obj = self._make(check_interval=10.0)
+        obj.get(frame, 1000.0)
+        self._write_source(
+            'def get_frame():\n'
+            '    return sys._getframe()  # changed\n', 1000000100)
+
+        # The file is not checked again until check_interval passes.
+        info = obj.get(frame, 1005.0)
+        self.assertEqual(info[3], 'return sys._getframe()')
+
+        info = obj.get(frame, 1010.0)
+        self.assertEqual(info[3], 'return sys._getframe()  # changed')
+
+    def test_get_without_source(self):
+        code = compile('def get_frame():\n'
+                       '    return sys._getframe()\n', '<nofile>', 'exec')
+        ns = {'sys': sys}
+        exec(code, ns)
+        frame = ns['get_frame']()
+        obj = self._make()
+        self.assertEqual(obj.get(frame, 1000.0),
+                         ('<nofile>', 2, 'get_frame', None))
+        self.assertEqual(obj.files['<nofile>'], (1000.0, 0, None))
+
+    def test_maxsize(self):
+        obj = self._make(maxsize=2)
+        frame = sys._getframe()
+        obj.get(frame, 1000.0)
+        obj.get(frame.f_back, 1000.0)
+        self.assertEqual(len(obj.entries), 2)
+        obj.get(frame.f_back.f_back, 1000.0)
+        self.assertEqual(len(obj.entries), 1)
+
+    def test_clear(self):
+        obj = self._make()
+        obj.get(sys._getframe(), 1000.0)
+        obj.clear()
+        self.assertEqual(obj.entries, {})
+        self.assertEqual(obj.files, {})
+
+
+class Test_extract_stack(unittest.TestCase):
+
+    def _call(self, frame, limit, cache=None):
+        from slowlog.exc import extract_stack
+        return extract_stack(frame, limit, cache=cache)
+
+    def test_with_cache(self):
+        from slowlog.exc import FrameInfoCache
+        cache = FrameInfoCache()
+        frame = sys._getframe()
+        res = self._call(frame, 3, cache)
+        self.assertEqual(len(res), 3)
+        self.assertEqual(res[-1][2], 'test_with_cache')
+        self.assertEqual(len(cache.entries), 3)
+        # The outer frames have not moved, so their entries are reused.
+        res2 = self._call(frame, 3, cache)
+        self.assertIs(res2[0], res[0])
+        self.assertIs(res2[1], res[1])
+
+    def test_records_extract_time(self):
+        from slowlog.stats import monitor_stats
+        count = monitor_stats.extract.count
+        self._call(sys._getframe(), 1)
+        self.assertEqual(monitor_stats.extract.count, count + 1)
+
+    def test_with_default_cache(self):
+        from slowlog.exc import frame_info_cache
+        frame = sys._getframe()
+        res = self._call(frame, 1)
+        self.assertIn(res[0], [entry[1][1] for entry in
+                               frame_info_cache.entries.values()])
@@ -0,0 +1,164 @@
+"""Tests of slowlog.flamegraph"""
+
+import json
+import os
+import shutil
+import tempfile
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+def make_node(name, samples, self_samples, children=()):
+    return {'name': name, 'filename': '/app/%s.py' % name, 'lineno': 1,
+            'samples': samples, 'self': self_samples,
+            'children': list(children)}
+
+
+def make_snapshot():
+    # main calls view (3 samples in view) and query (2 samples);
+    # one sample is in main itself.
+    return {
+        'name': '(root)', 'filename': None, 'lineno': None,
+        'samples': 6, 'self': 0, 'truncated': 0,
+        'children': [
+            make_node('main', 6, 1, [
+                make_node('view', 3, 3),
+                make_node('query', 2, 2),
+            ]),
+        ],
+    }
+
+
+class Test_write_collapsed(unittest.TestCase):
+
+    def test_it(self):
+        from slowlog.compat import StringIO
+        from slowlog.flamegraph import write_collapsed
+        f = StringIO()
+        write_collapsed(make_snapshot(), f)
+        self.assertEqual(f.getvalue().splitlines(), [
+            'main (/app/main.py:1) 1',
+            'main (/app/main.py:1);view (/app/view.py:1) 3',
+            'main (/app/main.py:1);query (/app/query.py:1) 2',
+        ])
+
+    def test_semicolon_in_name(self):
+        from slowlog.compat import StringIO
+        from slowlog.flamegraph import write_collapsed
+        f = StringIO()
+        snapshot = make_snapshot()
+        snapshot['children'][0]['name'] = 'a;b'
+        write_collapsed(snapshot, f)
+        self.assertTrue(f.getvalue().startswith('a:b '))
+
+
+class Test_make_speedscope(unittest.TestCase):
+
+    def test_it(self):
+        from slowlog.flamegraph import make_speedscope
+        doc = make_speedscope(make_snapshot(), 'test')
+        frames = doc['shared']['frames']
+        self.assertEqual([frame['name'] for frame in frames],
+                         ['main', 'view', 'query'])
+        profile = doc['profiles'][0]
+        self.assertEqual(profile['type'], 'sampled')
+        self.assertEqual(profile['samples'], [[0], [0, 1], [0, 2]])
+        self.assertEqual(profile['weights'], [1, 3, 2])
+        self.assertEqual(profile['endValue'], 6)
+        self.assertEqual(doc['name'], 'test')
+
+
+class TestFlameGraphWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _make(self, path, **kw):
+        from slowlog.flamegraph import FlameGraphWriter
+
+        class DummyProfiler:
+            def snapshot(self):
+                return make_snapshot()
+
+        return FlameGraphWriter(DummyProfiler(), path, **kw)
+
+    def test_ctor_with_unknown_format(self):
+        with self.assertRaises(ValueError):
+            self._make('x', format='svg')
+
+    def test_call_writes_collapsed(self):
+        path = os.path.join(self.dir, 'flame-{pid}.txt')
+        obj = self._make(path, flush_interval=5.0)
+        self.assertEqual(obj.interval, 5.0)
+        self.assertIsNone(obj.ident)
+        obj(123456789.0)
+        obj.close()
+        self.assertFalse(obj.writer.is_alive())
+        fn = os.path.join(self.dir, 'flame-%d.txt' % os.getpid())
+        with open(fn) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(os.listdir(self.dir), [os.path.basename(fn)])
+
+    def test_call_writes_speedscope(self):
+        path = os.path.join(self.dir, 'flame.json')
+        obj = self._make(path, format='speedscope')
+        obj(123456789.0)
+        obj(123456790.0)
+        obj.close()
+        with open(path) as f:
+            doc = json.load(f)
+        self.assertEqual(doc['profiles'][0]['weights'], [1, 3, 2])
+
+    def test_call_skips_while_writer_is_busy(self):
+        from slowlog.compat import Queue
+        path = os.path.join(self.dir, 'flame.txt')
+        obj = self._make(path)
+        obj.pid = os.getpid()
+        obj.queue = Queue(1)
+        obj.queue.put_nowait(('busy', obj.pid))
+        obj(123456789.0)
+        self.assertEqual(obj.skipped, 1)
+        self.assertEqual(obj.queue.get_nowait(), ('busy', obj.pid))
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_call_in_forked_child_starts_writer(self):
+        path = os.path.join(self.dir, 'flame.txt')
+        obj = self._make(path)
+        obj(123456789.0)
+        obj.close()
+        parent_writer = obj.writer
+        obj.pid = -1  # As if the process forked
+        obj(123456790.0)
+        obj.close()
+        self.assertIsNot(obj.writer, parent_writer)
+        self.assertEqual(obj.pid, os.getpid())
+        self.assertEqual(obj.skipped, 0)
+
+    def test_writer_survives_errors(self):
+        path = os.path.join(self.dir, 'missing', 'flame.txt')
+        obj = self._make(path)
+        obj(123456789.0)
+        obj(123456790.0)
+        obj.close()
+        self.assertFalse(obj.writer.is_alive())
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_flush(self):
+        path = os.path.join(self.dir, 'flame.txt')
+        obj = self._make(path)
+        obj.flush()
+        self.assertIsNone(obj.writer)
+        with open(path) as f:
+            self.assertEqual(len(f.read().splitlines()), 3)
+
+    def test_close_without_writer(self):
+        obj = self._make(os.path.join(self.dir, 'flame.txt'))
+        obj.close()
+        self.assertIsNone(obj.writer)
@@ -0,0 +1,136 @@
+"""Tests of slowlog.flightrecorder"""
+
+import sys
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+def phase1(recorder, report_time):
+    recorder(report_time)
+
+
+def phase2(recorder, report_time):
+    recorder(report_time)
+
+
+class TestFlightRecorder(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.flightrecorder import FlightRecorder
+        return FlightRecorder
+
+    def _make(self, **kw):
+        obj = self._class(**kw)
+        from slowlog.compat import get_ident
+        self.ident = get_ident()
+        self.idents = idents = set([self.ident])
+
+        from slowlog.monitor import Monitor
+
+        class DummyMonitor(Monitor):
+            def active_idents(self):
+                return idents
+
+        monitor = DummyMonitor()
+        obj.get_monitor = lambda: monitor
+        return obj
+
+    def test_ctor(self):
+        obj = self._make(rate=4.0)
+        self.assertEqual(obj.interval, 0.25)
+        self.assertIsNone(obj.ident)
+
+    def test_call_records_samples(self):
+        obj = self._make()
+        for t in (1000.0, 1000.1):
+            phase1(obj, t)
+        phase2(obj, 1000.2)
+        timeline = obj.timeline(self.ident, 1000.0)
+        self.assertEqual([t for t, _stack in timeline],
+                         [1000.0, 1000.1, 1000.2])
+        # Samples of the same stack share one tuple.
+        self.assertIs(timeline[0][1], timeline[1][1])
+        self.assertIsNot(timeline[1][1], timeline[2][1])
+        # Sampled by the monitor, called by the recorder in phase2().
+        self.assertEqual(timeline[2][1][-3][2], 'phase2')
+
+    def test_timeline_since(self):
+        obj = self._make()
+        phase1(obj, 1000.0)
+        phase2(obj, 1001.0)
+        timeline = obj.timeline(self.ident, 1000.5)
+        self.assertEqual([t for t, _stack in timeline], [1001.0])
+
+    def test_timeline_of_unknown_thread(self):
+        obj = self._make()
+        self.assertEqual(obj.timeline(-1, 0), [])
+
+    def test_ring_buffer_depth(self):
+        obj = self._make(depth=2)
+        for i in range(5):
+            phase1(obj, 1000.0 + i)
+        timeline = obj.timeline(self.ident, 0)
+        self.assertEqual([t for t, _stack in timeline], [1003.0, 1004.0])
+
+    def test_discard_samples_of_idle_thread(self):
+        obj = self._make()
+        phase1(obj, 1000.0)
+        self.idents.clear()
+        obj(1000.1)
+        self.assertEqual(obj.rings, {})
+        self.assertEqual(obj.timeline(self.ident, 0), [])
+
+    def test_max_stacks(self):
+        obj = self._make(max_stacks=1)
+        phase1(obj, 1000.0)
+        phase2(obj, 1000.1)
+        self.assertEqual(len(obj.stacks), 1)
+        self.assertEqual(len(obj.timeline(self.ident, 0)), 2)
+
+    def test_intern(self):
+        obj = self._make()
+        # Use the caller's frame, which stays on the same line.
+        frame = sys._getframe().f_back
+        stack = obj.intern([frame])
+        self.assertEqual(len(stack), 1)
+        self.assertEqual(stack[0][2], frame.f_code.co_name)
+        self.assertIs(obj.intern([frame]), stack)
+
+
+class Test_format_timeline(unittest.TestCase):
+
+    def test_it(self):
+        from slowlog.flightrecorder import format_timeline
+        a = (('/app/a.py', 1, 'a', 'x = 1'),)
+        b = (('/app/b.py', 2, 'b', 'y = 2'),)
+        text = format_timeline(
+            [(1000.0, a), (1000.1, a), (1000.2, b), (1000.3, a)], 1000.0)
+        self.assertEqual(text.splitlines(), [
+            'timeline:',
+            '  +0.00s 2 samples: stack 0',
+            '  +0.20s 1 sample: stack 1',
+            '  +0.30s 1 sample: stack 0',
+            'stack 0:',
+            '  File "/app/a.py", line 1, in a',
+            '    x = 1',
+            'stack 1:',
+            '  File "/app/b.py", line 2, in b',
+            '    y = 2',
+        ])
+
+
+class Test_timeline_data(unittest.TestCase):
+
+    def test_it(self):
+        from slowlog.flightrecorder import timeline_data
+        a = (('/app/a.py', 1, 'a', 'x = 1'),)
+        b = (('/app/b.py', 2, 'b', 'y = 2'),)
+        data = timeline_data([(1000.0, a), (1000.25, b), (1000.5, a)],
+                             1000.0)
+        self.assertEqual(data['samples'], [[0.0, 0], [0.25, 1], [0.5, 0]])
+        self.assertEqual(data['stacks'][1], [
+            {'file': '/app/b.py', 'line': 2, 'name': 'b', 'code': 'y = 2'}])
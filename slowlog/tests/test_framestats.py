@@ -1,3 +1,6 @@
+import sys
+
+from slowlog import cputime
 
 try:
     import unittest2 as unittest
@@ -5,11 +8,7 @@ except ImportError:
     import unittest
 
 
-class Test_report_framestats(unittest.TestCase):
-
-    def _call(self, client, frame):
-        from slowlog.framestats import report_framestats
-        return report_framestats(client, frame)
+class FrameStackHelpers(object):
 
     def _make_statsd_client(self):
         self.sentbufs = sentbufs = []
@@ -25,6 +24,9 @@ class Test_report_framestats(unittest.TestCase):
 
     def _make_frame_stack(self, length):
         class DummyCode:
+            co_varnames = ()
+            co_cellvars = ()
+
             def __init__(self, i):
                 self.co_name = 'dummy_name_%d' % i
 
@@ -50,6 +52,13 @@ class Test_report_framestats(unittest.TestCase):
 
         return current_frame
 
+
+class Test_report_framestats(FrameStackHelpers, unittest.TestCase):
+
+    def _call(self, client, frame):
+        from slowlog.framestats import report_framestats
+        return report_framestats(client, frame)
+
     def test_with_empty_frame(self):
         client = self._make_statsd_client()
         self._call(client, None)
@@ -72,6 +81,7 @@ class Test_report_framestats(unittest.TestCase):
     def test_with_barrier(self):
         client = self._make_statsd_client()
         frame = self._make_frame_stack(4)
+        frame.f_back.f_code.co_varnames = ('__slowlog_barrier__',)
         frame.f_back.f_locals['__slowlog_barrier__'] = True
         self._call(client, frame)
         self.assertEqual(len(self.sentbufs), 1)
@@ -82,6 +92,29 @@ class Test_report_framestats(unittest.TestCase):
                   ]
         self.assertEqual(expect, self.sentbufs[0].splitlines())
 
+    def test_with_registered_barrier(self):
+        from slowlog.exc import add_barrier
+        from slowlog.exc import barrier_codes
+        client = self._make_statsd_client()
+        frame = self._make_frame_stack(4)
+        barrier_code = frame.f_back.f_code
+        add_barrier(barrier_code)
+        try:
+            self._call(client, frame)
+        finally:
+            del barrier_codes[id(barrier_code)]
+        self.assertEqual(len(self.sentbufs[0].splitlines()), 4)
+
+    def test_without_reading_locals(self):
+        client = self._make_statsd_client()
+        frame = self._make_frame_stack(3)
+        f = frame
+        while f is not None:
+            f.f_locals = None  # Would fail if read
+            f = f.f_back
+        self._call(client, frame)
+        self.assertEqual(len(self.sentbufs[0].splitlines()), 6)
+
     def test_with_long_stack(self):
         client = self._make_statsd_client()
         frame = self._make_frame_stack(20)
@@ -111,6 +144,136 @@ class Test_report_framestats(unittest.TestCase):
         self.assertEqual(self.sentbufs[0].splitlines(), expect)
 
 
+class TestMetricNameCache(FrameStackHelpers, unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.framestats import MetricNameCache
+        return MetricNameCache
+
+    def test_get(self):
+        obj = self._class()
+        frame = self._make_frame_stack(1)
+        names = obj.get(frame)
+        self.assertEqual(names, ('framestats.dummy.module1.dummy_name_1',
+                                 'framestats._.dummy_module1_dummy_name_1'))
+        self.assertIs(obj.get(frame), names)
+
+    def test_get_with_reused_id(self):
+        obj = self._class()
+        frame = self._make_frame_stack(1)
+        names = obj.get(frame)
+        # Simulate another code object with the same id.
+        obj.entries[id(frame.f_code)] = (object(), ('x', 'y'))
+        self.assertEqual(obj.get(frame), names)
+
+    def test_maxsize(self):
+        obj = self._class(maxsize=2)
+        frame = self._make_frame_stack(3)
+        obj.get(frame)
+        obj.get(frame.f_back)
+        self.assertEqual(len(obj.entries), 2)
+        obj.get(frame.f_back.f_back)
+        self.assertEqual(len(obj.entries), 1)
+
+
+class Test_get_weights(unittest.TestCase):
+
+    def _call(self, framecount):
+        from slowlog.framestats import get_weights
+        return get_weights(framecount)
+
+    def test_it(self):
+        self.assertEqual(self._call(3), ['1', '0.667', '0.333'])
+        self.assertIs(self._call(3), self._call(3))
+
+    def test_empty(self):
+        self.assertEqual(self._call(0), [])
+
+
+class TestFrameStatsAggregator(FrameStackHelpers, unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.framestats import FrameStatsAggregator
+        return FrameStatsAggregator
+
+    def _make(self, flush_interval=10.0, max_buf=1000):
+        client = self._make_statsd_client()
+        return self._class(client, flush_interval, max_buf)
+
+    def test_ctor(self):
+        obj = self._make(flush_interval=5.0)
+        self.assertIsNone(obj.ident)
+        self.assertEqual(obj.interval, 5.0)
+        self.assertEqual(obj.report_at, 0)
+
+    def test_add(self):
+        obj = self._make()
+        obj.add(self._make_frame_stack(2))
+        obj.add(self._make_frame_stack(2))
+        self.assertEqual(obj.counters, {
+            ('framestats.dummy.module2.dummy_name_2',
+             'framestats._.dummy_module2_dummy_name_2'): 2.0,
+            ('framestats.dummy.module1.dummy_name_1',
+             'framestats._.dummy_module1_dummy_name_1'): 1.0,
+        })
+        self.assertEqual(self.sentbufs, [])
+
+    def test_add_with_limit(self):
+        obj = self._make()
+        obj.add(self._make_frame_stack(3), limit=1)
+        self.assertEqual(obj.counters, {
+            ('framestats.dummy.module3.dummy_name_3',
+             'framestats._.dummy_module3_dummy_name_3'): 1.0})
+
+    def test_flush(self):
+        obj = self._make()
+        for _i in range(3):
+            obj.add(self._make_frame_stack(3))
+        obj.flush()
+        self.assertEqual(obj.counters, {})
+        self.assertEqual(len(self.sentbufs), 1)
+        expect = ['framestats.dummy.module3.dummy_name_3:3|c',
+                  'framestats._.dummy_module3_dummy_name_3:3|c',
+                  'framestats.dummy.module2.dummy_name_2:2|c',
+                  'framestats._.dummy_module2_dummy_name_2:2|c',
+                  'framestats.dummy.module1.dummy_name_1:1|c',
+                  'framestats._.dummy_module1_dummy_name_1:1|c',
+                  ]
+        self.assertEqual(sorted(self.sentbufs[0].splitlines()),
+                         sorted(expect))
+
+    def test_flush_with_small_buffer(self):
+        obj = self._make(max_buf=100)
+        obj.add(self._make_frame_stack(5))
+        obj.flush()
+        self.assertGreater(len(self.sentbufs), 1)
+        lines = '\n'.join(self.sentbufs).splitlines()
+        self.assertEqual(len(lines), 10)
+
+    def test_flush_without_counters(self):
+        obj = self._make()
+        obj.flush()
+        self.assertEqual(self.sentbufs, [])
+
+    def test_call_flushes(self):
+        obj = self._make()
+        obj.add(self._make_frame_stack(1))
+        obj(123456789.0)
+        self.assertEqual(len(self.sentbufs), 1)
+
+    def test_flush_cpu(self):
+        obj = self._make()
+        obj.add_cpu(0.25, 1.0)
+        obj.add_cpu(0.5, 0.75)
+        obj.flush()
+        self.assertEqual(self.sentbufs, [
+            'slowlog.cpu_ms:750|c\nslowlog.wait_ms:1750|c'])
+        obj.flush()
+        self.assertEqual(len(self.sentbufs), 1)
+
+
 class TestFrameStatsReporter(unittest.TestCase):
 
     @property
@@ -142,12 +305,119 @@ class TestFrameStatsReporter(unittest.TestCase):
     def test_call_with_frame(self):
         reported = []
 
-        def report_framestats(client, frame, limit):
-            reported.append((client, frame, limit))
+        def report_framestats(client, frame, limit, barrier):
+            reported.append((client, frame, limit, barrier))
 
         client = object()
         reporter = self._class(client, 123456789.0, 1.5)
         frame = object()
         reporter(123456789.0, frame, report_framestats=report_framestats)
         self.assertEqual(len(reported), 1)
-        self.assertEqual(reported[0], (client, frame, 100))
+        self.assertEqual(reported[0], (client, frame, 100, None))
+
+    def test_call_with_barrier(self):
+        reported = []
+
+        def report_framestats(client, frame, limit, barrier):
+            reported.append((client, frame, limit, barrier))
+
+        client = object()
+        reporter = self._class(client, 123456789.0, 1.5)
+        reporter.barrier = barrier = object()
+        frame = object()
+        reporter(123456789.0, frame, report_framestats=report_framestats)
+        self.assertEqual(reported, [(client, frame, 100, barrier)])
+
+    def test_report_stack(self):
+        sent = []
+
+        class DummyClient:
+            def incr(self, name, amount, buf):
+                buf.append('%s:%s|c' % (name, amount))
+
+            def sendbuf(self, buf):
+                sent.extend(buf)
+
+        reporter = self._class(DummyClient(), 123456789.0, 1.5,
+                               frame_limit=1)
+        frame = sys._getframe()
+        reporter.report_stack(123456789.0, [frame, frame.f_back])
+        self.assertEqual(len(sent), 2)
+        self.assertIn('test_report_stack:1|c', sent[0])
+
+    def test_report_stack_with_aggregator(self):
+        added = []
+
+        class DummyAggregator:
+            def add_names(self, names):
+                added.append(names)
+
+        reporter = self._class(object(), 123456789.0, 1.5,
+                               aggregator=DummyAggregator())
+        frame = sys._getframe()
+        reporter.report_stack(123456789.0, [frame])
+        reporter.report_stack(123456790.0, None)
+        self.assertEqual(len(added), 1)
+        self.assertEqual(len(added[0]), 1)
+
+    def test_call_with_aggregator(self):
+        added = []
+
+        class DummyAggregator:
+            def add(self, frame, limit, barrier):
+                added.append((frame, limit))
+
+        def report_framestats(client, frame, limit, barrier):
+            raise AssertionError("should not be called")
+
+        reporter = self._class(object(), 123456789.0, 1.5, frame_limit=7,
+                               aggregator=DummyAggregator())
+        frame = object()
+        reporter(123456789.0, frame, report_framestats=report_framestats)
+        self.assertEqual(added, [(frame, 7)])
+
+    @unittest.skipUnless(cputime.available,
+                         'per-thread CPU clocks unavailable')
+    def test_report_stack_with_cpu(self):
+        sent = []
+
+        class DummyClient:
+            def incr(self, name, amount, buf):
+                buf.append('%s:%s|c' % (name, amount))
+
+            def sendbuf(self, buf):
+                sent.append(buf)
+
+        reporter = self._class(DummyClient(), 123456789.0, 1.5,
+                               frame_limit=0, cpu=True)
+        reporter.report_stack(1000.0, [])
+        # The first report only reads the clock.
+        self.assertEqual(sent, [])
+        self.assertEqual(reporter.cpu_mark[0], 1000.0)
+        reporter.report_stack(1002.0, [])
+        cpu_line, wait_line = sent[-1]
+        self.assertTrue(cpu_line.startswith('slowlog.cpu_ms:'))
+        self.assertTrue(wait_line.startswith('slowlog.wait_ms:'))
+        cpu = float(cpu_line.split(':')[1][:-2])
+        wait = float(wait_line.split(':')[1][:-2])
+        self.assertAlmostEqual(cpu + wait, 2000.0, delta=0.01)
+
+    @unittest.skipUnless(cputime.available,
+                         'per-thread CPU clocks unavailable')
+    def test_report_stack_with_cpu_and_aggregator(self):
+        added = []
+
+        class DummyAggregator:
+            def add_names(self, names):
+                pass
+
+            def add_cpu(self, cpu, wait):
+                added.append(cpu + wait)
+
+        reporter = self._class(object(), 123456789.0, 1.5, cpu=True,
+                               aggregator=DummyAggregator())
+        reporter.report_stack(1000.0, None)
+        reporter.report_stack(1001.0, [])
+        reporter.report_stack(1003.0, [])
+        self.assertEqual(len(added), 1)
+        self.assertAlmostEqual(added[0], 2.0)
@@ -4,6 +4,7 @@
 import tempfile
 import os
 import logging
+import time
 
 try:
     import unittest2 as unittest
@@ -13,9 +14,9 @@ except ImportError:
 
 class Test_make_file_logger(unittest.TestCase):
 
-    def _call(self, filename):
+    def _call(self, filename, **kw):
         from slowlog.logfile import make_file_logger
-        return make_file_logger(filename)
+        return make_file_logger(filename, **kw)
 
     def test_with_filename(self):
         f = tempfile.NamedTemporaryFile(delete=False)
@@ -47,3 +48,148 @@ class Test_make_file_logger(unittest.TestCase):
         logfile = StringIO()
         logger = self._call(logfile)
         self.assertIs(logger.handlers[0].stream, logfile)
+
+    def test_with_open_file_as_json(self):
+        from slowlog.compat import StringIO
+        logfile = StringIO()
+        logger = self._call(logfile, format='json')
+        logger.warning('%s', '{"a": 1}')
+        self.assertEqual(logfile.getvalue(), '{"a": 1}\n')
+
+    def test_queued_with_filename(self):
+        from slowlog.logfile import QueuedHandler
+        f = tempfile.NamedTemporaryFile(delete=False)
+        fn = f.name
+        f.close()
+        try:
+            logger = self._call(fn, queued=True)
+            handler = logger.handlers[0]
+            self.assertIsInstance(handler, QueuedHandler)
+            logger.warning('Hello %s!', 'queue')
+            handler.close()
+            self.assertFalse(handler.writer.is_alive())
+            f = open(fn, 'r')
+            content = f.read()
+            f.close()
+            self.assertRegexpMatches(content.rstrip(),
+                                     r'\d{4}-\d{2}-\d{2} '
+                                     r'\d{2}:\d{2}:\d{2},\d{3} - Hello queue!$')
+        finally:
+            os.remove(fn)
+
+    def test_queued_with_handler(self):
+        logfile = logging.StreamHandler()
+        logger = self._call(logfile, queued=True)
+        handler = logger.handlers[0]
+        try:
+            self.assertIs(handler.handler, logfile)
+        finally:
+            handler.close()
+
+
+class TestQueuedHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.handlers = []
+
+    def tearDown(self):
+        for handler in self.handlers:
+            handler.close()
+
+    def _make(self, handler, queue_size=1000):
+        from slowlog.logfile import QueuedHandler
+        obj = QueuedHandler(handler, queue_size)
+        self.handlers.append(obj)
+        return obj
+
+    def _make_record(self, msg):
+        return logging.LogRecord('slowlog', logging.WARNING, __file__, 1,
+                                 msg, (), None)
+
+    def _make_target(self, block=None):
+        written = self.written = []
+
+        class DummyHandler(logging.Handler):
+            def emit(self, record):
+                if block is not None:
+                    block.get()
+                written.append(record.getMessage())
+
+        return DummyHandler()
+
+    def test_emit(self):
+        target = self._make_target()
+        obj = self._make(target)
+        logger = logging.Logger('test')
+        logger.addHandler(obj)
+        logger.warning('a %d', 1)
+        logger.warning('b %d', 2)
+        obj.close()
+        self.assertEqual(self.written, ['a 1', 'b 2'])
+        self.assertEqual(obj.dropped, 0)
+
+    def test_drop_when_full(self):
+        from slowlog.compat import Queue
+        block = Queue()
+        target = self._make_target(block)
+        obj = self._make(target, queue_size=2)
+        # The writer takes the first record and blocks writing it.
+        obj.emit(self._make_record('1'))
+        for _i in range(100):
+            if obj.queue.empty():
+                break
+            time.sleep(0.01)
+        obj.emit(self._make_record('2'))
+        obj.emit(self._make_record('3'))
+        obj.emit(self._make_record('4'))
+        self.assertEqual(obj.dropped, 1)
+        for _i in range(4):
+            block.put(None)
+        obj.close()
+        self.assertEqual(self.written, ['1', '2', '3'])
+
+    def test_emit_after_fork(self):
+        from slowlog.compat import Queue
+        block = Queue()
+        obj = self._make(self._make_target(block))
+        obj.emit(self._make_record('before'))
+        parent_queue = obj.queue
+        parent_writer = obj.writer
+        obj.pid = -1  # Pretend the process forked.
+        block.put(None)
+        obj.emit(self._make_record('after'))
+        self.assertIsNot(obj.writer, parent_writer)
+        self.assertIsNot(obj.queue, parent_queue)
+        block.put(None)
+        obj.close()
+        parent_queue.put(None)
+        parent_writer.join(5.0)
+        self.assertEqual(sorted(self.written), ['after', 'before'])
+
+    def test_close_twice(self):
+        obj = self._make(self._make_target())
+        obj.close()
+        obj.close()
+
+
+class TestBatchRotatingFileHandler(unittest.TestCase):
+
+    def test_flush_deferred_while_batching(self):
+        from slowlog.logfile import BatchRotatingFileHandler
+        f = tempfile.NamedTemporaryFile(delete=False)
+        fn = f.name
+        f.close()
+        try:
+            handler = BatchRotatingFileHandler(fn)
+            flushed = []
+            handler.stream.flush = lambda: flushed.append(True)
+            handler.batching = True
+            handler.flush()
+            self.assertEqual(flushed, [])
+            handler.batching = False
+            handler.flush()
+            self.assertEqual(flushed, [True])
+            del handler.stream.flush
+            handler.close()
+        finally:
+            os.remove(fn)
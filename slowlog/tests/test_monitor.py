@@ -1,5 +1,8 @@
 
+import os
+import sys
 import time
+import types
 try:
     import unittest2 as unittest
 except ImportError:
@@ -57,17 +60,78 @@ class TestMonitor(unittest.TestCase):
         obj = self._make()
         reporter = self._make_reporter()
         obj.add(reporter)
-        self.assertFalse(obj.queue.empty())
+        self.assertEqual(list(obj.pending), [(reporter, True)])
         self.assertFalse(obj.reporters)
-        self.assertEqual(obj.queue.get(), (reporter, True))
+        # The monitor is busy (or not started), so it was not woken.
+        self.assertTrue(obj.queue.empty())
+
+    def test_add_wakes_sleeping_monitor(self):
+        obj = self._make()
+        obj.wake_at = 1300.0
+        obj.add(self._make_reporter(report_at=1400.0))
+        self.assertTrue(obj.queue.empty())
+        obj.add(self._make_reporter(report_at=1200.0))
+        self.assertEqual(obj.queue.get_nowait(), ())
+        self.assertEqual(obj.wake_at, 0.0)
 
     def test_remove(self):
         obj = self._make()
+        obj.wake_at = float('inf')
         reporter = self._make_reporter()
         obj.remove(reporter)
-        self.assertFalse(obj.queue.empty())
+        self.assertEqual(list(obj.pending), [(reporter, False)])
         self.assertFalse(obj.reporters)
-        self.assertEqual(obj.queue.get(), (reporter, False))
+        self.assertTrue(obj.queue.empty())
+
+    def test_drain(self):
+        obj = self._make()
+        reporter1 = self._make_reporter(report_at=1300.0)
+        reporter2 = self._make_reporter(report_at=1200.0)
+        obj.add(reporter1)
+        obj.add(reporter2)
+        self.assertEqual(obj.drain(), 1200.0)
+        self.assertEqual(set(obj.reporters), set([reporter1, reporter2]))
+        self.assertFalse(obj.pending)
+        self.assertEqual((obj.added, obj.removed, obj.cancelled), (2, 0, 0))
+
+        obj.remove(reporter1)
+        self.assertIsNone(obj.drain())
+        self.assertEqual(set(obj.reporters), set([reporter2]))
+        self.assertEqual((obj.added, obj.removed, obj.cancelled), (2, 1, 0))
+
+    def test_drain_cancels_pairs(self):
+        obj = self._make()
+        for _i in range(5):
+            reporter = self._make_reporter()
+            obj.add(reporter)
+            obj.remove(reporter)
+        reporter = self._make_reporter(report_at=1300.0)
+        obj.add(reporter)
+        self.assertEqual(obj.drain(), 1300.0)
+        self.assertEqual(set(obj.reporters), set([reporter]))
+        self.assertEqual(len(obj.schedule), 1)
+        self.assertEqual((obj.added, obj.removed, obj.cancelled), (1, 0, 5))
+
+    def test_drain_with_add_remove_add(self):
+        obj = self._make()
+        reporter = self._make_reporter()
+        obj.add(reporter)
+        obj.remove(reporter)
+        obj.add(reporter)
+        obj.drain()
+        self.assertEqual(set(obj.reporters), set([reporter]))
+        self.assertEqual(obj.cancelled, 1)
+
+    def test_drain_with_remove_add(self):
+        obj = self._make()
+        reporter = self._make_reporter()
+        obj._add(reporter)
+        obj.remove(reporter)
+        obj.add(reporter)
+        obj.drain()
+        self.assertEqual(set(obj.reporters), set([reporter]))
+        self.assertEqual(len(obj.schedule), 1)
+        self.assertEqual(obj.cancelled, 0)
 
     def test_run_after_add_one(self):
         obj = self._make()
@@ -75,16 +139,16 @@ class TestMonitor(unittest.TestCase):
         obj.add(reporter)
         obj.queue.put(None)
         obj.run()
-        self.assertEqual(obj.reporters, set([reporter]))
+        self.assertEqual(set(obj.reporters), set([reporter]))
 
     def test_run_after_remove_one(self):
         obj = self._make()
         reporter = self._make_reporter()
-        obj.reporters.add(reporter)
+        obj._add(reporter)
         obj.remove(reporter)
         obj.queue.put(None)
         obj.run()
-        self.assertEqual(obj.reporters, set())
+        self.assertEqual(set(obj.reporters), set())
 
     def test_run_after_add_2_and_remove_1(self):
         obj = self._make()
@@ -95,7 +159,7 @@ class TestMonitor(unittest.TestCase):
         obj.remove(reporter1)
         obj.queue.put(None)
         obj.run()
-        self.assertEqual(obj.reporters, set([reporter2]))
+        self.assertEqual(set(obj.reporters), set([reporter2]))
 
     def test_run_without_reporters(self):
         obj = self._make()
@@ -111,9 +175,9 @@ class TestMonitor(unittest.TestCase):
         obj.queue = self._make_nosleep_queue()
 
         reporter1 = self._make_reporter(report_at=now + 2400.0)
-        obj.reporters.add(reporter1)
+        obj._add(reporter1)
         reporter2 = self._make_reporter(report_at=now + 1800.0)
-        obj.reporters.add(reporter2)
+        obj._add(reporter2)
 
         obj.run()
         self.assertEqual(len(self.queue_gets), 1)
@@ -126,9 +190,9 @@ class TestMonitor(unittest.TestCase):
         obj.queue = self._make_nosleep_queue()
 
         reporter1 = self._make_reporter(report_at=1233.9)
-        obj.reporters.add(reporter1)
+        obj._add(reporter1)
         reporter2 = self._make_reporter(report_at=1233.8)
-        obj.reporters.add(reporter2)
+        obj._add(reporter2)
 
         obj.run(time=lambda: 1234.0)
 
@@ -160,7 +224,7 @@ class TestMonitor(unittest.TestCase):
             obj = self._make()
             obj.queue = self._make_nosleep_queue()
             reporter = self._make_reporter(report_at=1234.0, ident=ident)
-            obj.reporters.add(reporter)
+            obj._add(reporter)
             obj.run(time=lambda: 1234.1)
         finally:
             end_queue.put(None)  # Let the thread end.
@@ -183,7 +247,7 @@ class TestMonitor(unittest.TestCase):
 
         reporter = self._make_reporter(report_at=1234.0,
                                        report_error=ValueError('synthetic'))
-        obj.reporters.add(reporter)
+        obj._add(reporter)
 
         obj.run(time=lambda: 1234.0)
 
@@ -193,6 +257,36 @@ class TestMonitor(unittest.TestCase):
         t = self.queue_gets[0][1]
         self.assertEqual(t, 10.0)
 
+    def test_run_records_stats(self):
+        from slowlog.stats import MonitorStats
+        obj = self._make()
+        obj.stats = MonitorStats()
+        obj.queue = self._make_nosleep_queue()
+        obj._add(self._make_reporter(report_at=1234.0))
+        obj._add(self._make_reporter(
+            report_at=1234.0, report_error=ValueError('synthetic')))
+        obj.run(time=lambda: 1234.0)
+        self.assertEqual(obj.stats.reports, 1)
+        self.assertEqual(obj.stats.errors, 1)
+        self.assertEqual(obj.stats.report.count, 1)
+        self.assertEqual(obj.stats.sweep.count, 1)
+
+    def test_get_stats(self):
+        from slowlog.stats import MonitorStats
+        obj = self._make()
+        obj.stats = MonitorStats()
+        obj.stats.reports = 2
+        obj._add(self._make_reporter())
+        obj.add(self._make_reporter())
+        obj.slots[(5, object())] = (1000.0, 998.0, None)
+        stats = obj.get_stats()
+        self.assertEqual(stats['reports'], 2)
+        self.assertEqual(stats['reporters'], 1)
+        self.assertEqual(stats['pending'], 1)
+        self.assertEqual(stats['slots'], 1)
+        self.assertEqual(stats['added'], 0)
+        self.assertEqual(stats['sweep']['count'], 0)
+
     def test_run_when_timeout_reached(self):
         from slowlog.compat import Empty
         queue_gets = []
@@ -214,13 +308,660 @@ class TestMonitor(unittest.TestCase):
         obj.queue = DummyQueue()
 
         reporter = self._make_reporter(report_at=1234.0)
-        obj.reporters.add(reporter)
+        obj._add(reporter)
 
         obj.run(time=lambda: 1234.0)
 
         self.assertEqual(self.reported, [(1234.0, None)])
         self.assertEqual(queue_gets, [(True, 10.0), (True, 10.0)])
 
+    def test_sweep_calls_only_due_reporters(self):
+        obj = self._make()
+        reporter1 = self._make_reporter(report_at=1234.0, ident='r1')
+        obj._add(reporter1)
+        reporter2 = self._make_reporter(report_at=1300.0, ident='r2')
+        obj._add(reporter2)
+        next_at = obj.sweep(1234.5)
+        self.assertEqual(self.reported, [(1234.5, None)])
+        self.assertEqual(reporter1.report_at, 1244.5)
+        self.assertEqual(next_at, 1244.5)
+        self.assertEqual(len(obj.schedule), 2)
+
+    def test_sweep_reports_in_deadline_order(self):
+        obj = self._make()
+        for ident, report_at in (('c', 3.0), ('a', 1.0), ('b', 2.0)):
+            reporter = self._make_reporter(report_at=report_at, ident=ident)
+            obj._add(reporter)
+
+        def current_frames():
+            return dict((r.ident, r.ident) for r in obj.reporters)
+
+        import slowlog.monitor
+        orig = slowlog.monitor.sys
+        try:
+            class DummySys:
+                _current_frames = staticmethod(current_frames)
+            slowlog.monitor.sys = DummySys
+            obj.sweep(5.0)
+        finally:
+            slowlog.monitor.sys = orig
+        order = [frame for _t, frame in self.reported]
+        self.assertEqual(order, ['a', 'b', 'c'])
+
+    def test_sweep_with_task_reporter(self):
+        obj = self._make()
+        reporter = self._make_reporter(report_at=1.0, ident='loop')
+        reporter.get_frame = lambda thread_frame: ('task', thread_frame)
+        obj._add(reporter)
+
+        def current_frames():
+            return {'loop': 'loop frame'}
+
+        import slowlog.monitor
+        orig = slowlog.monitor.sys
+        try:
+            class DummySys:
+                _current_frames = staticmethod(current_frames)
+            slowlog.monitor.sys = DummySys
+            obj.sweep(5.0)
+        finally:
+            slowlog.monitor.sys = orig
+        self.assertEqual(self.reported, [(5.0, ('task', 'loop frame'))])
+
+    def test_sweep_skips_removed_reporters(self):
+        obj = self._make()
+        reporter1 = self._make_reporter(report_at=1234.0)
+        obj._add(reporter1)
+        reporter2 = self._make_reporter(report_at=1234.0)
+        obj._add(reporter2)
+        obj._remove(reporter1)
+        self.assertEqual(len(obj.schedule), 2)
+        obj.sweep(1235.0)
+        self.assertEqual(len(self.reported), 1)
+        self.assertEqual(len(obj.schedule), 1)
+        self.assertIs(obj.schedule[0][2], reporter2)
+
+    def test_sweep_with_only_removed_reporters(self):
+        obj = self._make()
+        reporter1 = self._make_reporter(report_at=1234.0)
+        obj._add(reporter1)
+        reporter2 = self._make_reporter(report_at=1240.0)
+        obj._add(reporter2)
+        obj.reporters.clear()
+        self.assertIsNone(obj.sweep(1235.0))
+        self.assertEqual(self.reported, [])
+        self.assertEqual(obj.schedule, [])
+
+    def test_sweep_stops_reporter_without_interval(self):
+        obj = self._make()
+
+        class LastReporter(object):
+            ident = 'x'
+            report_at = 1234.0
+            interval = 10.0
+
+            def __call__(self, report_time, frame):
+                self.interval = None
+
+        reporter = LastReporter()
+        obj._add(reporter)
+        self.assertIsNone(obj.sweep(1235.0))
+        self.assertEqual(obj.schedule, [])
+        # The reporter stays registered until it is removed.
+        self.assertEqual(obj.reporters, {reporter: None})
+        self.assertEqual(obj.active_idents(), set(['x']))
+        obj._remove(reporter)
+        self.assertEqual(obj.reporters, {})
+
+    def test_sweep_coalesces_identical_stacks(self):
+        import sys
+        obj = self._make()
+        groups = []
+
+        def here():
+            return sys._getframe()
+
+        frame_a = here()
+        frame_b = sys._getframe()
+
+        class CoalescingReporter(object):
+            report_at = 1234.0
+            interval = 10.0
+            coalesce = 'owner'
+
+            def __init__(self, ident):
+                self.ident = ident
+
+            def walk(self, frame):
+                return [frame]
+
+            def report_group(self, report_time, stack, others):
+                groups.append((self, stack, others))
+
+        r1, r2, r3 = [CoalescingReporter(ident) for ident in (1, 2, 3)]
+        r4 = self._make_reporter(report_at=1234.0, ident=4)
+        for reporter in (r1, r2, r3, r4):
+            obj._add(reporter)
+
+        def current_frames():
+            return {1: frame_a, 2: frame_a, 3: frame_b, 4: frame_a}
+
+        import slowlog.monitor
+        orig = slowlog.monitor.sys
+        try:
+            class DummySys:
+                _current_frames = staticmethod(current_frames)
+            slowlog.monitor.sys = DummySys
+            next_at = obj.sweep(1235.0)
+        finally:
+            slowlog.monitor.sys = orig
+        self.assertEqual(sorted((g[0].ident, [o.ident for o in g[2]])
+                                for g in groups),
+                         [(1, [2]), (3, [])])
+        self.assertEqual(groups[0][1], [frame_a])
+        # Reporters without a coalesce key are called as usual.
+        self.assertEqual(self.reported, [(1235.0, frame_a)])
+        self.assertEqual(r4.report_at, 1245.0)
+        # Coalescing reporters stay on multiples of their interval.
+        self.assertEqual(next_at, 1240.0)
+        self.assertEqual(r1.report_at, 1240.0)
+        self.assertEqual(len(obj.schedule), 4)
+
+    def test_sample_stacks(self):
+        import sys
+        from slowlog.compat import get_ident
+        obj = self._make()
+        obj.slots[(get_ident(), 'owner')] = (1234.0, 1232.0, None)
+        obj.slots[(-1, 'owner')] = (1234.0, 1232.0, None)
+        stacks = obj.sample_stacks(1234.0, 3)
+        self.assertEqual(list(stacks), [get_ident()])
+        stack = stacks[get_ident()]
+        self.assertEqual(len(stack), 3)
+        self.assertIs(stack[1], sys._getframe())
+        # Reporters called in the same sweep share the stacks.
+        self.assertIs(obj.sample_stacks(1234.0, 3), stacks)
+        self.assertEqual(obj.sample_stacks(1234.0, 1),
+                         {get_ident(): stack[:1]})
+        self.assertIsNot(obj.sample_stacks(1234.0, 5), stacks)
+        self.assertIsNot(obj.sample_stacks(1235.0, 5), stacks)
+
+    def test_sweep_forgets_sampled_stacks(self):
+        obj = self._make()
+        obj._add(self._make_reporter(report_at=1234.0))
+        obj.sample_stacks(1235.0)
+        self.assertIsNotNone(obj.sampled)
+        obj.sweep(1235.0)
+        self.assertIsNone(obj.sampled)
+
+    def test_sweep_coalesces_staggered_reporters(self):
+        import sys
+        obj = self._make()
+        groups = []
+        frame = sys._getframe()
+
+        class CoalescingReporter(object):
+            interval = 1.0
+            coalesce = 'owner'
+
+            def __init__(self, ident, report_at):
+                self.ident = ident
+                self.report_at = report_at
+
+            def walk(self, frame):
+                return [frame]
+
+            def report_group(self, report_time, stack, others):
+                groups.append((report_time, self, others))
+
+        reporters = [CoalescingReporter(ident, 1233.0 + ident * 0.05)
+                     for ident in range(1, 20)]
+        for reporter in reporters:
+            obj.add(reporter)
+        self.assertEqual(obj.drain(), 1234.0)
+        self.assertEqual(set(r.report_at for r in reporters), set([1234.0]))
+
+        import slowlog.monitor
+        orig = slowlog.monitor.sys
+        try:
+            class DummySys:
+                @staticmethod
+                def _current_frames():
+                    return dict((r.ident, frame) for r in reporters)
+            slowlog.monitor.sys = DummySys
+            # The monitor wakes up a little late.
+            next_at = obj.sweep(1234.02)
+            self.assertEqual(next_at, 1235.0)
+            self.assertEqual(obj.sweep(1235.01), 1236.0)
+        finally:
+            slowlog.monitor.sys = orig
+        self.assertEqual([(t, len(others)) for t, _r, others in groups],
+                         [(1234.02, 18), (1235.01, 18)])
+
+    def test_poll_aligns_coalescing_reporters(self):
+        obj = self._make()
+
+        class CoalescingReporter(object):
+            interval = 2.0
+            coalesce = 'owner'
+
+            def __init__(self, ident, report_at):
+                self.ident = ident
+                self.report_at = report_at
+
+        class Owner(object):
+            def make_reporter(self, context, start, report_at, ident):
+                return CoalescingReporter(ident, report_at)
+
+        owner = Owner()
+        obj.slots[('t1', owner)] = (1233.1, 1231.1, None)
+        obj.slots[('t2', owner)] = (1233.7, 1231.7, None)
+        obj.poll(1234.0)
+        self.assertEqual(sorted(r.report_at for r in obj.reporters),
+                         [1234.0, 1234.0])
+
+    def test_remove_last_reporter_clears_schedule(self):
+        obj = self._make()
+        reporter = self._make_reporter(report_at=1234.0)
+        obj._add(reporter)
+        obj._remove(reporter)
+        self.assertEqual(obj.schedule, [])
+
+    def test_remove_compacts_schedule(self):
+        obj = self._make()
+        keep = self._make_reporter(report_at=1234.0)
+        obj._add(keep)
+        for _i in range(100):
+            reporter = self._make_reporter(report_at=1234.0)
+            obj._add(reporter)
+            obj._remove(reporter)
+        self.assertLessEqual(len(obj.schedule), 2 * len(obj.reporters) + 65)
+        obj.sweep(1235.0)
+        self.assertEqual(len(self.reported), 1)
+
+    def test_readd_after_remove(self):
+        obj = self._make()
+        reporter = self._make_reporter(report_at=1234.0)
+        obj._add(reporter)
+        obj._add(self._make_reporter(report_at=1300.0))
+        obj._remove(reporter)
+        obj._add(reporter)
+        obj.sweep(1235.0)
+        # The stale entry must not cause a second report.
+        self.assertEqual(len(self.reported), 1)
+
+    def _make_slot_owner(self, make_error=None):
+        made = self.made = []
+        test = self
+
+        class DummyOwner:
+            def make_reporter(self, context, start, report_at, ident):
+                if make_error is not None:
+                    raise make_error
+                reporter = test._make_reporter(report_at=report_at,
+                                               ident=ident)
+                reporter.context = context
+                reporter.start = start
+                made.append(reporter)
+                return reporter
+
+        return DummyOwner()
+
+    def test_wake(self):
+        obj = self._make()
+        obj.wake_at = float('inf')
+        obj.wake()
+        self.assertEqual(obj.wake_at, 0.0)
+        self.assertEqual(obj.queue.get(), ())
+
+    def test_active_idents(self):
+        obj = self._make()
+        obj.slots[(5, object())] = (1000.0, 998.0, None)
+        obj._add(self._make_reporter(ident=6))
+        obj._add(self._make_reporter(ident=None))
+        self.assertEqual(obj.active_idents(), set([5, 6]))
+
+    def test_poll_without_slots(self):
+        obj = self._make()
+        self.assertIsNone(obj.poll(1234.0))
+
+    def test_poll_with_future_slot(self):
+        obj = self._make()
+        owner = self._make_slot_owner()
+        obj.slots[('t1', owner)] = (1234.05, 1232.05, 'ctx')
+        self.assertEqual(obj.poll(1234.0), 1234.05)
+        obj.slots[('t1', owner)] = (1300.0, 1298.0, 'ctx')
+        self.assertEqual(obj.poll(1234.0), 1234.0 + obj.poll_interval)
+        self.assertEqual(self.made, [])
+        self.assertFalse(obj.reporters)
+
+    def test_poll_with_due_slot(self):
+        obj = self._make()
+        owner = self._make_slot_owner()
+        slot = (1233.0, 1231.0, 'ctx')
+        obj.slots[('t1', owner)] = slot
+        obj.poll(1234.0)
+        self.assertEqual(len(self.made), 1)
+        reporter = self.made[0]
+        self.assertEqual(reporter.ident, 't1')
+        self.assertEqual(reporter.context, 'ctx')
+        self.assertEqual(reporter.start, 1231.0)
+        self.assertEqual(reporter.report_at, 1233.0)
+        self.assertEqual(set(obj.reporters), set([reporter]))
+        self.assertEqual(obj.slot_reporters, {('t1', owner): (slot, reporter)})
+
+        # Polling again does not create another reporter.
+        obj.poll(1235.0)
+        self.assertEqual(len(self.made), 1)
+
+    def test_poll_after_slot_released(self):
+        obj = self._make()
+        owner = self._make_slot_owner()
+        obj.slots[('t1', owner)] = (1233.0, 1231.0, 'ctx')
+        obj.poll(1234.0)
+        del obj.slots[('t1', owner)]
+        self.assertIsNone(obj.poll(1235.0))
+        self.assertFalse(obj.reporters)
+        self.assertFalse(obj.slot_reporters)
+
+    def test_poll_after_slot_reused(self):
+        obj = self._make()
+        owner = self._make_slot_owner()
+        obj.slots[('t1', owner)] = (1233.0, 1231.0, 'ctx1')
+        obj.poll(1234.0)
+        # The thread finished its request and started another.
+        obj.slots[('t1', owner)] = (1300.0, 1298.0, 'ctx2')
+        obj.poll(1235.0)
+        self.assertEqual(len(self.made), 1)
+        self.assertFalse(obj.reporters)
+        self.assertFalse(obj.slot_reporters)
+
+    def test_poll_with_broken_owner(self):
+        obj = self._make()
+        owner = self._make_slot_owner(make_error=ValueError('synthetic'))
+        slot = (1233.0, 1231.0, 'ctx')
+        obj.slots[('t1', owner)] = slot
+        obj.poll(1234.0)
+        self.assertFalse(obj.reporters)
+        self.assertEqual(obj.slot_reporters, {('t1', owner): (slot, None)})
+        del obj.slots[('t1', owner)]
+        obj.poll(1235.0)
+        self.assertFalse(obj.slot_reporters)
+
+    def test_run_with_due_slot(self):
+        obj = self._make()
+        obj.queue = self._make_nosleep_queue()
+        owner = self._make_slot_owner()
+        obj.slots[('t1', owner)] = (1233.0, 1231.0, 'ctx')
+        obj.run(time=lambda: 1234.0)
+        self.assertEqual(self.reported, [(1234.0, None)])
+        self.assertEqual(len(self.queue_gets), 1)
+        block, timeout = self.queue_gets[0]
+        self.assertTrue(block)
+        self.assertAlmostEqual(timeout, obj.poll_interval)
+
+    def test_run_publishes_wake_at(self):
+        obj = self._make()
+        wake_at = []
+
+        class DummyQueue:
+            def get(self, block=True, timeout=None):
+                wake_at.append(obj.wake_at)
+                return None
+
+        obj.queue = DummyQueue()
+        obj.run(time=lambda: 1234.0)
+        self.assertEqual(wake_at, [float('inf')])
+
+        wake_at[:] = []
+        obj._add(self._make_reporter(report_at=1300.0))
+        obj.run(time=lambda: 1234.0)
+        self.assertEqual(wake_at, [1300.0])
+
+    def test_run_woken(self):
+        obj = self._make()
+        obj.queue.put(())
+        obj.queue.put(None)
+        obj.run()
+        self.assertFalse(obj.reporters)
+
+    def test_run_drains_late_registrations(self):
+        # Registrations that arrive while the monitor is busy shorten
+        # the wait.
+        obj = self._make()
+        obj._add(self._make_reporter(report_at=1300.0))
+        late = self._make_reporter(report_at=1240.0)
+        queue_gets = []
+
+        class DummyQueue:
+            def get(self, block=True, timeout=None):
+                queue_gets.append(timeout)
+                return None
+
+        def time():
+            obj.pending.append((late, True))
+            return 1234.0
+
+        obj.queue = DummyQueue()
+        obj.run(time=time)
+        self.assertIn(late, obj.reporters)
+        self.assertEqual(queue_gets, [6.0])
+
+    def test_run_with_pending_pairs(self):
+        obj = self._make()
+        obj.queue = self._make_nosleep_queue()
+        reporter = self._make_reporter()
+        obj.add(reporter)
+        obj.remove(reporter)
+        obj.run()
+        self.assertEqual(self.reported, [])
+        self.assertEqual(obj.cancelled, 1)
+        self.assertEqual(self.queue_gets, [(True, None)])
+
+    def test_lazy_request_with_real_thread(self):
+        # A request that outlives its timeout gets a reporter;
+        # a request that finishes quickly never does.
+        from slowlog.compat import get_ident
+
+        obj = self._make()
+        obj.poll_interval = 0.01
+        owner = self._make_slot_owner()
+        obj.start()
+        try:
+            key = (get_ident(), owner)
+            now = time.time()
+            obj.slots[key] = (now + 3600.0, now, 'fast')
+            if now + 3600.0 < obj.wake_at:
+                obj.wake()
+            del obj.slots[key]
+
+            now = time.time()
+            obj.slots[key] = (now + 0.05, now, 'slow')
+            if now + 0.05 < obj.wake_at:
+                obj.wake()
+            for _i in range(200):
+                if self.reported:
+                    break
+                time.sleep(0.01)
+            del obj.slots[key]
+        finally:
+            obj.stop()
+            obj.join()
+
+        self.assertEqual([r.context for r in self.made], ['slow'])
+        self.assertTrue(self.reported)
+        frame = self.reported[0][1]
+        self.assertIsNotNone(frame)
+
+    @unittest.skipIf(sys.version_info[0] < 3, "Requires Python 3")
+    def test_native_thread_under_gevent(self):
+        from slowlog.compat import NativeQueue
+        from slowlog.compat import get_ident
+        saved = sys.modules.get('gevent.monkey')
+        module = types.ModuleType('gevent.monkey')
+        module.is_module_patched = lambda name: name == 'threading'
+        module.get_original = None
+        sys.modules['gevent.monkey'] = module
+        try:
+            obj = self._make()
+        finally:
+            if saved is None:
+                del sys.modules['gevent.monkey']
+            else:
+                sys.modules['gevent.monkey'] = saved  # pragma no cover
+        self.assertTrue(obj.native)
+        self.assertIsInstance(obj.queue, NativeQueue)
+
+        obj.start()
+        try:
+            obj.add(self._make_reporter(report_at=time.time(),
+                                        ident=get_ident()))
+            obj.wake()
+            for _i in range(200):
+                if self.reported:
+                    break
+                time.sleep(0.01)
+        finally:
+            obj.stop()
+        self.assertIsNotNone(self.reported[0][1])
+
+
+class TestStatsReporter(unittest.TestCase):
+
+    def _make(self):
+        from slowlog.monitor import StatsReporter
+        self.sent = sent = []
+
+        class DummyClient:
+            def incr(self, stat, count=1, buf=None):
+                buf.append('%s:%s|c' % (stat, count))
+
+            def gauge(self, stat, value, buf=None):
+                buf.append('%s:%s|g' % (stat, value))
+
+            def sendbuf(self, buf):
+                sent.append(buf)
+
+        return StatsReporter(DummyClient(), interval=30.0)
+
+    def _make_stats(self, reports, sweeps, sweep_total):
+        from slowlog.stats import MonitorStats
+        stats = MonitorStats().snapshot()
+        stats.update({
+            'reports': reports,
+            'added': 0,
+            'removed': 0,
+            'cancelled': 0,
+            'reporters': 4,
+            'slots': 2,
+            'pending': 0,
+        })
+        stats['sweep']['count'] = sweeps
+        stats['sweep']['total'] = sweep_total
+        return stats
+
+    def test_ctor(self):
+        obj = self._make()
+        self.assertEqual(obj.interval, 30.0)
+        self.assertIsNone(obj.ident)
+
+    def test_send(self):
+        obj = self._make()
+        obj.send(self._make_stats(5, 10, 0.01))
+        obj.send(self._make_stats(7, 12, 0.016))
+        first, second = self.sent
+        self.assertIn('slowlog.monitor.reports:5|c', first)
+        self.assertIn('slowlog.monitor.reporters:4|g', first)
+        self.assertIn('slowlog.monitor.sweep:10|c', first)
+        self.assertIn('slowlog.monitor.sweep_ms:1.000|g', first)
+        self.assertIn('slowlog.monitor.reports:2|c', second)
+        self.assertIn('slowlog.monitor.sweep:2|c', second)
+        self.assertIn('slowlog.monitor.sweep_ms:3.000|g', second)
+        # Histograms without new timings are not sent.
+        self.assertFalse([line for line in second if '.log' in line])
+
+    def test_call_without_monitor(self):
+        from slowlog import monitor
+        obj = self._make()
+        saved = monitor._monitor
+        monitor._monitor = None
+        try:
+            obj(1234.0)
+        finally:
+            monitor._monitor = saved
+        self.assertEqual(self.sent, [])
+
+    def test_call_with_monitor(self):
+        from slowlog import monitor
+        obj = self._make()
+        saved = monitor._monitor
+        monitor._monitor = monitor.Monitor()
+        try:
+            obj(1234.0)
+        finally:
+            monitor._monitor = saved
+        self.assertEqual(len(self.sent), 1)
+        self.assertIn('slowlog.monitor.pending:0|g', self.sent[0])
+
+    def test_call_with_new_monitor(self):
+        # A forked child starts a new Monitor; its counters start over.
+        from slowlog import monitor
+        obj = self._make()
+        saved = monitor._monitor
+        parent = monitor._monitor = monitor.Monitor()
+        parent.added = 10
+        try:
+            obj(1234.0)
+            monitor._monitor = child = monitor.Monitor()
+            child.added = 2
+            obj(1235.0)
+        finally:
+            monitor._monitor = saved
+        self.assertIn('slowlog.monitor.added:10|c', self.sent[0])
+        self.assertIn('slowlog.monitor.added:2|c', self.sent[1])
+        self.assertIs(obj.monitor, child)
+
+
+class TestBackoff(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.monitor import Backoff
+        return Backoff
+
+    def test_defaults(self):
+        obj = self._class()
+        self.assertEqual(obj.next_interval(1.0, 1000), 1.0)
+
+    def test_factor_and_max_interval(self):
+        obj = self._class(factor=2.0, max_interval=5.0)
+        intervals = []
+        interval = 1.0
+        for count in range(1, 6):
+            interval = obj.next_interval(interval, count)
+            intervals.append(interval)
+        self.assertEqual(intervals, [2.0, 4.0, 5.0, 5.0, 5.0])
+
+    def test_max_reports(self):
+        obj = self._class(max_reports=3)
+        self.assertEqual(obj.next_interval(1.0, 2), 1.0)
+        self.assertIsNone(obj.next_interval(1.0, 3))
+
+
+class Test_make_backoff(unittest.TestCase):
+
+    def _call(self, *args):
+        from slowlog.monitor import make_backoff
+        return make_backoff(*args)
+
+    def test_without_backoff(self):
+        self.assertIsNone(self._call())
+        self.assertIsNone(self._call(1.0, 0, 0))
+
+    def test_with_backoff(self):
+        obj = self._call(1.5, 60.0, 10)
+        self.assertEqual((obj.factor, obj.max_interval, obj.max_reports),
+                         (1.5, 60.0, 10))
+
 
 class Test_get_monitor(unittest.TestCase):
 
@@ -236,6 +977,13 @@ class Test_get_monitor(unittest.TestCase):
         from slowlog.monitor import get_monitor
         return get_monitor()
 
+    def _wait_for(self, condition):
+        for _i in range(200):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("Timed out")
+
     def test_once(self):
         monitor = self._call()
         self.assertIsNotNone(monitor)
@@ -253,6 +1001,105 @@ class Test_get_monitor(unittest.TestCase):
         monitor2 = self._call()
         self.assertIsNot(monitor1, monitor2)
 
+    def test_installed_reporters(self):
+        from slowlog.monitor import install
+        from slowlog.monitor import uninstall
+
+        class DummyReporter:
+            ident = None
+            report_at = time.time() + 3600.0
+            interval = 3600.0
+
+        reporter = DummyReporter()
+        install(reporter)
+        try:
+            install(reporter)  # No effect
+            monitor1 = self._call()
+            monitor1.stop()
+            monitor1.join()
+            self.assertIn(reporter, monitor1.reporters)
+            monitor2 = self._call()
+            self.assertIsNot(monitor2, monitor1)
+            self._wait_for(lambda: reporter in monitor2.reporters)
+        finally:
+            uninstall(reporter)
+        # The monitor drains the removal before it would call the reporter.
+        self.assertEqual(list(monitor2.pending), [(reporter, False)])
+        uninstall(reporter)  # No effect
+
+    def test_install_with_running_monitor(self):
+        from slowlog.monitor import install
+        from slowlog.monitor import uninstall
+
+        class DummyReporter:
+            ident = None
+            report_at = time.time() + 3600.0
+            interval = 3600.0
+
+        monitor = self._call()
+        reporter = DummyReporter()
+        install(reporter)
+        try:
+            self._wait_for(lambda: reporter in monitor.reporters)
+        finally:
+            uninstall(reporter)
+
+    def test_restart_in_forked_child(self):
+        # Emulate a fork on a Python without os.register_at_fork().
+        import slowlog.monitor
+        from slowlog.stats import monitor_stats
+        monitor1 = self._call()
+        monitor_stats.errors = 5  # Inherited from the parent
+        slowlog.monitor._monitor_pid = -1
+        monitor2 = self._call()
+        self.assertIsNot(monitor2, monitor1)
+        self.assertEqual(monitor2.get_stats()['errors'], 0)
+        self.assertIs(self._call(), monitor2)
+        monitor1.queue.put(None)
+        monitor1.join()
+        self.assertIs(slowlog.monitor._monitor, monitor2)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+    def test_reports_in_forked_child(self):
+        from threading import Event
+        monitor = self._call()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            # Child process: report through a fresh monitor, then exit
+            # without running the rest of the test suite.
+            status = 1
+            try:
+                os.close(read_fd)
+                child_monitor = self._call()
+                reported = Event()
+
+                class PipeReporter:
+                    ident = None
+                    report_at = time.time()
+                    interval = 3600.0
+
+                    def __call__(self, report_time, frame=None):
+                        os.write(write_fd, b'reported')
+                        reported.set()
+
+                if child_monitor is not monitor:
+                    child_monitor.add(PipeReporter())
+                    reported.wait(5.0)
+                    status = 0
+            finally:
+                os._exit(status)
+
+        os.close(write_fd)
+        try:
+            data = os.read(read_fd, 100)
+        finally:
+            os.close(read_fd)
+            _pid, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.assertEqual(data, b'reported')
+        self.assertIs(self._call(), monitor)
+
     def test_delete_monitor_on_stop(self):
         monitor = self._call()
         monitor.queue.put(None)
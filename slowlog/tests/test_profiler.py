@@ -0,0 +1,114 @@
+"""Tests of slowlog.profiler"""
+
+import sys
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+def outer(profiler):
+    return inner(profiler)
+
+
+def inner(profiler):
+    profiler(123456789.0)
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.profiler import SamplingProfiler
+        return SamplingProfiler
+
+    def _make(self, idents=None, **kw):
+        obj = self._class(**kw)
+        from slowlog.compat import get_ident
+        if idents is None:
+            idents = set([get_ident()])
+
+        from slowlog.monitor import Monitor
+
+        class DummyMonitor(Monitor):
+            def active_idents(self):
+                return idents
+
+        monitor = DummyMonitor()
+        obj.get_monitor = lambda: monitor
+        return obj
+
+    def _find(self, node, name):
+        for child in node['children']:
+            if child['name'] == name:
+                return child
+            found = self._find(child, name)
+            if found is not None:
+                return found
+        return None
+
+    def test_ctor(self):
+        obj = self._make(rate=50.0)
+        self.assertEqual(obj.interval, 0.02)
+        self.assertIsNone(obj.ident)
+        self.assertEqual(obj.samples, 0)
+
+    def test_call_without_threads(self):
+        obj = self._make(idents=set())
+        obj(123456789.0)
+        self.assertEqual(obj.samples, 0)
+
+    def test_call_with_unknown_thread(self):
+        obj = self._make(idents=set([-1]))
+        obj(123456789.0)
+        self.assertEqual(obj.samples, 0)
+
+    def test_call_samples_request_thread(self):
+        obj = self._make()
+        outer(obj)
+        outer(obj)
+        snapshot = obj.snapshot()
+        self.assertEqual(snapshot['samples'], 2)
+        self.assertEqual(snapshot['truncated'], 0)
+        node = self._find(snapshot, 'outer')
+        self.assertEqual(node['samples'], 2)
+        self.assertEqual(node['self'], 0)
+        self.assertEqual(node['filename'], outer.__code__.co_filename)
+        self.assertEqual(node['lineno'], outer.__code__.co_firstlineno)
+        self.assertEqual(len(node['children']), 1)
+        child = node['children'][0]
+        self.assertEqual(child['name'], 'inner')
+        self.assertEqual(child['samples'], 2)
+        # The sample is taken by the monitor, called from __call__.
+        call = child['children'][0]
+        self.assertEqual(call['name'], '__call__')
+        self.assertEqual(call['children'][0]['name'], 'sample_stacks')
+        self.assertEqual(call['children'][0]['self'], 2)
+
+    def test_add_stack_with_node_budget(self):
+        obj = self._make(max_nodes=3)
+        frame = sys._getframe()
+        obj.add_stack([frame, frame.f_back, frame.f_back.f_back])
+        self.assertEqual(obj.nodes, 3)
+        self.assertEqual(obj.truncated, 1)
+        snapshot = obj.snapshot()
+        self.assertEqual(snapshot['samples'], 1)
+        outermost = snapshot['children'][0]
+        self.assertEqual(outermost['children'][0]['self'], 1)
+        self.assertEqual(outermost['children'][0]['children'], [])
+
+    def test_snapshot_with_reset(self):
+        obj = self._make()
+        outer(obj)
+        snapshot = obj.snapshot(reset=True)
+        self.assertEqual(snapshot['samples'], 1)
+        self.assertEqual(obj.samples, 0)
+        self.assertEqual(obj.nodes, 1)
+        self.assertEqual(obj.snapshot()['children'], [])
+
+    def test_reset(self):
+        obj = self._make()
+        outer(obj)
+        obj.reset()
+        self.assertEqual(obj.snapshot()['samples'], 0)
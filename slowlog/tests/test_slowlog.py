@@ -43,9 +43,23 @@ class Test_includeme(unittest.TestCase):
         self._call(config)
         self.assertEqual(self.added_tweens, ['slowlog.tween.FrameStatsTween'])
 
+    def test_with_stats_uri(self):
+        from slowlog.monitor import StatsReporter
+        from slowlog.monitor import _installed
+        from slowlog.monitor import uninstall
+        config = self._make_config(settings={
+            'slowlog_stats_uri': 'statsd://localhost:9999',
+            'slowlog_stats_interval': '15'})
+        self._call(config)
+        reporters = [r for r in _installed if isinstance(r, StatsReporter)]
+        for reporter in reporters:
+            uninstall(reporter)
+        self.assertEqual(len(reporters), 1)
+        self.assertEqual(reporters[0].interval, 15.0)
+        self.assertEqual(self.added_tweens, [])
+
     def test_with_both_enabled(self):
         config = self._make_config(settings={'framestats': 'true',
                                              'slowlog': 'true'})
         self._call(config)
-        self.assertEqual(self.added_tweens, ['slowlog.tween.SlowLogTween',
-                                             'slowlog.tween.FrameStatsTween'])
+        self.assertEqual(self.added_tweens, ['slowlog.tween.CombinedTween'])
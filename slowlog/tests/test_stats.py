@@ -0,0 +1,70 @@
+"""Tests of slowlog.stats"""
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class TestHistogram(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.stats import Histogram
+        return Histogram
+
+    def test_empty(self):
+        obj = self._class()
+        snapshot = obj.snapshot()
+        self.assertEqual(snapshot['count'], 0)
+        self.assertEqual(snapshot['total'], 0.0)
+        self.assertEqual(snapshot['max'], 0.0)
+        self.assertEqual(len(snapshot['buckets']), len(obj.bounds) + 1)
+        self.assertEqual(snapshot['buckets'][-1], (float('inf'), 0))
+
+    def test_add(self):
+        obj = self._class()
+        obj.add(0.00005)
+        obj.add(0.0001)
+        obj.add(0.002)
+        obj.add(5.0)
+        snapshot = obj.snapshot()
+        self.assertEqual(snapshot['count'], 4)
+        self.assertAlmostEqual(snapshot['total'], 5.00215)
+        self.assertEqual(snapshot['max'], 5.0)
+        buckets = dict(snapshot['buckets'])
+        self.assertEqual(buckets[0.0001], 2)
+        self.assertEqual(buckets[0.003], 1)
+        self.assertEqual(buckets[float('inf')], 1)
+        self.assertEqual(sum(buckets.values()), 4)
+
+
+class TestMonitorStats(unittest.TestCase):
+
+    def test_snapshot(self):
+        from slowlog.stats import MonitorStats
+        obj = MonitorStats()
+        obj.reports = 3
+        obj.errors = 1
+        obj.log.add(0.01)
+        snapshot = obj.snapshot()
+        self.assertEqual(snapshot['reports'], 3)
+        self.assertEqual(snapshot['errors'], 1)
+        self.assertEqual(snapshot['log']['count'], 1)
+        self.assertEqual(snapshot['sweep']['count'], 0)
+        self.assertEqual(sorted(snapshot),
+                         ['errors', 'extract', 'log', 'report', 'reports',
+                          'sweep'])
+
+    def test_reset(self):
+        from slowlog.stats import MonitorStats
+        obj = MonitorStats()
+        obj.reports = 3
+        obj.errors = 1
+        obj.sweep.add(0.01)
+        obj.reset()
+        snapshot = obj.snapshot()
+        self.assertEqual(snapshot['reports'], 0)
+        self.assertEqual(snapshot['errors'], 0)
+        self.assertEqual(snapshot['sweep']['count'], 0)
+        self.assertEqual(snapshot['sweep']['total'], 0.0)
@@ -5,6 +5,8 @@ import sys
 import tempfile
 import time
 
+from slowlog import cputime
+
 try:
     import unittest2 as unittest
 except ImportError:
@@ -20,9 +22,13 @@ class TestFrameStatsTween(unittest.TestCase):
 
     def _make(self, settings=None, handler_error=None):
         self.ops = ops = []
+        slots = self.slots = {}
+        slot_reporters = self.slot_reporters = {}
+        self.handled_slots = handled_slots = []
 
         def dummy_handler(request):
             ops.append(('handle', request))
+            handled_slots.append(dict(slots))
             if handler_error is not None:
                 raise handler_error
             else:
@@ -34,12 +40,27 @@ class TestFrameStatsTween(unittest.TestCase):
                                              'statsd://localhost:9999'}
 
         class DummyMonitor:
+            wake_at = float('inf')
+
+            def __init__(self):
+                self.slots = slots
+                self.slot_reporters = slot_reporters
+
+            def wake(self):
+                ops.append(('wake',))
+
             def add(self, reporter):
                 ops.append(('add', reporter))
 
             def remove(self, reporter):
                 ops.append(('remove', reporter))
 
+            def get_slot_reporter(self, key, slot):
+                entry = self.slot_reporters.get(key)
+                if entry is not None and entry[0] is slot:
+                    return entry[1]
+                return None
+
         obj = self._class(dummy_handler, DummyRegistry())
         obj.get_monitor = DummyMonitor
         return obj
@@ -48,6 +69,7 @@ class TestFrameStatsTween(unittest.TestCase):
         obj = self._make()
         self.assertEqual(obj.timeout, 2.0)
         self.assertEqual(obj.interval, 1.0)
+        self.assertIsNone(obj.aggregator)
 
     def test_ctor_with_custom_settings(self):
         obj = self._make(settings={'framestats_timeout': '2.1',
@@ -56,6 +78,20 @@ class TestFrameStatsTween(unittest.TestCase):
         self.assertEqual(obj.timeout, 2.1)
         self.assertEqual(obj.interval, 0.125)
 
+    def test_ctor_with_flush_interval(self):
+        from slowlog.monitor import _installed
+        from slowlog.monitor import uninstall
+        obj = self._make(settings={'framestats_flush_interval': '10',
+                                   'statsd_uri': 'statsd://localhost:9999'})
+        try:
+            self.assertIsNotNone(obj.aggregator)
+            self.assertEqual(obj.aggregator.interval, 10.0)
+            self.assertIn(obj.aggregator, _installed)
+        finally:
+            uninstall(obj.aggregator)
+        obj(object())
+        self.assertIs(self.ops[0][1].aggregator, obj.aggregator)
+
     def test_call_without_handler_error(self):
         obj = self._make()
         request = object()
@@ -91,6 +127,71 @@ class TestFrameStatsTween(unittest.TestCase):
         self.assertEqual(self.ops[2][0], 'remove')
         self.assertIs(self.ops[0][1], self.ops[2][1])
 
+    def test_call_lazily(self):
+        obj = self._make(settings={'framestats_lazy': 'true',
+                                   'statsd_uri': 'statsd://localhost:9999'})
+        self.assertTrue(obj.lazy)
+        request = object()
+        response = obj(request)
+        self.assertEqual(response, 'ok')
+        self.assertEqual([op[0] for op in self.ops], ['wake', 'handle'])
+        from slowlog.compat import get_ident
+        slots = self.handled_slots[0]
+        self.assertEqual(list(slots.keys()), [(get_ident(), obj)])
+        report_at, start, context = slots[(get_ident(), obj)]
+        self.assertAlmostEqual(report_at - start, 2.0)
+        self.assertIs(context, request)
+        self.assertEqual(self.slots, {})
+
+    def test_call_lazily_with_handler_error(self):
+        obj = self._make(settings={'framestats_lazy': 'true',
+                                   'statsd_uri': 'statsd://localhost:9999'},
+                         handler_error=ValueError('synthetic'))
+        with self.assertRaises(ValueError):
+            obj(object())
+        self.assertEqual(len(self.handled_slots[0]), 1)
+        self.assertEqual(self.slots, {})
+
+    def test_call_lazily_nested(self):
+        obj = self._make(settings={'framestats_lazy': 'true',
+                                   'statsd_uri': 'statsd://localhost:9999'})
+        from slowlog.compat import get_ident
+        outer = (1.0, 0.0, None)
+        self.slots[(get_ident(), obj)] = outer
+        obj(object())
+        self.assertEqual([op[0] for op in self.ops], ['handle'])
+        self.assertIs(self.slots[(get_ident(), obj)], outer)
+
+    def test_make_reporter(self):
+        obj = self._make()
+        reporter = obj.make_reporter(None, 1000.0, 1002.0, 54321)
+        from slowlog.framestats import FrameStatsReporter
+        self.assertIsInstance(reporter, FrameStatsReporter)
+        self.assertEqual(reporter.report_at, 1002.0)
+        self.assertEqual(reporter.ident, 54321)
+        self.assertIs(reporter.client, obj.client)
+
+    def test_call_is_a_barrier(self):
+        from slowlog.exc import walk_stack
+        from slowlog.tween import MonitoredTween
+        obj = self._make()
+        stacks = []
+
+        def handler(request):
+            stacks.append(walk_stack(sys._getframe(), None))
+            return 'ok'
+
+        class DummyRequest:
+            environ = {}
+
+        obj.handler = handler
+        obj(DummyRequest())
+        stack = stacks[0]
+        self.assertIs(stack[0].f_code, handler.__code__)
+        # The walk stops at the tween instead of reaching the test.
+        self.assertIs(stack[-1].f_code, MonitoredTween.__call__.__code__)
+        self.assertEqual(len(stack), 2)
+
 
 class TestSlowLogTween(unittest.TestCase):
 
@@ -101,9 +202,13 @@ class TestSlowLogTween(unittest.TestCase):
 
     def _make(self, settings=None, handler_error=None):
         self.ops = ops = []
+        slots = self.slots = {}
+        slot_reporters = self.slot_reporters = {}
+        self.handled_slots = handled_slots = []
 
         def dummy_handler(request):
             ops.append(('handle', request))
+            handled_slots.append(dict(slots))
             if handler_error is not None:
                 raise handler_error
             else:
@@ -114,12 +219,27 @@ class TestSlowLogTween(unittest.TestCase):
                 self.settings = settings or {}
 
         class DummyMonitor:
+            wake_at = float('inf')
+
+            def __init__(self):
+                self.slots = slots
+                self.slot_reporters = slot_reporters
+
+            def wake(self):
+                ops.append(('wake',))
+
             def add(self, reporter):
                 ops.append(('add', reporter))
 
             def remove(self, reporter):
                 ops.append(('remove', reporter))
 
+            def get_slot_reporter(self, key, slot):
+                entry = self.slot_reporters.get(key)
+                if entry is not None and entry[0] is slot:
+                    return entry[1]
+                return None
+
         obj = self._class(dummy_handler, DummyRegistry())
         obj.get_monitor = DummyMonitor
         return obj
@@ -141,11 +261,81 @@ class TestSlowLogTween(unittest.TestCase):
                                        'slowlog_file': fn})
             self.assertEqual(obj.timeout, 2.1)
             self.assertEqual(obj.interval, 0.125)
+            self.assertEqual(obj.format, 'text')
             self.assertEqual(obj.log.name, 'slowlog')
             self.assertTrue(obj.log.handlers)
         finally:
             os.remove(fn)
 
+    def test_ctor_with_record_rate(self):
+        from slowlog.monitor import _installed
+        from slowlog.monitor import uninstall
+        obj = self._make(settings={'slowlog_record_rate': '5',
+                                   'slowlog_record_depth': '8',
+                                   'slowlog_record_stacks': '100'})
+        try:
+            recorder = obj.recorder
+            self.assertIn(recorder, _installed)
+        finally:
+            uninstall(obj.recorder)
+        self.assertEqual(recorder.interval, 0.2)
+        self.assertEqual(recorder.depth, 8)
+        self.assertEqual(recorder.max_stacks, 100)
+
+    def test_ctor_with_backoff(self):
+        obj = self._make()
+        self.assertIsNone(obj.backoff)
+        obj = self._make(settings={'slowlog_backoff': '2',
+                                   'slowlog_max_interval': '60',
+                                   'slowlog_max_reports': '10'})
+        backoff = obj.backoff
+        self.assertEqual((backoff.factor, backoff.max_interval,
+                          backoff.max_reports), (2.0, 60.0, 10))
+
+    def test_ctor_with_coalesce(self):
+        obj = self._make()
+        self.assertFalse(obj.coalesce)
+        obj = self._make(settings={'slowlog_coalesce': 'true'})
+        self.assertTrue(obj.coalesce)
+        reporter = obj.make_reporter(self._make_request(), time.time(),
+                                     time.time() + 2.0, 1)
+        self.assertIs(reporter.coalesce, obj)
+
+    def test_ctor_with_compact(self):
+        obj = self._make()
+        self.assertFalse(obj.compact)
+        obj = self._make(settings={'slowlog_compact': 'true'})
+        self.assertTrue(obj.compact)
+
+    def test_ctor_with_json_format(self):
+        f = tempfile.NamedTemporaryFile(delete=False)
+        fn = f.name
+        f.close()
+        try:
+            obj = self._make(settings={'slowlog_file': fn,
+                                       'slowlog_format': 'json'})
+            self.assertEqual(obj.format, 'json')
+            fmt = obj.log.handlers[0].formatter
+            self.assertEqual(fmt._fmt, '%(message)s')
+        finally:
+            os.remove(fn)
+
+    def test_ctor_with_queued_file(self):
+        from slowlog.logfile import QueuedHandler
+        f = tempfile.NamedTemporaryFile(delete=False)
+        fn = f.name
+        f.close()
+        try:
+            obj = self._make(settings={'slowlog_file': fn,
+                                       'slowlog_file_queued': 'true',
+                                       'slowlog_file_queue_size': '10'})
+            handler = obj.log.handlers[0]
+            self.assertIsInstance(handler, QueuedHandler)
+            self.assertEqual(handler.queue.maxsize, 10)
+            handler.close()
+        finally:
+            os.remove(fn)
+
     def test_call_without_handler_error(self):
         obj = self._make()
         request = object()
@@ -181,6 +371,300 @@ class TestSlowLogTween(unittest.TestCase):
         self.assertEqual(self.ops[2][0], 'remove')
         self.assertIs(self.ops[0][1], self.ops[2][1])
 
+    def test_call_lazily(self):
+        obj = self._make(settings={'slowlog_lazy': 'true'})
+        self.assertTrue(obj.lazy)
+        request = object()
+        response = obj(request)
+        self.assertEqual(response, 'ok')
+        self.assertEqual([op[0] for op in self.ops], ['wake', 'handle'])
+        from slowlog.compat import get_ident
+        slots = self.handled_slots[0]
+        report_at, start, context = slots[(get_ident(), obj)]
+        self.assertAlmostEqual(report_at - start, 2.0)
+        self.assertIs(context, request)
+        self.assertEqual(self.slots, {})
+
+    def test_call_lazily_in_greenlets(self):
+        # The greenlets of a thread register separate slots.
+        import types
+        from slowlog.compat import get_ident
+
+        class DummyGreenlet(object):
+            parent = object()
+
+        greenlets = [DummyGreenlet(), DummyGreenlet()]
+        module = types.ModuleType('greenlet')
+        module.getcurrent = lambda: greenlets[len(self.handled_slots)]
+        saved = sys.modules.get('greenlet')
+        sys.modules['greenlet'] = module
+        try:
+            obj = self._make(settings={'slowlog_lazy': 'true'})
+            obj(object())
+            obj(object())
+        finally:
+            if saved is None:
+                del sys.modules['greenlet']
+            else:
+                sys.modules['greenlet'] = saved  # pragma no cover
+        self.assertEqual(list(self.handled_slots[0]),
+                         [((get_ident(), greenlets[0]), obj)])
+        self.assertEqual(list(self.handled_slots[1]),
+                         [((get_ident(), greenlets[1]), obj)])
+
+    def test_call_lazily_with_handler_error(self):
+        obj = self._make(settings={'slowlog_lazy': 'true'},
+                         handler_error=ValueError('synthetic'))
+        with self.assertRaises(ValueError):
+            obj(object())
+        self.assertEqual(len(self.handled_slots[0]), 1)
+        self.assertEqual(self.slots, {})
+
+    def _log_to(self, obj):
+        logged = []
+
+        class DummyLogger:
+            def warning(self, msg, *args):
+                logged.append(msg % args)
+
+        obj.log = DummyLogger()
+        return logged
+
+    def _make_request(self):
+        class DummyRequest:
+            method = 'GET'
+            url = 'http://example.com/x'
+            headers = {}
+        return DummyRequest()
+
+    def test_call_logs_summary_of_reported_request(self):
+        class DummyResponse:
+            status = '201 Created'
+
+        def report_handler(request):
+            # Simulate a report by the monitor while the handler runs.
+            self.ops[0][1](time.time())
+            return DummyResponse()
+
+        obj = self._make()
+        obj.handler = report_handler
+        logged = self._log_to(obj)
+        obj(self._make_request())
+        self.assertEqual(len(logged), 2)
+        self.assertIn('Finished after', logged[1])
+        self.assertIn('status: 201 Created; reports: 1', logged[1])
+
+    def test_call_logs_summary_of_reported_request_with_error(self):
+        def report_handler(request):
+            self.ops[0][1](time.time())
+            raise ValueError('synthetic')
+
+        obj = self._make()
+        obj.handler = report_handler
+        logged = self._log_to(obj)
+        with self.assertRaises(ValueError):
+            obj(self._make_request())
+        self.assertIn('status: ValueError; reports: 1', logged[1])
+
+    def test_call_without_summary_of_fast_request(self):
+        obj = self._make()
+        logged = self._log_to(obj)
+        obj(self._make_request())
+        self.assertEqual(logged, [])
+
+    @unittest.skipUnless(cputime.available,
+                         'per-thread CPU clocks unavailable')
+    def test_call_with_cpu(self):
+        obj = self._make(settings={'slowlog_cpu': 'true'})
+        self.assertTrue(obj.cpu)
+        request = self._make_request()
+        request.environ = {}
+        obj(request)
+        cpu_start = request.environ['slowlog.cpu_start']
+        self.assertLessEqual(cpu_start, cputime.thread_time())
+        self.assertEqual(self.ops[0][1].cpu_start, cpu_start)
+
+    def test_call_lazily_logs_summary(self):
+        finished = []
+
+        class DummyReporter(object):
+            report_count = 1
+
+            def finish(self, end_time, status):
+                finished.append(status)
+
+        obj = self._make(settings={'slowlog_lazy': 'true'})
+        from slowlog.compat import get_ident
+        key = (get_ident(), obj)
+
+        def slow_handler(request):
+            # The monitor created a reporter for the slot.
+            self.slot_reporters[key] = (self.slots[key], DummyReporter())
+            return 'ok'
+
+        obj.handler = slow_handler
+        obj(object())
+        self.assertEqual(finished, [None])
+        self.assertEqual(self.slots, {})
+
+    def test_make_reporter(self):
+        obj = self._make()
+        request = object()
+        logger = obj.make_reporter(request, 1000.0, 1002.0, 54321)
+        from slowlog.tween import TweenRequestLogger
+        self.assertIsInstance(logger, TweenRequestLogger)
+        self.assertIs(logger.request, request)
+        self.assertEqual(logger.start, 1000.0)
+        self.assertEqual(logger.report_at, 1002.0)
+        self.assertEqual(logger.ident, 54321)
+
+    def test_call_is_a_barrier(self):
+        from slowlog.exc import walk_stack
+        from slowlog.tween import MonitoredTween
+        obj = self._make()
+        stacks = []
+
+        def handler(request):
+            stacks.append(walk_stack(sys._getframe(), None))
+            return 'ok'
+
+        class DummyRequest:
+            environ = {}
+
+        obj.handler = handler
+        obj(DummyRequest())
+        stack = stacks[0]
+        self.assertIs(stack[0].f_code, handler.__code__)
+        # The walk stops at the tween instead of reaching the test.
+        self.assertIs(stack[-1].f_code, MonitoredTween.__call__.__code__)
+        self.assertEqual(len(stack), 2)
+
+
+class TestCombinedTween(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.tween import CombinedTween
+        return CombinedTween
+
+    def _make(self, settings=None):
+        self.ops = ops = []
+        slots = self.slots = {}
+        slot_reporters = self.slot_reporters = {}
+
+        def dummy_handler(request):
+            ops.append(('handle', request))
+            return 'ok'
+
+        class DummyRegistry:
+            def __init__(self):
+                self.settings = {'statsd_uri': 'statsd://localhost:9999'}
+                self.settings.update(settings or {})
+
+        class DummyMonitor:
+            wake_at = float('inf')
+
+            def __init__(self):
+                self.slots = slots
+                self.slot_reporters = slot_reporters
+
+            def wake(self):
+                ops.append(('wake',))
+
+            def add(self, reporter):
+                ops.append(('add', reporter))
+
+            def remove(self, reporter):
+                ops.append(('remove', reporter))
+
+            def get_slot_reporter(self, key, slot):
+                entry = self.slot_reporters.get(key)
+                if entry is not None and entry[0] is slot:
+                    return entry[1]
+                return None
+
+        obj = self._class(dummy_handler, DummyRegistry())
+        obj.get_monitor = DummyMonitor
+        return obj
+
+    def test_ctor(self):
+        obj = self._make(settings={'slowlog_timeout': '3.0',
+                                   'framestats_timeout': '1.5',
+                                   'slowlog_frames': '20',
+                                   'framestats_frames': '50'})
+        self.assertEqual(obj.timeout, 1.5)
+        self.assertEqual(obj.frame_limit, 50)
+        self.assertFalse(obj.lazy)
+
+    def test_call(self):
+        obj = self._make()
+        request = object()
+        self.assertEqual(obj(request), 'ok')
+        self.assertEqual([op[0] for op in self.ops],
+                         ['add', 'handle', 'remove'])
+        from slowlog.combined import CombinedReporter
+        reporter = self.ops[0][1]
+        self.assertIsInstance(reporter, CombinedReporter)
+        self.assertIs(self.ops[2][1], reporter)
+
+    def test_call_lazily(self):
+        obj = self._make(settings={'slowlog_lazy': 'true'})
+        self.assertEqual(obj(object()), 'ok')
+        self.assertEqual([op[0] for op in self.ops], ['wake', 'handle'])
+        self.assertEqual(self.slots, {})
+
+    def test_make_reporter(self):
+        obj = self._make(settings={'slowlog_timeout': '3.0',
+                                   'framestats_timeout': '1.5'})
+        request = object()
+        reporter = obj.make_reporter(request, 1000.0, 1001.5, 54321)
+        self.assertEqual(reporter.ident, 54321)
+        self.assertEqual(reporter.report_at, 1001.5)
+        logger, stats = reporter.reporters
+        from slowlog.framestats import FrameStatsReporter
+        from slowlog.tween import TweenRequestLogger
+        self.assertIsInstance(logger, TweenRequestLogger)
+        self.assertIs(logger.request, request)
+        self.assertEqual(logger.report_at, 1003.0)
+        self.assertEqual(logger.ident, 54321)
+        self.assertIsInstance(stats, FrameStatsReporter)
+        self.assertEqual(stats.report_at, 1001.5)
+        self.assertEqual(stats.ident, 54321)
+
+    def test_make_reporter_with_coalesce(self):
+        obj = self._make(settings={'slowlog_timeout': '3.0',
+                                   'framestats_timeout': '1.5',
+                                   'slowlog_coalesce': 'true'})
+        reporter = obj.make_reporter(object(), 1000.2, 1001.7, 54321)
+        self.assertIs(reporter.coalesce, obj.slowlog)
+        logger, stats = reporter.reporters
+        self.assertIs(reporter.logger, logger)
+        # The reports are aligned so that requests are due together.
+        self.assertEqual(logger.report_at, 1004.0)
+        self.assertEqual(stats.report_at, 1002.0)
+        self.assertEqual(reporter.report_at, 1002.0)
+
+    def test_call_is_a_barrier(self):
+        from slowlog.exc import walk_stack
+        from slowlog.tween import MonitoredTween
+        obj = self._make()
+        stacks = []
+
+        def handler(request):
+            stacks.append(walk_stack(sys._getframe(), None))
+            return 'ok'
+
+        class DummyRequest:
+            environ = {}
+
+        obj.handler = handler
+        obj(DummyRequest())
+        stack = stacks[0]
+        self.assertIs(stack[0].f_code, handler.__code__)
+        # The walk stops at the tween instead of reaching the test.
+        self.assertIs(stack[-1].f_code, MonitoredTween.__call__.__code__)
+        self.assertEqual(len(stack), 2)
+
 
 class TestTweenRequestLogger(unittest.TestCase):
 
@@ -189,7 +673,8 @@ class TestTweenRequestLogger(unittest.TestCase):
         from slowlog.tween import TweenRequestLogger
         return TweenRequestLogger
 
-    def _make(self, ident=None, method='POST', frame_limit=100):
+    def _make(self, ident=None, method='POST', frame_limit=100,
+              format='text', headers=None):  # @ReservedAssignment
         self.logged = logged = []
 
         class DummyLogger:
@@ -200,14 +685,21 @@ class TestTweenRequestLogger(unittest.TestCase):
             interval = 5.0
             hide_post_vars = ('password', 'HIDEME')
             log = DummyLogger()
+            recorder = None
+            cpu = False
+            backoff = None
+            coalesce = False
+            compact = False
 
             def __init__(self):
                 self.frame_limit = frame_limit
+                self.format = format
 
         class DummyRequest:
             def __init__(self):
                 self.method = method
                 self.url = 'http://example.com/stuff?x=1'
+                self.headers = headers or {}
                 if method == 'POST':
                     self.POST = {'login': 'abc', 'password': '123'}
                 else:
@@ -269,6 +761,203 @@ class TestTweenRequestLogger(unittest.TestCase):
         self.assertIn('POST http://example.com/stuff?x=1', self.logged[0])
         self.assertNotIn('Traceback:', self.logged[0])
 
+    def test_call_with_recorder(self):
+        obj = self._make()
+        stack = (('/app/a.py', 1, 'a', 'x = 1'),)
+        obj.start = 1000.0
+        timelines = []
+
+        class DummyRecorder:
+            def timeline(self, ident, since):
+                timelines.append((ident, since))
+                return [(1000.5, stack)]
+
+        obj.tween.recorder = DummyRecorder()
+        obj(1002.0)
+        obj(1003.0)
+        self.assertEqual(timelines, [(obj.ident, 1000.0)])
+        self.assertIn('timeline:\n  +0.50s 1 sample: stack 0', self.logged[0])
+        self.assertIn('File "/app/a.py", line 1, in a', self.logged[0])
+        self.assertNotIn('timeline:', self.logged[1])
+
+    def test_call_as_json_with_recorder(self):
+        import json
+        obj = self._make(format='json')
+        obj.start = 1000.0
+        stack = (('/app/a.py', 1, 'a', 'x = 1'),)
+
+        class DummyRecorder:
+            def timeline(self, ident, since):
+                return [(1000.5, stack)]
+
+        obj.tween.recorder = DummyRecorder()
+        obj(1002.0)
+        report = json.loads(self.logged[0])
+        self.assertEqual(report['timeline']['samples'], [[0.5, 0]])
+        self.assertEqual(report['timeline']['stacks'][0][0]['name'], 'a')
+
+    def test_report_stack_truncates_to_frame_limit(self):
+        obj = self._make(frame_limit=1)
+        frame = sys._getframe()
+        obj.report_stack(123456789.0, [frame, frame.f_back])
+        self.assertEqual(len(self.logged), 1)
+        self.assertIn('test_report_stack_truncates_to_frame_limit',
+                      self.logged[0])
+        self.assertEqual(self.logged[0].count('File "'), 1)
+
+    def test_call_as_json_with_first_report(self):
+        import json
+        obj = self._make(format='json', headers={'X-Request-Id': 'abc'})
+        obj.start = 123456780.0
+        frame = sys._getframe()
+        obj(123456789.0, frame)
+        self.assertEqual(len(self.logged), 1)
+        self.assertNotIn('\n', self.logged[0])
+        report = json.loads(self.logged[0])
+        self.assertEqual(report['thread'], obj.ident)
+        self.assertEqual(report['request_id'], 'abc')
+        self.assertEqual(report['start'], 123456780.0)
+        self.assertEqual(report['elapsed'], 9.0)
+        self.assertEqual(report['method'], 'POST')
+        self.assertEqual(report['url'], 'http://example.com/stuff?x=1')
+        self.assertEqual(report['post'],
+                         {'login': 'abc', 'password': '<hidden>'})
+        innermost = report['frames'][-1]
+        self.assertEqual(innermost['name'],
+                         'test_call_as_json_with_first_report')
+        self.assertEqual(innermost['file'], __file__.replace('.pyc', '.py'))
+        self.assertEqual(innermost['code'], 'obj(123456789.0, frame)')
+
+    def test_call_as_json_with_subsequent_report(self):
+        import json
+        obj = self._make(format='json', frame_limit=0)
+        obj(123456789.0)
+        obj(123456790.0, sys._getframe())
+        self.assertEqual(len(self.logged), 2)
+        first = json.loads(self.logged[0])
+        second = json.loads(self.logged[1])
+        self.assertIn('post', first)
+        self.assertNotIn('post', second)
+        self.assertTrue(first['request_id'])
+        self.assertEqual(second['request_id'], first['request_id'])
+        self.assertIsNone(second['frames'])
+
+    def test_call_with_backoff(self):
+        from slowlog.monitor import Backoff
+        obj = self._make()
+        obj.tween.backoff = Backoff(factor=2.0, max_reports=3)
+        intervals = []
+        for i in range(3):
+            obj(123456789.0 + i)
+            intervals.append(obj.interval)
+        self.assertEqual(intervals, [10.0, 20.0, None])
+        self.assertEqual(len(self.logged), 3)
+
+    def test_report_group(self):
+        other = self._make(ident=543)
+        obj = self._make(method='GET')
+        other.start = obj.start - 3.0
+        report_time = obj.start + 2.0
+        obj.report_group(report_time, [sys._getframe()], [other])
+        self.assertEqual(len(self.logged), 1)
+        self.assertEqual((obj.report_count, other.report_count), (1, 1))
+        self.assertIn(
+            'same stack in 1 other request:\n'
+            '  thread 543: running for 5.0 secs; '
+            'request: POST http://example.com/stuff?x=1\n'
+            'Traceback:\n', self.logged[0])
+
+    def test_report_group_as_json(self):
+        import json
+        other = self._make(ident=543, headers={'X-Request-Id': 'abc'})
+        obj = self._make(format='json')
+        report_time = other.start + 2.0
+        obj.report_group(report_time, [sys._getframe()], [other])
+        report = json.loads(self.logged[0])
+        self.assertEqual(report['others'], [{
+            'thread': 543,
+            'request_id': 'abc',
+            'elapsed': 2.0,
+            'method': 'POST',
+            'url': 'http://example.com/stuff?x=1',
+        }])
+
+    def test_report_stack_compact(self):
+        obj = self._make()
+        obj.tween.compact = True
+        # The callers of this test stay on the same lines.
+        frame = sys._getframe().f_back
+        outer = [frame, frame.f_back]
+        obj.report_stack(1000.0, outer)
+        obj.report_stack(1001.0, outer)
+        obj.report_stack(1003.0, outer)
+        inner = [sys._getframe()] + outer
+        obj.report_stack(1004.0, inner)
+        self.assertIn('Traceback:\n', self.logged[0])
+        self.assertTrue(self.logged[1].endswith(
+            '\nStack unchanged for 1.0 secs'))
+        self.assertTrue(self.logged[2].endswith(
+            '\nStack unchanged for 3.0 secs'))
+        tb = self.logged[3]
+        self.assertIn('\nTraceback (after 2 unchanged frames):\n', tb)
+        self.assertEqual(tb.count('File "'), 1)
+        self.assertIn('in test_report_stack_compact\n', tb)
+
+    def test_report_stack_compact_as_json(self):
+        import json
+        obj = self._make(format='json')
+        obj.tween.compact = True
+        # The callers of this test stay on the same lines.
+        frame = sys._getframe().f_back
+        outer = [frame, frame.f_back]
+        obj.report_stack(1000.0, outer)
+        obj.report_stack(1002.0, outer)
+        obj.report_stack(1003.0, [sys._getframe()] + outer)
+        reports = [json.loads(line) for line in self.logged]
+        self.assertEqual(len(reports[0]['frames']), 2)
+        self.assertNotIn('common', reports[0])
+        self.assertIsNone(reports[1]['frames'])
+        self.assertEqual(reports[1]['unchanged'], 2.0)
+        self.assertEqual(reports[2]['common'], 2)
+        self.assertEqual(len(reports[2]['frames']), 1)
+
+    def test_report_count(self):
+        obj = self._make()
+        self.assertEqual(obj.report_count, 0)
+        obj(123456789.0)
+        self.assertEqual(obj.report_count, 1)
+
+    @unittest.skipUnless(cputime.available,
+                         'per-thread CPU clocks unavailable')
+    def test_call_with_cpu(self):
+        obj = self._make(frame_limit=0)
+        obj.cpu_start = cputime.thread_time()
+        obj(obj.start + 2.0, sys._getframe())
+        self.assertIn('\ncpu: 0.00 secs; wait: 2.00 secs', self.logged[0])
+
+    def test_finish(self):
+        obj = self._make(method='GET')
+        obj.start = 1000.0
+        obj.report_count = 2
+        obj.finish(1003.25, '200 OK')
+        self.assertEqual(self.logged, [
+            'Thread %s: Started on 1000.0; Finished after 3.2 secs; '
+            'request: GET http://example.com/stuff?x=1; '
+            'status: 200 OK; reports: 2' % obj.ident])
+
+    def test_finish_as_json(self):
+        import json
+        obj = self._make(format='json', headers={'X-Request-Id': 'abc'})
+        obj(1002.0)
+        obj.start = 1000.0
+        obj.finish(1003.25, None)
+        summary = json.loads(self.logged[1])
+        self.assertTrue(summary['finished'])
+        self.assertEqual(summary['request_id'], 'abc')
+        self.assertEqual(summary['elapsed'], 3.25)
+        self.assertIsNone(summary['status'])
+        self.assertEqual(summary['reports'], 1)
+
 
 class TestHidden(unittest.TestCase):
 
@@ -6,6 +6,8 @@ import sys
 import tempfile
 import time
 
+from slowlog import cputime
+
 try:
     import unittest2 as unittest
 except ImportError:
@@ -19,24 +21,44 @@ class TestFrameStatsApp(unittest.TestCase):
         from slowlog.wsgi import FrameStatsApp
         return FrameStatsApp
 
-    def _make(self, app_error=None, statsd_uri='statsd://localhost:9999'):
+    def _make(self, app_error=None, statsd_uri='statsd://localhost:9999',
+              app_iter=None, **kw):
         self.ops = ops = []
+        slots = self.slots = {}
+        slot_reporters = self.slot_reporters = {}
+        self.handled_slots = handled_slots = []
 
         def dummy_app(environ, start_response):
             ops.append(('handle', environ, start_response))
+            handled_slots.append(dict(slots))
             if app_error is not None:
                 raise app_error
             else:
-                return ['ok']
+                return app_iter if app_iter is not None else ['ok']
 
         class DummyMonitor:
+            wake_at = float('inf')
+
+            def __init__(self):
+                self.slots = slots
+                self.slot_reporters = slot_reporters
+
+            def wake(self):
+                ops.append(('wake',))
+
             def add(self, reporter):
                 ops.append(('add', reporter))
 
             def remove(self, reporter):
                 ops.append(('remove', reporter))
 
-        obj = self._class(dummy_app, statsd_uri)
+            def get_slot_reporter(self, key, slot):
+                entry = self.slot_reporters.get(key)
+                if entry is not None and entry[0] is slot:
+                    return entry[1]
+                return None
+
+        obj = self._class(dummy_app, statsd_uri, **kw)
         obj.get_monitor = DummyMonitor
         return obj
 
@@ -44,6 +66,19 @@ class TestFrameStatsApp(unittest.TestCase):
         obj = self._make()
         self.assertEqual(obj.timeout, 2.0)
         self.assertEqual(obj.interval, 1.0)
+        self.assertIsNone(obj.aggregator)
+
+    def test_ctor_with_flush_interval(self):
+        from slowlog.monitor import _installed
+        from slowlog.monitor import uninstall
+        obj = self._make(flush_interval=10.0)
+        try:
+            self.assertEqual(obj.aggregator.interval, 10.0)
+            self.assertIn(obj.aggregator, _installed)
+        finally:
+            uninstall(obj.aggregator)
+        obj({}, object())
+        self.assertIs(self.ops[0][1].aggregator, obj.aggregator)
 
     def test_call_without_app_error(self):
         obj = self._make()
@@ -84,6 +119,52 @@ class TestFrameStatsApp(unittest.TestCase):
         self.assertEqual(self.ops[2][0], 'remove')
         self.assertIs(self.ops[0][1], self.ops[2][1])
 
+    def test_call_lazily(self):
+        obj = self._make(lazy=True)
+        env = {}
+        response = obj(env, object())
+        self.assertEqual(response, ['ok'])
+        self.assertEqual([op[0] for op in self.ops], ['wake', 'handle'])
+        from slowlog.compat import get_ident
+        report_at, start, context = self.handled_slots[0][(get_ident(), obj)]
+        self.assertAlmostEqual(report_at - start, 2.0)
+        self.assertIs(context, env)
+        self.assertEqual(self.slots, {})
+
+    def test_call_lazily_with_app_error(self):
+        obj = self._make(app_error=ValueError('synthetic'), lazy=True)
+        with self.assertRaises(ValueError):
+            obj({}, object())
+        self.assertEqual(len(self.handled_slots[0]), 1)
+        self.assertEqual(self.slots, {})
+
+    def test_make_reporter(self):
+        obj = self._make()
+        reporter = obj.make_reporter({}, 1000.0, 1002.0, 54321)
+        from slowlog.framestats import FrameStatsReporter
+        self.assertIsInstance(reporter, FrameStatsReporter)
+        self.assertEqual(reporter.report_at, 1002.0)
+        self.assertEqual(reporter.ident, 54321)
+        self.assertIsNone(reporter.barrier)
+
+    def test_call_with_streaming_response(self):
+        def generate():
+            yield 'ok'
+
+        app_iter = generate()
+        obj = self._make(app_iter=app_iter)
+        response = obj({}, object())
+        self.assertEqual([op[0] for op in self.ops], ['add', 'handle'])
+        reporter = self.ops[0][1]
+        self.assertIs(reporter.barrier, app_iter.gi_frame)
+        self.assertEqual(list(response), ['ok'])
+        response.close()
+        self.assertEqual(self.ops[2], ('remove', reporter))
+
+
+    def test_call_is_a_barrier(self):
+        from slowlog.exc import barrier_codes
+        self.assertIn(id(self._class.__call__.__code__), barrier_codes)
 
 class Test_make_framestats(unittest.TestCase):
 
@@ -100,6 +181,31 @@ class Test_make_framestats(unittest.TestCase):
         self.assertIs(obj.next_app, dummy_app)
         self.assertEqual(obj.timeout, 2.0)
         self.assertEqual(obj.interval, 0.02)
+        self.assertFalse(obj.lazy)
+
+    def test_lazy(self):
+        def dummy_app(environ, start_response):
+            pass
+
+        obj = self._call(dummy_app, {}, lazy='true',
+                         statsd_uri='statsd://localhost:9999')
+        self.assertTrue(obj.lazy)
+
+    def test_cpu(self):
+        app = self._call(None, {}, statsd_uri='statsd://localhost:9999',
+                         cpu='true')
+        self.assertEqual(app.report_cpu, cputime.available)
+
+    def test_flush_interval(self):
+        from slowlog.monitor import uninstall
+
+        def dummy_app(environ, start_response):
+            pass
+
+        obj = self._call(dummy_app, {}, flush_interval='5',
+                         statsd_uri='statsd://localhost:9999')
+        uninstall(obj.aggregator)
+        self.assertEqual(obj.aggregator.interval, 5.0)
 
 
 class TestSlowLogApp(unittest.TestCase):
@@ -109,23 +215,42 @@ class TestSlowLogApp(unittest.TestCase):
         from slowlog.wsgi import SlowLogApp
         return SlowLogApp
 
-    def _make(self, app_error=None, **kw):
+    def _make(self, app_error=None, app_iter=None, **kw):
         self.ops = ops = []
+        slots = self.slots = {}
+        slot_reporters = self.slot_reporters = {}
+        self.handled_slots = handled_slots = []
 
         def dummy_app(environ, start_response):
             ops.append(('handle', environ, start_response))
+            handled_slots.append(dict(slots))
             if app_error is not None:
                 raise app_error
             else:
-                return ['ok']
+                return app_iter if app_iter is not None else ['ok']
 
         class DummyMonitor:
+            wake_at = float('inf')
+
+            def __init__(self):
+                self.slots = slots
+                self.slot_reporters = slot_reporters
+
+            def wake(self):
+                ops.append(('wake',))
+
             def add(self, reporter):
                 ops.append(('add', reporter))
 
             def remove(self, reporter):
                 ops.append(('remove', reporter))
 
+            def get_slot_reporter(self, key, slot):
+                entry = self.slot_reporters.get(key)
+                if entry is not None and entry[0] is slot:
+                    return entry[1]
+                return None
+
         obj = self._class(dummy_app, **kw)
         obj.get_monitor = DummyMonitor
         return obj
@@ -153,7 +278,10 @@ class TestSlowLogApp(unittest.TestCase):
     def test_call_without_app_error(self):
         obj = self._make()
         env = {}
-        start_response = object()
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started.append(status)
         response = obj(env, start_response)
         self.assertEqual(response, ['ok'])
         self.assertEqual(len(self.ops), 3)
@@ -164,7 +292,9 @@ class TestSlowLogApp(unittest.TestCase):
 
         self.assertEqual(self.ops[1][0], 'handle')
         self.assertIs(self.ops[1][1], env)
-        self.assertIs(self.ops[1][2], start_response)
+        # start_response is wrapped to capture the status.
+        self.ops[1][2]('200 OK', [])
+        self.assertEqual(started, ['200 OK'])
 
         self.assertEqual(self.ops[2][0], 'remove')
         self.assertIs(self.ops[0][1], self.ops[2][1])
@@ -172,7 +302,10 @@ class TestSlowLogApp(unittest.TestCase):
     def test_call_with_app_error(self):
         obj = self._make(app_error=ValueError('synthetic'))
         env = {}
-        start_response = object()
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started.append(status)
         with self.assertRaises(ValueError):
             obj(env, start_response)
 
@@ -184,11 +317,233 @@ class TestSlowLogApp(unittest.TestCase):
 
         self.assertEqual(self.ops[1][0], 'handle')
         self.assertIs(self.ops[1][1], env)
-        self.assertIs(self.ops[1][2], start_response)
+        # start_response is wrapped to capture the status.
+        self.ops[1][2]('200 OK', [])
+        self.assertEqual(started, ['200 OK'])
 
         self.assertEqual(self.ops[2][0], 'remove')
         self.assertIs(self.ops[0][1], self.ops[2][1])
 
+    def test_call_lazily(self):
+        obj = self._make(lazy=True)
+        env = {}
+        response = obj(env, object())
+        self.assertEqual(response, ['ok'])
+        self.assertEqual([op[0] for op in self.ops], ['wake', 'handle'])
+        from slowlog.compat import get_ident
+        report_at, start, context = self.handled_slots[0][(get_ident(), obj)]
+        self.assertAlmostEqual(report_at - start, 2.0)
+        self.assertIs(context, env)
+        self.assertEqual(self.slots, {})
+
+    def test_call_lazily_with_app_error(self):
+        obj = self._make(app_error=ValueError('synthetic'), lazy=True)
+        with self.assertRaises(ValueError):
+            obj({}, object())
+        self.assertEqual(len(self.handled_slots[0]), 1)
+        self.assertEqual(self.slots, {})
+
+    def test_make_reporter(self):
+        obj = self._make()
+        env = {}
+        logger = obj.make_reporter(env, 1000.0, 1002.0, 54321)
+        from slowlog.wsgi import SlowRequestLogger
+        self.assertIsInstance(logger, SlowRequestLogger)
+        self.assertIs(logger.environ, env)
+        self.assertEqual(logger.start, 1000.0)
+        self.assertEqual(logger.report_at, 1002.0)
+        self.assertEqual(logger.ident, 54321)
+        self.assertIsNone(logger.barrier)
+
+    def test_make_reporter_for_streaming_response(self):
+        obj = self._make()
+        barrier = object()
+        logger = obj.make_reporter({'slowlog.barriers': {obj: barrier}},
+                                   1000.0, 1002.0, 54321)
+        self.assertIs(logger.barrier, barrier)
+
+    def test_call_with_streaming_response(self):
+        def generate():
+            yield 'ok'
+
+        app_iter = generate()
+        obj = self._make(app_iter=app_iter)
+        response = obj({}, object())
+        self.assertEqual([op[0] for op in self.ops], ['add', 'handle'])
+        logger = self.ops[0][1]
+        self.assertIs(logger.barrier, app_iter.gi_frame)
+        self.assertIs(iter(response), app_iter)
+        self.assertEqual(list(response), ['ok'])
+        response.close()
+        self.assertEqual(self.ops[2], ('remove', logger))
+        response.close()
+        self.assertEqual(len(self.ops), 3)
+
+    def test_call_with_file_wrapper_response(self):
+        class FileWrapper(object):
+            def __iter__(self):
+                return iter(['ok'])
+
+        app_iter = FileWrapper()
+        obj = self._make(app_iter=app_iter)
+        response = obj({'wsgi.file_wrapper': FileWrapper}, object())
+        self.assertIs(response, app_iter)
+        self.assertEqual([op[0] for op in self.ops],
+                         ['add', 'handle', 'remove'])
+
+    def test_call_with_file_wrapper_function(self):
+        app_iter = iter(['ok'])
+        obj = self._make(app_iter=app_iter)
+        env = {'wsgi.file_wrapper': lambda f, size=None: f}
+        response = obj(env, object())
+        self.assertIsNot(response, app_iter)
+        self.assertEqual([op[0] for op in self.ops], ['add', 'handle'])
+        response.close()
+        self.assertEqual([op[0] for op in self.ops],
+                         ['add', 'handle', 'remove'])
+
+    def test_call_lazily_with_streaming_response(self):
+        closed = []
+
+        class AppIter(object):
+            def __iter__(self):
+                return iter(['ok'])
+
+            def close(self):
+                closed.append(True)
+
+        obj = self._make(app_iter=AppIter(), lazy=True)
+        from slowlog.compat import get_ident
+        key = (get_ident(), obj)
+
+        class DummyReporter(object):
+            barrier = 'unset'
+
+        reporter = DummyReporter()
+        self.slot_reporters[key] = (None, reporter)
+        env = {}
+        response = obj(env, object())
+        self.assertIn(key, self.slots)
+        self.assertEqual(env['slowlog.barriers'], {obj: None})
+        self.assertIsNone(reporter.barrier)
+        self.assertEqual(list(response), ['ok'])
+        response.close()
+        self.assertEqual(closed, [True])
+        self.assertEqual(self.slots, {})
+
+    def _stack(self, lazy):
+        # SlowLogApp over SlowLogApp over a generator app.
+        from slowlog.wsgi import SlowLogApp
+
+        def generate():
+            yield 'ok'
+
+        app_iter = generate()
+        inner = self._make(app_iter=app_iter, lazy=lazy)
+        outer = SlowLogApp(inner, lazy=lazy)
+        outer.get_monitor = inner.get_monitor
+        return outer, inner, app_iter.gi_frame
+
+    def test_call_stacked_with_streaming_response(self):
+        outer, inner, barrier = self._stack(lazy=False)
+        response = outer({}, lambda status, headers, exc_info=None: None)
+        reporters = [op[1] for op in self.ops if op[0] == 'add']
+        self.assertEqual(len(reporters), 2)
+        self.assertIs(reporters[0].app, outer)
+        self.assertIs(reporters[0].barrier, barrier)
+        self.assertIs(reporters[1].app, inner)
+        self.assertIs(reporters[1].barrier, barrier)
+        self.assertIs(response.barrier, barrier)
+        self.assertEqual(list(response), ['ok'])
+        response.close()
+
+    def test_call_lazily_stacked_with_streaming_response(self):
+        outer, inner, barrier = self._stack(lazy=True)
+        env = {}
+        response = outer(env, lambda status, headers, exc_info=None: None)
+        self.assertEqual(env['slowlog.barriers'],
+                         {inner: barrier, outer: barrier})
+        for app in (outer, inner):
+            reporter = app.make_reporter(env, 1000.0, 1002.0, 54321)
+            self.assertIs(reporter.barrier, barrier)
+        response.close()
+        self.assertEqual(self.slots, {})
+
+    def _log_to(self, obj):
+        logged = []
+
+        class DummyLogger:
+            def warning(self, msg, *args):
+                logged.append(msg % args)
+
+        obj.log = DummyLogger()
+        return logged
+
+    def test_call_logs_summary_of_reported_request(self):
+        def report_app(environ, start_response):
+            # Simulate a report by the monitor while the app runs.
+            self.ops[0][1](time.time())
+            start_response('404 Not Found', [])
+            return ['missing']
+
+        obj = self._make()
+        obj.next_app = report_app
+        logged = self._log_to(obj)
+        env = {'REQUEST_METHOD': 'GET', 'wsgi.url_scheme': 'http',
+               'HTTP_HOST': 'example.com', 'PATH_INFO': '/x'}
+        response = obj(env, lambda status, headers, exc_info=None: None)
+        self.assertEqual(response, ['missing'])
+        self.assertEqual(len(logged), 2)
+        self.assertIn('Finished after', logged[1])
+        self.assertIn('status: 404 Not Found; reports: 1', logged[1])
+
+    def test_call_without_summary_of_fast_request(self):
+        obj = self._make()
+        logged = self._log_to(obj)
+        obj({}, lambda status, headers, exc_info=None: None)
+        self.assertEqual(logged, [])
+
+    def test_call_lazily_with_streaming_response_logs_summary(self):
+        def app_iter():
+            yield 'ok'
+
+        obj = self._make(app_iter=app_iter(), lazy=True)
+        from slowlog.compat import get_ident
+        key = (get_ident(), obj)
+
+        class DummyReporter(object):
+            barrier = None
+            report_count = 2
+
+            def finish(self, end_time, status):
+                finished.append(status)
+
+        finished = []
+        response = obj({}, lambda status, headers, exc_info=None: None)
+        # The monitor created a reporter for the slot.
+        self.slot_reporters[key] = (self.slots[key], DummyReporter())
+        self.ops[-1][2]('200 OK', [])
+        self.assertEqual(list(response), ['ok'])
+        self.assertEqual(finished, [])
+        response.close()
+        self.assertEqual(finished, ['200 OK'])
+        self.assertEqual(self.slots, {})
+
+
+    @unittest.skipUnless(cputime.available,
+                         'per-thread CPU clocks unavailable')
+    def test_call_with_cpu(self):
+        obj = self._make(cpu=True)
+        self.assertTrue(obj.cpu)
+        env = {}
+        obj(env, object())
+        cpu_start = env['slowlog.cpu_start']
+        self.assertLessEqual(cpu_start, cputime.thread_time())
+        self.assertEqual(self.ops[0][1].cpu_start, cpu_start)
+
+    def test_call_is_a_barrier(self):
+        from slowlog.exc import barrier_codes
+        self.assertIn(id(self._class.__call__.__code__), barrier_codes)
 
 class Test_make_slowlog(unittest.TestCase):
 
@@ -207,6 +562,256 @@ class Test_make_slowlog(unittest.TestCase):
         self.assertEqual(obj.hide_env, ['HTTP_COOKIE',
                                         'paste.cookies',
                                         'beaker.session'])
+        self.assertFalse(obj.lazy)
+
+    def test_lazy(self):
+        def dummy_app(environ, start_response):
+            pass
+
+        obj = self._call(dummy_app, {}, lazy='yes')
+        self.assertTrue(obj.lazy)
+
+    def test_record_rate(self):
+        from slowlog.monitor import uninstall
+
+        def dummy_app(environ, start_response):
+            pass
+
+        obj = self._call(dummy_app, {}, record_rate='20', record_depth='8',
+                         record_stacks='100')
+        uninstall(obj.recorder)
+        self.assertEqual(obj.recorder.interval, 0.05)
+        self.assertEqual(obj.recorder.depth, 8)
+        self.assertEqual(obj.recorder.max_stacks, 100)
+
+    def test_cpu(self):
+        app = self._call(None, {}, cpu='true')
+        self.assertEqual(app.cpu, cputime.available)
+
+    def test_backoff(self):
+        app = self._call(None, {})
+        self.assertIsNone(app.backoff)
+        app = self._call(None, {}, backoff='1.5', max_interval='30',
+                         max_reports='5')
+        backoff = app.backoff
+        self.assertEqual((backoff.factor, backoff.max_interval,
+                          backoff.max_reports), (1.5, 30.0, 5))
+
+    def test_coalesce(self):
+        app = self._call(None, {})
+        self.assertFalse(app.coalesce)
+        app = self._call(None, {}, coalesce='true')
+        self.assertTrue(app.coalesce)
+        reporter = app.make_reporter({}, 1000.0, 1002.0, 1)
+        self.assertIs(reporter.coalesce, app)
+
+    def test_compact(self):
+        app = self._call(None, {})
+        self.assertFalse(app.compact)
+        app = self._call(None, {}, compact='true')
+        self.assertTrue(app.compact)
+
+    def test_json_format(self):
+
+        def dummy_app(environ, start_response):
+            pass
+
+        obj = self._call(dummy_app, {}, format='json')
+        self.assertEqual(obj.format, 'json')
+
+    def test_queued_file(self):
+        from slowlog.logfile import QueuedHandler
+
+        def dummy_app(environ, start_response):
+            pass
+
+        f = tempfile.NamedTemporaryFile(delete=False)
+        fn = f.name
+        f.close()
+        try:
+            obj = self._call(dummy_app, {}, file=fn, file_queued='true',
+                             file_queue_size='10')
+            handler = obj.log.handlers[0]
+            self.assertIsInstance(handler, QueuedHandler)
+            self.assertEqual(handler.queue.maxsize, 10)
+            handler.close()
+        finally:
+            os.remove(fn)
+
+
+class TestCombinedApp(unittest.TestCase):
+
+    @property
+    def _class(self):
+        from slowlog.wsgi import CombinedApp
+        return CombinedApp
+
+    def _make(self, app_iter=None, lazy=False, coalesce=False):
+        from slowlog.wsgi import FrameStatsApp
+        from slowlog.wsgi import SlowLogApp
+        self.ops = ops = []
+        slots = self.slots = {}
+
+        def dummy_app(environ, start_response):
+            ops.append(('handle', environ, start_response))
+            return app_iter if app_iter is not None else ['ok']
+
+        class DummyMonitor:
+            wake_at = float('inf')
+
+            def __init__(self):
+                self.slots = slots
+                self.slot_reporters = {}
+
+            def wake(self):
+                ops.append(('wake',))
+
+            def add(self, reporter):
+                ops.append(('add', reporter))
+
+            def remove(self, reporter):
+                ops.append(('remove', reporter))
+
+            def get_slot_reporter(self, key, slot):
+                entry = self.slot_reporters.get(key)
+                if entry is not None and entry[0] is slot:
+                    return entry[1]
+                return None
+
+        slowlog = SlowLogApp(None, timeout=3.0, frame_limit=20, lazy=lazy,
+                             coalesce=coalesce)
+        framestats = FrameStatsApp(None, 'statsd://localhost:9999',
+                                   timeout=1.5, frame_limit=50)
+        obj = self._class(dummy_app, slowlog, framestats)
+        obj.get_monitor = DummyMonitor
+        return obj
+
+    def test_ctor(self):
+        obj = self._make()
+        self.assertEqual(obj.timeout, 1.5)
+        self.assertEqual(obj.frame_limit, 50)
+        self.assertFalse(obj.lazy)
+
+    def test_call(self):
+        obj = self._make()
+        self.assertEqual(obj({}, object()), ['ok'])
+        self.assertEqual([op[0] for op in self.ops],
+                         ['add', 'handle', 'remove'])
+        from slowlog.combined import CombinedReporter
+        self.assertIsInstance(self.ops[0][1], CombinedReporter)
+
+    def test_call_with_streaming_response(self):
+        def generate():
+            yield 'ok'
+
+        app_iter = generate()
+        obj = self._make(app_iter=app_iter)
+        response = obj({}, object())
+        reporter = self.ops[0][1]
+        self.assertIs(reporter.barrier, app_iter.gi_frame)
+        response.close()
+        self.assertEqual(self.ops[-1], ('remove', reporter))
+
+    def test_call_lazily(self):
+        obj = self._make(lazy=True)
+        self.assertEqual(obj({}, object()), ['ok'])
+        self.assertEqual([op[0] for op in self.ops], ['wake', 'handle'])
+        self.assertEqual(self.slots, {})
+
+    def test_coalesce_in_monitor(self):
+        import slowlog.monitor
+        from slowlog.monitor import Monitor
+        obj = self._make(coalesce=True)
+        logged = []
+        sent = []
+
+        class DummyLog:
+            def warning(self, msg, *args):
+                logged.append(msg % args)
+
+        class DummyClient:
+            def incr(self, stat, count=1, buf=None):
+                buf.append('x')
+
+            def sendbuf(self, buf):
+                sent.append(buf)
+
+        obj.slowlog.log = DummyLog()
+        obj.framestats.client = DummyClient()
+        monitor = Monitor()
+        for ident in range(3):
+            environ = {'wsgi.url_scheme': 'http', 'SERVER_NAME': 'example',
+                       'SERVER_PORT': '80', 'REQUEST_METHOD': 'GET',
+                       'PATH_INFO': '/%d' % ident}
+            reporter = obj.create_reporter(environ, 1000.1 + ident * 0.3,
+                                           None, ident)
+            self.assertIs(reporter.coalesce, obj.slowlog)
+            monitor.add(reporter)
+        monitor.drain()
+
+        frame = sys._getframe()
+
+        class DummySys:
+            @staticmethod
+            def _current_frames():
+                return {0: frame, 1: frame, 2: frame}
+
+        orig = slowlog.monitor.sys
+        slowlog.monitor.sys = DummySys
+        try:
+            sweeps = []
+            while len(sweeps) < 4:
+                # The monitor wakes up a little late.
+                report_time = monitor.schedule[0][0] + 0.01
+                sweeps.append(report_time)
+                monitor.sweep(report_time)
+        finally:
+            slowlog.monitor.sys = orig
+        self.assertEqual(sweeps, [1002.01, 1003.01, 1004.01, 1005.01])
+        # The framestats parts report every request.
+        self.assertEqual(len(sent), 2 + 3 + 3 + 3)
+        # The logger parts share one report per sweep.
+        self.assertEqual(len(logged), 2)
+        for msg in logged:
+            self.assertIn('same stack in 2 other requests', msg)
+        self.assertEqual(monitor.schedule[0][0], 1006.0)
+
+    def test_make_reporter(self):
+        obj = self._make()
+        env = {}
+        reporter = obj.make_reporter(env, 1000.0, 1001.5, 54321)
+        self.assertEqual(reporter.ident, 54321)
+        self.assertEqual(reporter.report_at, 1001.5)
+        self.assertEqual(reporter.frame_limit, 50)
+        logger, stats = reporter.reporters
+        from slowlog.framestats import FrameStatsReporter
+        from slowlog.wsgi import SlowRequestLogger
+        self.assertIsInstance(logger, SlowRequestLogger)
+        self.assertIs(logger.environ, env)
+        self.assertEqual(logger.report_at, 1003.0)
+        self.assertIsInstance(stats, FrameStatsReporter)
+        self.assertEqual(stats.report_at, 1001.5)
+
+
+class Test_make_combined(unittest.TestCase):
+
+    def _call(self, *args, **kw):
+        from slowlog.wsgi import make_combined
+        return make_combined(*args, **kw)
+
+    def test_it(self):
+        def dummy_app(environ, start_response):
+            pass
+
+        obj = self._call(dummy_app, {}, timeout='3.0',
+                         statsd_uri='statsd://localhost:9999',
+                         framestats_timeout='1.5',
+                         framestats_interval='0.5')
+        self.assertIs(obj.next_app, dummy_app)
+        self.assertEqual(obj.slowlog.timeout, 3.0)
+        self.assertEqual(obj.framestats.timeout, 1.5)
+        self.assertEqual(obj.framestats.interval, 0.5)
+        self.assertEqual(obj.timeout, 1.5)
 
 
 class TestSlowRequestLogger(unittest.TestCase):
@@ -216,7 +821,8 @@ class TestSlowRequestLogger(unittest.TestCase):
         from slowlog.wsgi import SlowRequestLogger
         return SlowRequestLogger
 
-    def _make(self, ident=None, frame_limit=100):
+    def _make(self, ident=None, frame_limit=100,
+              format='text'):  # @ReservedAssignment
         self.logged = logged = []
 
         class DummyLogger:
@@ -227,9 +833,15 @@ class TestSlowRequestLogger(unittest.TestCase):
             interval = 5.0
             hide_env = ('paste.cookies', 'HTTP_COOKIE')
             log = DummyLogger()
+            recorder = None
+            cpu = False
+            backoff = None
+            coalesce = False
+            compact = False
 
             def __init__(self):
                 self.frame_limit = frame_limit
+                self.format = format
 
         app = DummyApp()
         environ = {'REQUEST_METHOD': 'POST',
@@ -252,6 +864,24 @@ class TestSlowRequestLogger(unittest.TestCase):
         obj = self._make(ident=543)
         self.assertEqual(obj.ident, 543)
 
+    def test_ctor_with_greenlet_ident(self):
+        glet = object()
+        obj = self._make(ident=(543, glet))
+        self.assertEqual(obj.ident, 543)
+        self.assertIs(obj.greenlet, glet)
+
+    def test_get_frame(self):
+        obj = self._make(ident=543)
+        frame = sys._getframe()
+        self.assertIs(obj.get_frame(frame), frame)
+
+    def test_get_frame_of_suspended_greenlet(self):
+        class DummyGreenlet(object):
+            gr_frame = sys._getframe()
+
+        obj = self._make(ident=(543, DummyGreenlet()))
+        self.assertIs(obj.get_frame(None), DummyGreenlet.gr_frame)
+
     def test_call_with_first_report(self):
         obj = self._make()
         obj(123456789.0)
@@ -285,6 +915,198 @@ class TestSlowRequestLogger(unittest.TestCase):
         self.assertIn('POST http://example.com/stuff?x=1', self.logged[0])
         self.assertNotIn('Traceback:', self.logged[0])
 
+    def test_call_as_json_with_first_report(self):
+        import json
+        obj = self._make(format='json')
+        obj.environ['HTTP_X_REQUEST_ID'] = 'abc'
+        obj.start = 123456780.0
+        frame = sys._getframe()
+        obj(123456789.0, frame)
+        self.assertEqual(len(self.logged), 1)
+        self.assertNotIn('\n', self.logged[0])
+        report = json.loads(self.logged[0])
+        self.assertEqual(report['thread'], obj.ident)
+        self.assertEqual(report['request_id'], 'abc')
+        self.assertEqual(report['start'], 123456780.0)
+        self.assertEqual(report['elapsed'], 9.0)
+        self.assertEqual(report['method'], 'POST')
+        self.assertEqual(report['url'], 'http://example.com/stuff?x=1')
+        self.assertEqual(report['environ']['paste.cookies'], '<hidden>')
+        innermost = report['frames'][-1]
+        self.assertEqual(innermost['name'],
+                         'test_call_as_json_with_first_report')
+        self.assertEqual(innermost['code'], 'obj(123456789.0, frame)')
+
+    def test_call_with_recorder(self):
+        obj = self._make()
+        obj.start = 1000.0
+        stack = (('/app/a.py', 1, 'a', 'x = 1'),)
+
+        class DummyRecorder:
+            def timeline(self, ident, since):
+                return [(1000.5, stack)]
+
+        obj.app.recorder = DummyRecorder()
+        obj(1002.0)
+        self.assertIn('timeline:\n  +0.50s 1 sample: stack 0', self.logged[0])
+
+    def test_call_as_json_with_recorder(self):
+        import json
+        obj = self._make(format='json')
+        obj.start = 1000.0
+        stack = (('/app/a.py', 1, 'a', 'x = 1'),)
+
+        class DummyRecorder:
+            def timeline(self, ident, since):
+                return [(1000.5, stack)]
+
+        obj.app.recorder = DummyRecorder()
+        obj(1002.0)
+        report = json.loads(self.logged[0])
+        self.assertEqual(report['timeline']['samples'], [[0.5, 0]])
+
+    def test_call_as_json_with_subsequent_report(self):
+        import json
+        obj = self._make(format='json', frame_limit=0)
+        obj(123456789.0)
+        obj(123456790.0, sys._getframe())
+        self.assertEqual(len(self.logged), 2)
+        first = json.loads(self.logged[0])
+        second = json.loads(self.logged[1])
+        self.assertIn('environ', first)
+        self.assertNotIn('environ', second)
+        self.assertTrue(first['request_id'])
+        self.assertEqual(second['request_id'], first['request_id'])
+        self.assertIsNone(second['frames'])
+
+    def test_ctor_with_cpu(self):
+        obj = self._make()
+        self.assertIsNone(obj.cpu_start)
+        obj.app.cpu = True
+        obj.environ['slowlog.cpu_start'] = 1.5
+        obj = self._class(obj.app, obj.environ, obj.start, obj.report_at)
+        self.assertEqual(obj.cpu_start, 1.5)
+
+    def test_details_without_cpu_start(self):
+        obj = self._make()
+        obj.environ['slowlog.cpu_start'] = 1.5
+        env = dict(obj.details())['environ']
+        self.assertNotIn('slowlog.cpu_start', env)
+        self.assertEqual(obj.environ['slowlog.cpu_start'], 1.5)
+
+    @unittest.skipUnless(cputime.available,
+                         'per-thread CPU clocks unavailable')
+    def test_call_with_cpu(self):
+        obj = self._make(frame_limit=0)
+        obj.cpu_start = cputime.thread_time()
+        obj(obj.start + 2.0)
+        # Without a frame, the thread may have finished.
+        self.assertNotIn('cpu:', self.logged[0])
+        obj(obj.start + 2.0, sys._getframe())
+        self.assertIn('\ncpu: 0.00 secs; wait: 2.00 secs', self.logged[1])
+
+    @unittest.skipUnless(cputime.available,
+                         'per-thread CPU clocks unavailable')
+    def test_call_as_json_with_cpu(self):
+        import json
+        obj = self._make(format='json', frame_limit=0)
+        obj.cpu_start = cputime.thread_time()
+        obj(obj.start + 2.0, sys._getframe())
+        report = json.loads(self.logged[0])
+        self.assertAlmostEqual(report['cpu'] + report['wait'], 2.0, 2)
+
+    @unittest.skipUnless(cputime.available,
+                         'per-thread CPU clocks unavailable')
+    def test_finish_with_cpu(self):
+        obj = self._make()
+        obj.cpu_start = cputime.thread_time()
+        obj.report_count = 1
+        obj.finish(obj.start + 3.0, '200 OK')
+        self.assertTrue(self.logged[0].endswith(
+            'reports: 1; cpu: 0.00 secs; wait: 3.00 secs'))
+
+    def test_call_with_backoff(self):
+        from slowlog.monitor import Backoff
+        obj = self._make()
+        obj.app.backoff = Backoff(factor=2.0, max_reports=3)
+        intervals = []
+        for i in range(3):
+            obj(123456789.0 + i)
+            intervals.append(obj.interval)
+        self.assertEqual(intervals, [10.0, 20.0, None])
+        self.assertEqual(len(self.logged), 3)
+
+    def test_report_group(self):
+        other = self._make(ident=543)
+        obj = self._make()
+        other.start = obj.start - 3.0
+        obj.report_group(obj.start + 2.0, [sys._getframe()], [other])
+        self.assertEqual((obj.report_count, other.report_count), (1, 1))
+        self.assertIn(
+            'same stack in 1 other request:\n'
+            '  thread 543: running for 5.0 secs; '
+            'request: POST http://example.com/stuff?x=1\n'
+            'Traceback:\n', self.logged[0])
+
+    def test_report_group_as_json(self):
+        import json
+        other = self._make(ident=543)
+        obj = self._make(format='json')
+        obj.report_group(other.start + 2.0, [sys._getframe()], [other])
+        report = json.loads(self.logged[0])
+        self.assertEqual(len(report['others']), 1)
+        self.assertEqual(report['others'][0]['thread'], 543)
+        self.assertEqual(report['others'][0]['elapsed'], 2.0)
+        self.assertTrue(report['others'][0]['request_id'])
+
+    def test_report_stack_compact(self):
+        obj = self._make()
+        obj.app.compact = True
+        # The callers of this test stay on the same lines.
+        frame = sys._getframe().f_back
+        outer = [frame, frame.f_back]
+        obj.report_stack(1000.0, outer)
+        obj.report_stack(1001.5, outer)
+        obj.report_stack(1002.0, [sys._getframe()] + outer)
+        self.assertIn('Traceback:\n', self.logged[0])
+        self.assertTrue(self.logged[1].endswith(
+            '\nStack unchanged for 1.5 secs'))
+        self.assertIn('Traceback (after 2 unchanged frames):\n',
+                      self.logged[2])
+        self.assertEqual(self.logged[2].count('File "'), 1)
+
+    def test_report_count(self):
+        obj = self._make()
+        self.assertEqual(obj.report_count, 0)
+        obj(123456789.0)
+        obj(123456790.0)
+        self.assertEqual(obj.report_count, 2)
+
+    def test_finish(self):
+        obj = self._make()
+        obj.start = 1000.0
+        obj.report_count = 3
+        obj.finish(1012.5, '200 OK')
+        self.assertEqual(self.logged, [
+            'Thread %s: Started on 1000.0; Finished after 12.5 secs; '
+            'request: POST http://example.com/stuff?x=1; '
+            'status: 200 OK; reports: 3' % obj.ident])
+
+    def test_finish_as_json(self):
+        import json
+        obj = self._make(format='json')
+        obj(1002.0)
+        obj.start = 1000.0
+        obj.finish(1012.5, '500 Internal Server Error')
+        first = json.loads(self.logged[0])
+        summary = json.loads(self.logged[1])
+        self.assertTrue(summary['finished'])
+        self.assertEqual(summary['request_id'], first['request_id'])
+        self.assertEqual(summary['elapsed'], 12.5)
+        self.assertEqual(summary['status'], '500 Internal Server Error')
+        self.assertEqual(summary['reports'], 1)
+        self.assertIsNone(summary['frames'])
+
 
 class TestHidden(unittest.TestCase):
 
@@ -297,6 +1119,24 @@ class TestHidden(unittest.TestCase):
         self.assertEqual(repr(self._class()), '<hidden>')
 
 
+class Test_asbool(unittest.TestCase):
+
+    def _call(self, value):
+        from slowlog.wsgi import asbool
+        return asbool(value)
+
+    def test_strings(self):
+        self.assertTrue(self._call('true'))
+        self.assertTrue(self._call(' On '))
+        self.assertTrue(self._call('1'))
+        self.assertFalse(self._call('false'))
+        self.assertFalse(self._call(''))
+
+    def test_other(self):
+        self.assertTrue(self._call(True))
+        self.assertFalse(self._call(None))
+
+
 class Test_construct_url(unittest.TestCase):
 
     def _call(self, *args, **kw):
@@ -1,17 +1,81 @@
-
 from perfmetrics import statsd_client_from_uri
-from pprint import pformat
-from slowlog.compat import StringIO
-from slowlog.compat import get_ident
-from slowlog.exc import print_stack
+from pyramid.settings import asbool
+from slowlog import cputime
+from slowlog.combined import CombinedReporter
+from slowlog.compat import get_request_ident
+from slowlog.cputime import thread_time
+from slowlog.exc import add_barrier
+from slowlog.flightrecorder import FlightRecorder
+from slowlog.framestats import FrameStatsAggregator
 from slowlog.framestats import FrameStatsReporter
 from slowlog.logfile import make_file_logger
 from slowlog.monitor import get_monitor
+from slowlog.monitor import install
+from slowlog.monitor import make_backoff
+from slowlog.requestlog import Hidden
+from slowlog.requestlog import RequestLogger
 import logging
+import sys
 import time
 
 
-class FrameStatsTween(object):
+class MonitoredTween(object):
+    """Base class of the tweens that register requests with the monitor.
+
+    Subclasses provide create_reporter().
+    """
+    lazy = False
+    summarize = False  # Summarize the requests that reporters reported
+    cpu = False  # Read the CPU clock of the thread at the start
+
+    def __call__(self, request):
+        monitor = self.get_monitor()
+        now = time.time()
+        report_at = now + self.timeout
+        if self.cpu:
+            request.environ['slowlog.cpu_start'] = thread_time()
+        if self.lazy:
+            # Publish a slot; the monitor creates the reporter only if
+            # the request is still running at report_at.
+            key = (get_request_ident(), self)
+            slots = monitor.slots
+            if key in slots:
+                # Nested call (such as a subrequest) in the same thread.
+                return self.handler(request)
+            slot = slots[key] = (report_at, now, request)
+            if report_at < monitor.wake_at:
+                monitor.wake()
+        else:
+            reporter = self.create_reporter(request, now, report_at)
+            monitor.add(reporter)
+
+        status = None
+        try:
+            response = self.handler(request)
+            status = getattr(response, 'status', None)
+            return response
+        except Exception:
+            status = sys.exc_info()[0].__name__
+            raise
+        finally:
+            if self.lazy:
+                reporter = monitor.get_slot_reporter(key, slot)
+                del slots[key]
+            else:
+                monitor.remove(reporter)
+            if (self.summarize and reporter is not None and
+                    reporter.report_count):
+                reporter.finish(time.time(), status)
+
+    def make_reporter(self, request, start, report_at, ident):
+        """Create a reporter for a lazily registered request."""
+        return self.create_reporter(request, start, report_at, ident)
+
+
+add_barrier(MonitoredTween.__call__)
+
+
+class FrameStatsTween(MonitoredTween):
     """Log the Python frames involved in slow requests to statsd.
 
     Increments a counter for each frame currently involved in the request.
@@ -25,98 +89,137 @@ class FrameStatsTween(object):
         self.timeout = float(settings.get('framestats_timeout', 2.0))
         self.interval = float(settings.get('framestats_interval', 1.0))
         self.frame_limit = int(settings.get('framestats_frames', 100))
+        self.lazy = asbool(settings.get('framestats_lazy', False))
+        self.report_cpu = (asbool(settings.get('framestats_cpu', False)) and
+                           cputime.available)
+        flush_interval = float(settings.get('framestats_flush_interval', 0))
+        if flush_interval > 0:
+            self.aggregator = FrameStatsAggregator(self.client, flush_interval)
+            install(self.aggregator)
+        else:
+            self.aggregator = None
         self.get_monitor = get_monitor  # testing hook
 
-    def __call__(self, request):
-        monitor = self.get_monitor()
-        report_at = time.time() + self.timeout
-        __slowlog_barrier__ = True
-        reporter = FrameStatsReporter(self.client, report_at, self.interval,
-                                      self.frame_limit)
-        monitor.add(reporter)
-        try:
-            return self.handler(request)
-        finally:
-            monitor.remove(reporter)
+    def create_reporter(self, _request, _start, report_at, ident=None):
+        """Create the reporter for a request."""
+        return FrameStatsReporter(self.client, report_at, self.interval,
+                                  self.frame_limit, ident,
+                                  aggregator=self.aggregator,
+                                  cpu=self.report_cpu)
 
 
-class SlowLogTween(object):
+class SlowLogTween(MonitoredTween):
     """Log slow requests in a manner similar to Products.LongRequestLogger.
     """
+    summarize = True
+
     def __init__(self, handler, registry):
         self.handler = handler
         settings = registry.settings
         self.timeout = float(settings.get('slowlog_timeout', 2.0))
         self.interval = float(settings.get('slowlog_interval', 1.0))
         self.frame_limit = int(settings.get('slowlog_frames', 100))
+        self.format = settings.get('slowlog_format', 'text')
         logfile = settings.get('slowlog_file')
         if logfile:
-            self.log = make_file_logger(logfile)
+            queued = asbool(settings.get('slowlog_file_queued', False))
+            queue_size = int(settings.get('slowlog_file_queue_size', 1000))
+            self.log = make_file_logger(logfile, queued=queued,
+                                        queue_size=queue_size,
+                                        format=self.format)
         else:
             self.log = logging.getLogger('slowlog')
         default_hide = 'password'
         self.hide_post_vars = settings.get('slowlog_hide_post_vars',
                                            default_hide).split()
+        self.lazy = asbool(settings.get('slowlog_lazy', False))
+        self.cpu = (asbool(settings.get('slowlog_cpu', False)) and
+                    cputime.available)
+        self.backoff = make_backoff(
+            float(settings.get('slowlog_backoff', 1.0)),
+            float(settings.get('slowlog_max_interval', 0)),
+            int(settings.get('slowlog_max_reports', 0)))
+        self.coalesce = asbool(settings.get('slowlog_coalesce', False))
+        self.compact = asbool(settings.get('slowlog_compact', False))
+        record_rate = float(settings.get('slowlog_record_rate', 0))
+        if record_rate > 0:
+            self.recorder = FlightRecorder(
+                record_rate,
+                depth=int(settings.get('slowlog_record_depth', 64)),
+                max_stacks=int(settings.get('slowlog_record_stacks', 10000)),
+                frame_limit=self.frame_limit)
+            install(self.recorder)
+        else:
+            self.recorder = None
         self.get_monitor = get_monitor  # testing hook
 
-    def __call__(self, request):
-        monitor = self.get_monitor()
-        now = time.time()
-        report_at = now + self.timeout
-        __slowlog_barrier__ = True
-        logger = TweenRequestLogger(self, request, now, report_at)
-        monitor.add(logger)
-        try:
-            return self.handler(request)
-        finally:
-            monitor.remove(logger)
+    def create_reporter(self, request, start, report_at, ident=None):
+        """Create the logger for a request."""
+        return TweenRequestLogger(self, request, start, report_at, ident)
+
 
+class CombinedTween(MonitoredTween):
+    """Log slow requests and count their frames with one reporter.
 
-class TweenRequestLogger(object):
+    Used instead of SlowLogTween and FrameStatsTween when both are
+    enabled.  Takes the settings of both tweens, registers one
+    CombinedReporter per request, and walks each stack once for both.
+    """
+    summarize = True
+
+    def __init__(self, handler, registry):
+        self.handler = handler
+        self.slowlog = SlowLogTween(handler, registry)
+        self.framestats = FrameStatsTween(handler, registry)
+        self.timeout = min(self.slowlog.timeout, self.framestats.timeout)
+        self.frame_limit = max(self.slowlog.frame_limit,
+                               self.framestats.frame_limit)
+        self.lazy = self.slowlog.lazy or self.framestats.lazy
+        self.cpu = self.slowlog.cpu
+        self.get_monitor = get_monitor  # testing hook
+
+    def create_reporter(self, request, start, _report_at, ident=None):
+        """Create the combined reporter for a request."""
+        slowlog = self.slowlog
+        framestats = self.framestats
+        return CombinedReporter([
+            TweenRequestLogger(slowlog, request, start,
+                               start + slowlog.timeout, ident),
+            FrameStatsReporter(framestats.client,
+                               start + framestats.timeout,
+                               framestats.interval, framestats.frame_limit,
+                               ident, aggregator=framestats.aggregator,
+                               cpu=framestats.report_cpu),
+        ], self.frame_limit, ident)
+
+
+class TweenRequestLogger(RequestLogger):
     """Logger for a particular request"""
-    logged_first = False
 
     def __init__(self, tween, request, start, report_at, ident=None):
         self.tween = tween
         self.request = request
-        self.start = start
-        self.report_at = report_at
-        if ident is None:
-            ident = get_ident()
-        self.ident = ident
-        self.interval = tween.interval
-
-    def __call__(self, report_time, frame=None):
-        elapsed = report_time - self.start
+        super(TweenRequestLogger, self).__init__(
+            tween, start, report_at, ident)
+
+    @property
+    def environ(self):
+        return self.request.environ
+
+    def method_url(self):
+        request = self.request
+        return request.method, request.url
+
+    def details(self):
         request = self.request
-        lines = ['request: %s %s' % (request.method, request.url)]
-
-        if not self.logged_first:
-            if request.method == 'POST':
-                postdata = {}
-                postdata.update(request.POST)
-                for key in self.tween.hide_post_vars:
-                    if key in postdata:
-                        postdata[key] = Hidden()
-                lines.append('post: %s' % pformat(postdata))
-            self.logged_first = True
-
-        if frame is not None:
-            limit = self.tween.frame_limit
-            if limit > 0:
-                tb = StringIO()
-                tb.write('Traceback:\n')
-                print_stack(frame, limit=limit, file=tb)
-                lines.append(tb.getvalue())
-            del frame
-
-        log = self.tween.log
-        msg = '\n'.join(lines)
-        log.warning("Thread %s: Started on %.1f; "
-                    "Running for %.1f secs; %s",
-                    self.ident, self.start, elapsed, msg)
-
-
-class Hidden(object):
-    def __repr__(self):
-        return '<hidden>'
+        if request.method != 'POST':
+            return []
+        postdata = {}
+        postdata.update(request.POST)
+        for key in self.tween.hide_post_vars:
+            if key in postdata:
+                postdata[key] = Hidden()
+        return [('post', postdata)]
+
+    def read_request_id(self):
+        return self.request.headers.get('X-Request-Id')
@@ -1,46 +1,205 @@
-
 from perfmetrics import statsd_client_from_uri
-from pprint import pformat
-from slowlog.compat import StringIO
-from slowlog.compat import get_ident
+from slowlog import cputime
+from slowlog.combined import CombinedReporter
+from slowlog.compat import get_request_ident
 from slowlog.compat import quote
-from slowlog.exc import print_stack
+from slowlog.cputime import thread_time
+from slowlog.exc import add_barrier
+from slowlog.flightrecorder import FlightRecorder
+from slowlog.framestats import FrameStatsAggregator
 from slowlog.framestats import FrameStatsReporter
 from slowlog.logfile import make_file_logger
 from slowlog.monitor import get_monitor
+from slowlog.monitor import install
+from slowlog.monitor import make_backoff
+from slowlog.requestlog import Hidden
+from slowlog.requestlog import RequestLogger
 import logging
+import sys
 import time
 
 
 default_log = logging.getLogger('slowlog.wsgi')
 
 
-class FrameStatsApp(object):
+class MonitoredApp(object):
+    """Base class of WSGI components that register requests with the monitor.
+
+    The request stays registered until the next app returns or, for a
+    streaming response, until the server closes the app_iter.
+    Subclasses provide create_reporter().
+    """
+    lazy = False
+    summarize = False  # Capture the status for reporters with finish()
+    cpu = False  # Read the CPU clock of the thread at the start
+
+    def __call__(self, environ, start_response):
+        monitor = self.get_monitor()
+        now = time.time()
+        report_at = now + self.timeout
+        if self.cpu:
+            environ['slowlog.cpu_start'] = thread_time()
+        if self.lazy:
+            # Publish a slot; the monitor creates the reporter only if
+            # the request is still running at report_at.
+            key = (get_request_ident(), self)
+            slots = monitor.slots
+            if key in slots:
+                # Nested call in the same thread.
+                return self.next_app(environ, start_response)
+            slot = slots[key] = (report_at, now, environ)
+            if report_at < monitor.wake_at:
+                monitor.wake()
+            reporter = None
+        else:
+            key = slot = None
+            reporter = self.create_reporter(environ, now, report_at)
+            monitor.add(reporter)
+
+        if self.summarize:
+            status = []
+            next_start_response = start_response
+
+            def start_response(status_line, headers, exc_info=None):
+                status.append(status_line)
+                return next_start_response(status_line, headers, exc_info)
+        else:
+            status = None
+
+        args = (monitor, key, slot, reporter, status)
+        streaming = False
+        try:
+            app_iter = self.next_app(environ, start_response)
+            if is_streaming(environ, app_iter):
+                # Keep the request registered while the server iterates,
+                # ending stacks at the frame of a generator app_iter
+                # (or at the barrier of an inner component's app_iter).
+                if isinstance(app_iter, ClosingIterable):
+                    barrier = app_iter.barrier
+                else:
+                    barrier = getattr(app_iter, 'gi_frame', None)
+                if self.lazy:
+                    # Stacked components share the environ, so each
+                    # one keeps its own barrier.
+                    barriers = environ.get('slowlog.barriers')
+                    if barriers is None:
+                        barriers = environ['slowlog.barriers'] = {}
+                    barriers[self] = barrier
+                    entry = monitor.slot_reporters.get(key)
+                    if entry is not None and entry[1] is not None:
+                        entry[1].barrier = barrier
+                else:
+                    reporter.barrier = barrier
+                app_iter = ClosingIterable(app_iter, self.release, args,
+                                           barrier)
+                streaming = True
+        except Exception:
+            if status is not None:
+                status.append(sys.exc_info()[0].__name__)
+            raise
+        finally:
+            if not streaming:
+                self.release(*args)
+        return app_iter
+
+    def release(self, monitor, key, slot, reporter, status):
+        """Unregister a request and summarize it if it was reported."""
+        if key is not None:
+            reporter = monitor.get_slot_reporter(key, slot)
+            del monitor.slots[key]
+        else:
+            monitor.remove(reporter)
+        if (status is not None and reporter is not None and
+                reporter.report_count):
+            reporter.finish(time.time(), status[-1] if status else None)
+
+    def make_reporter(self, environ, start, report_at, ident):
+        """Create a reporter for a lazily registered request."""
+        reporter = self.create_reporter(environ, start, report_at, ident)
+        barriers = environ.get('slowlog.barriers')
+        if barriers is not None:
+            reporter.barrier = barriers.get(self)
+        return reporter
+
+
+add_barrier(MonitoredApp.__call__)
+
+
+def is_streaming(environ, app_iter):
+    """Return true if the server will produce app_iter after __call__.
+
+    Lists and tuples are already complete, and the server may send a
+    wsgi.file_wrapper without Python code, so neither needs tracking.
+    """
+    if isinstance(app_iter, (list, tuple)):
+        return False
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        try:
+            if isinstance(app_iter, file_wrapper):
+                return False
+        except TypeError:
+            # file_wrapper is a function rather than a class.
+            pass
+    return True
+
+
+class ClosingIterable(object):
+    """Wrap an app_iter and call release(*args) when the server closes it.
+
+    __iter__ returns the iterator of the wrapped app_iter, so the server
+    gets chunks directly from the app rather than through this object.
+    barrier is the frame where stacks end while the server iterates;
+    an outer component that receives this object uses it too.
+    """
+
+    def __init__(self, app_iter, release, args, barrier=None):
+        self.app_iter = app_iter
+        self.release = release
+        self.args = args
+        self.barrier = barrier
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        try:
+            close = getattr(self.app_iter, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            release, self.release = self.release, None
+            if release is not None:
+                release(*self.args)
+
+
+class FrameStatsApp(MonitoredApp):
     """WSGI app that logs Python frames involved in slow requests to statsd.
 
     Increments a counter for each frame currently involved in the request.
     Counters for slow code will increase more quickly than fast code.
     """
     def __init__(self, next_app, statsd_uri, timeout=2.0, interval=1.0,
-                 frame_limit=100):
+                 frame_limit=100, lazy=False, flush_interval=0, cpu=False):
         self.next_app = next_app
         self.client = statsd_client_from_uri(statsd_uri)
         self.timeout = timeout
         self.interval = interval
         self.frame_limit = frame_limit
+        self.lazy = lazy
+        self.report_cpu = cpu and cputime.available
+        if flush_interval > 0:
+            self.aggregator = FrameStatsAggregator(self.client, flush_interval)
+            install(self.aggregator)
+        else:
+            self.aggregator = None
         self.get_monitor = get_monitor  # test hook
 
-    def __call__(self, environ, start_response):
-        monitor = self.get_monitor()
-        report_at = time.time() + self.timeout
-        __slowlog_barrier__ = True
-        reporter = FrameStatsReporter(self.client, report_at, self.interval,
-                                      self.frame_limit)
-        monitor.add(reporter)
-        try:
-            return self.next_app(environ, start_response)
-        finally:
-            monitor.remove(reporter)
+    def create_reporter(self, _environ, _start, report_at, ident=None):
+        return FrameStatsReporter(self.client, report_at, self.interval,
+                                  self.frame_limit, ident,
+                                  aggregator=self.aggregator,
+                                  cpu=self.report_cpu)
 
 
 def make_framestats(next_app, _globals, **kw):
@@ -48,38 +207,55 @@ def make_framestats(next_app, _globals, **kw):
     statsd_uri = kw['statsd_uri']
     timeout = float(kw.get('timeout', 2.0))
     interval = float(kw.get('interval', 1.0))
+    lazy = asbool(kw.get('lazy', False))
+    flush_interval = float(kw.get('flush_interval', 0))
+    cpu = asbool(kw.get('cpu', False))
     return FrameStatsApp(next_app, statsd_uri,
-                         timeout=timeout, interval=interval)
+                         timeout=timeout, interval=interval, lazy=lazy,
+                         flush_interval=flush_interval, cpu=cpu)
 
 
-class SlowLogApp(object):
+class SlowLogApp(MonitoredApp):
     """Log slow requests in a manner similar to Products.LongRequestLogger.
     """
+    summarize = True
+
     def __init__(self, next_app, timeout=2.0, interval=1.0, logfile=None,
                  frame_limit=100,
-                 hide_env=('HTTP_COOKIE', 'paste.cookies', 'beaker.session')):
+                 hide_env=('HTTP_COOKIE', 'paste.cookies', 'beaker.session'),
+                 lazy=False, logfile_queued=False, logfile_queue_size=1000,
+                 format='text',  # @ReservedAssignment
+                 record_rate=0, record_depth=64, record_stacks=10000,
+                 cpu=False, backoff=1.0, max_interval=0, max_reports=0,
+                 coalesce=False, compact=False):
         self.next_app = next_app
         self.timeout = timeout
         self.interval = interval
         self.frame_limit = frame_limit
+        self.format = format
         if logfile:
-            self.log = make_file_logger(logfile)
+            self.log = make_file_logger(logfile, queued=logfile_queued,
+                                        queue_size=logfile_queue_size,
+                                        format=format)
         else:
             self.log = logging.getLogger('slowlog')
         self.hide_env = hide_env
+        self.lazy = lazy
+        self.cpu = cpu and cputime.available
+        self.backoff = make_backoff(backoff, max_interval, max_reports)
+        self.coalesce = coalesce
+        self.compact = compact
+        if record_rate > 0:
+            self.recorder = FlightRecorder(record_rate, depth=record_depth,
+                                           max_stacks=record_stacks,
+                                           frame_limit=frame_limit)
+            install(self.recorder)
+        else:
+            self.recorder = None
         self.get_monitor = get_monitor  # test hook
 
-    def __call__(self, environ, start_response):
-        monitor = self.get_monitor()
-        now = time.time()
-        report_at = now + self.timeout
-        __slowlog_barrier__ = True
-        logger = SlowRequestLogger(self, environ, now, report_at)
-        monitor.add(logger)
-        try:
-            return self.next_app(environ, start_response)
-        finally:
-            monitor.remove(logger)
+    def create_reporter(self, environ, start, report_at, ident=None):
+        return SlowRequestLogger(self, environ, start, report_at, ident)
 
 
 def make_slowlog(next_app, _globals, **kw):
@@ -89,55 +265,113 @@ def make_slowlog(next_app, _globals, **kw):
     hide_env = kw.get('hide_env',
                       'HTTP_COOKIE paste.cookies beaker.session').split()
     logfile = kw.get('file')
+    lazy = asbool(kw.get('lazy', False))
+    logfile_queued = asbool(kw.get('file_queued', False))
+    logfile_queue_size = int(kw.get('file_queue_size', 1000))
+    format = kw.get('format', 'text')  # @ReservedAssignment
+    record_rate = float(kw.get('record_rate', 0))
+    record_depth = int(kw.get('record_depth', 64))
+    record_stacks = int(kw.get('record_stacks', 10000))
+    cpu = asbool(kw.get('cpu', False))
+    backoff = float(kw.get('backoff', 1.0))
+    max_interval = float(kw.get('max_interval', 0))
+    max_reports = int(kw.get('max_reports', 0))
+    coalesce = asbool(kw.get('coalesce', False))
+    compact = asbool(kw.get('compact', False))
     return SlowLogApp(next_app, timeout=timeout, interval=interval,
-                      hide_env=hide_env, logfile=logfile)
+                      hide_env=hide_env, logfile=logfile, lazy=lazy,
+                      logfile_queued=logfile_queued,
+                      logfile_queue_size=logfile_queue_size,
+                      format=format, record_rate=record_rate,
+                      record_depth=record_depth, record_stacks=record_stacks,
+                      cpu=cpu, backoff=backoff, max_interval=max_interval,
+                      max_reports=max_reports, coalesce=coalesce,
+                      compact=compact)
+
 
+class CombinedApp(MonitoredApp):
+    """Log slow requests and count their frames with one reporter.
 
-class SlowRequestLogger(object):
+    Use instead of stacking SlowLogApp and FrameStatsApp.  The given
+    SlowLogApp and FrameStatsApp provide the settings; each request
+    registers one CombinedReporter, and each stack is walked once.
+    """
+    summarize = True
+
+    def __init__(self, next_app, slowlog, framestats):
+        self.next_app = next_app
+        self.slowlog = slowlog
+        self.framestats = framestats
+        self.timeout = min(slowlog.timeout, framestats.timeout)
+        self.frame_limit = max(slowlog.frame_limit, framestats.frame_limit)
+        self.lazy = slowlog.lazy or framestats.lazy
+        self.cpu = slowlog.cpu
+        self.get_monitor = get_monitor  # test hook
+
+    def create_reporter(self, environ, start, _report_at, ident=None):
+        slowlog = self.slowlog
+        framestats = self.framestats
+        return CombinedReporter([
+            SlowRequestLogger(slowlog, environ, start,
+                              start + slowlog.timeout, ident),
+            FrameStatsReporter(framestats.client,
+                               start + framestats.timeout,
+                               framestats.interval, framestats.frame_limit,
+                               ident, aggregator=framestats.aggregator,
+                               cpu=framestats.report_cpu),
+        ], self.frame_limit, ident)
+
+
+def make_combined(next_app, _globals, **kw):
+    """Paste entry point for creating a CombinedApp
+
+    Accepts the options of the slowlog filter, statsd_uri, and the
+    other options of the framestats filter prefixed with framestats_.
+    """
+    slowlog_kw = {}
+    framestats_kw = {}
+    for key, value in kw.items():
+        if key.startswith('framestats_'):
+            framestats_kw[key[len('framestats_'):]] = value
+        elif key == 'statsd_uri':
+            framestats_kw[key] = value
+        else:
+            slowlog_kw[key] = value
+    return CombinedApp(next_app,
+                       make_slowlog(None, _globals, **slowlog_kw),
+                       make_framestats(None, _globals, **framestats_kw))
+
+
+class SlowRequestLogger(RequestLogger):
     """Logger for a particular request"""
-    logged_first = False
 
     def __init__(self, app, environ, start, report_at, ident=None):
         self.app = app
         self.environ = environ
-        self.start = start
-        self.report_at = report_at
-        if ident is None:
-            ident = get_ident()
-        self.ident = ident
-        self.interval = app.interval
-
-    def __call__(self, report_time, frame=None):
-        elapsed = report_time - self.start
+        super(SlowRequestLogger, self).__init__(app, start, report_at, ident)
+
+    def method_url(self):
         env = self.environ
-        url = construct_url(env)
-        lines = ['request: %s %s' % (env.get('REQUEST_METHOD'), url)]
-        if not self.logged_first:
-            env = env.copy()
-            for key in self.app.hide_env:
-                if key in env:
-                    env[key] = Hidden()
-            lines.append('environ: %s' % pformat(env))
-            self.logged_first = True
-
-        if frame is not None:
-            limit = self.app.frame_limit
-            if limit > 0:
-                tb = StringIO()
-                tb.write('Traceback:\n')
-                print_stack(frame, limit=limit, file=tb)
-                lines.append(tb.getvalue())
-            del frame
-
-        log = self.app.log
-        log.warning("Thread %s: Started on %.1f; "
-                    "Running for %.1f secs; %s",
-                    self.ident, self.start, elapsed, '\n'.join(lines))
-
-
-class Hidden(object):
-    def __repr__(self):
-        return '<hidden>'
+        return env.get('REQUEST_METHOD'), construct_url(env)
+
+    def details(self):
+        env = self.environ.copy()
+        # The CPU time reading is ours, not part of the request.
+        env.pop('slowlog.cpu_start', None)
+        for key in self.app.hide_env:
+            if key in env:
+                env[key] = Hidden()
+        return [('environ', env)]
+
+    def read_request_id(self):
+        return self.environ.get('HTTP_X_REQUEST_ID')
+
+
+def asbool(value):
+    """Convert a Paste configuration value to a boolean."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 'yes', 'on', 'y', 't', '1')
+    return bool(value)
 
 
 # construct_url is mostly copied from Paste (paste.request).